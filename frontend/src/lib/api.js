@@ -1,3 +1,5 @@
+import { applyPreviewDelta, decodePreviewMesh } from './mesh.js';
+
 /**
  * Fetch OpenAPI schema from server
  * @returns {Promise<Object>}
@@ -143,32 +145,120 @@ export function downloadBlob(blob, filename) {
 }
 
 /**
- * Generate STL from endpoint
+ * Error for a failed generation request, with the message from the server if it gave one
+ * @param {Response} response
+ * @returns {Promise<Error>}
+ */
+async function responseError(response) {
+  const errorText = await response.text().catch(() => 'Model generation failed');
+  // Try to parse JSON error response to extract message
+  try {
+    const errorJson = JSON.parse(errorText);
+    return Object.assign(new Error(errorJson.message || errorText), { code: errorJson.code });
+  } catch {
+    return new Error(errorText || 'Model generation failed');
+  }
+}
+
+/**
+ * Parse a server-sent event
+ * @param {string} text - Lines of the event
+ * @returns {{event: string, data: Object}}
+ */
+function parseEvent(text) {
+  const event = { event: 'message', data: '' };
+  for (const line of text.split('\n')) {
+    const [field, ...rest] = line.split(':');
+    const value = rest.join(':').replace(/^ /, '');
+    if (field === 'event') event.event = value;
+    if (field === 'data') event.data += value;
+  }
+  event.data = event.data ? JSON.parse(event.data) : {};
+  return event;
+}
+
+/**
+ * Request a model as a stream of progress events
+ *
+ * The server sends the phase of the build, the position in the queue and the estimated
+ * seconds remaining until it finishes with the URL of the model.
  * @param {string} endpoint - API endpoint
  * @param {Object} parameters - Parameters object
- * @returns {Promise<{blob: Blob, filename: string}>}
+ * @param {function(Object): void} onProgress - Called with each progress event
+ * @param {Object} headers - Additional request headers
+ * @returns {Promise<{url: string|null, preview_name?: string}>}
  */
-export async function generateSTL(endpoint, parameters) {
+async function followBuild(endpoint, parameters, onProgress, headers) {
   const response = await fetch(endpoint, {
     method: 'POST',
-    headers: { 'Content-Type': 'application/json' },
+    headers: { ...headers, 'Content-Type': 'application/json', Accept: 'text/event-stream' },
     body: JSON.stringify(parameters),
   });
 
   if (!response.ok) {
-    const errorText = await response.text().catch(() => 'Model generation failed');
-    // Try to parse JSON error response to extract message
-    try {
-      const errorJson = JSON.parse(errorText);
-      throw new Error(errorJson.message || errorText);
-    } catch (e) {
-      if (e.message && e.message !== errorText) {
-        throw e; // Re-throw the parsed error
+    throw await responseError(response);
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+
+    buffer += value;
+    let end;
+    while ((end = buffer.indexOf('\n\n')) >= 0) {
+      const event = parseEvent(buffer.slice(0, end));
+      buffer = buffer.slice(end + 2);
+
+      if (event.event === 'progress') {
+        onProgress(event.data);
+      } else if (event.event === 'error') {
+        throw Object.assign(new Error(event.data.message || 'Model generation failed'), { code: event.data.code });
+      } else if (event.event === 'done') {
+        reader.cancel();
+        return event.data;
       }
-      throw new Error(errorText || 'Model generation failed');
     }
   }
 
+  throw new Error('Model generation failed');
+}
+
+/**
+ * Generate STL from endpoint
+ * @param {string} endpoint - API endpoint
+ * @param {Object} parameters - Parameters object
+ * @param {Object} options
+ * @param {function(Object): void} [options.onProgress] - Follow the build with progress events
+ * @param {string} [options.session] - Preview session. A newer request of the same session
+ *   replaces this one, which then fails with the code `build_superseded`
+ * @returns {Promise<{blob: Blob, filename: string, headers: Headers}>}
+ */
+export async function generateSTL(endpoint, parameters, { onProgress = null, session = null } = {}) {
+  let response;
+  let previewName = null;
+  const requestHeaders = session ? { 'X-Preview-Session': session } : {};
+
+  if (onProgress) {
+    const done = await followBuild(endpoint, parameters, onProgress, requestHeaders);
+    previewName = done.preview_name ?? null;
+    // Models that are not cached are sent again by a plain request
+    response = done.url ? await fetch(done.url) : null;
+  }
+
+  if (!response) {
+    response = await fetch(endpoint, {
+      method: 'POST',
+      headers: { ...requestHeaders, 'Content-Type': 'application/json' },
+      body: JSON.stringify(parameters),
+    });
+  }
+
+  if (!response.ok) {
+    throw await responseError(response);
+  }
+
   // Extract filename from Content-Disposition header
   const contentDisposition = response.headers.get('Content-Disposition');
   let filename = null;
@@ -176,8 +266,45 @@ export async function generateSTL(endpoint, parameters) {
     filename = contentDisposition.split('filename=')[1].replace(/"/g, '').trim();
   }
 
+  const headers = new Headers(response.headers);
+  if (previewName) {
+    headers.set('X-Preview-Name', previewName);
+  }
+
   const blob = await response.blob();
-  return { blob, filename };
+  return { blob, filename, headers };
+}
+
+/**
+ * Generate a compact preview mesh from endpoint
+ *
+ * If the previous preview of the same part is given as the base, only the changes from it
+ * are downloaded.
+ * @param {string} endpoint - API endpoint
+ * @param {Object} parameters - Parameters object
+ * @param {Object} options
+ * @param {{name: string, geometry: BufferGeometry}} [options.base] - Previous preview
+ * @param {function(Object): void} [options.onProgress] - Follow the build with progress events
+ * @param {string} [options.session] - Preview session, see generateSTL()
+ * @returns {Promise<{geometry: BufferGeometry, name: string|null, filename: string}>}
+ */
+export async function generatePreviewMesh(endpoint, parameters, { base = null, onProgress = null, session = null } = {}) {
+  const query = new URLSearchParams({ format: 'preview' });
+  if (base?.name) {
+    query.set('base', base.name);
+  }
+
+  const { blob, filename, headers } = await generateSTL(`${endpoint}?${query}`, parameters, { onProgress, session });
+  const buffer = await blob.arrayBuffer();
+  const delta = headers.get('Content-Type')?.startsWith('application/vnd.goews.preview-delta');
+
+  return {
+    geometry: delta ? applyPreviewDelta(base.geometry, buffer) : decodePreviewMesh(buffer),
+    // Name of the mesh on the server, to use as the base of the next preview
+    name: headers.get('X-Preview-Name'),
+    // The filename of the STL the preview is for
+    filename: filename?.replace(/\.preview$/, '.stl'),
+  };
 }
 
 /**
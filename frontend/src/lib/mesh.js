@@ -0,0 +1,155 @@
+import { BufferAttribute, BufferGeometry } from 'three';
+
+const PREVIEW_MAGIC = 'GPRV';
+const PREVIEW_VERSION = 1;
+const PREVIEW_HEADER_SIZE = 40;
+const PREVIEW_NORMALS_FLAG = 1;
+const PREVIEW_WIDE_INDEX_FLAG = 2;
+const PREVIEW_SCALE = 65535;
+
+/**
+ * Round a byte offset up to a 4 byte boundary
+ * @param {number} offset
+ * @returns {number}
+ */
+function align(offset) {
+  return offset + ((4 - (offset % 4)) % 4);
+}
+
+/**
+ * Decode a preview mesh returned with `?format=preview` into a geometry
+ *
+ * See write_preview() in server/mesh.py for the layout.
+ * @param {ArrayBuffer} buffer - Preview mesh
+ * @returns {BufferGeometry} - Indexed geometry, with normals if the mesh has them
+ */
+export function decodePreviewMesh(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== PREVIEW_MAGIC || view.getUint8(4) !== PREVIEW_VERSION) {
+    throw new Error('Not a preview mesh');
+  }
+
+  const flags = view.getUint8(5);
+  const vertexCount = view.getUint32(8, true);
+  const indexCount = view.getUint32(12, true);
+  const low = [0, 1, 2].map((axis) => view.getFloat32(16 + axis * 4, true));
+  const high = [0, 1, 2].map((axis) => view.getFloat32(28 + axis * 4, true));
+  const step = low.map((value, axis) => (high[axis] - value) / PREVIEW_SCALE);
+
+  let offset = PREVIEW_HEADER_SIZE;
+  const quantized = new Uint16Array(buffer, offset, vertexCount * 3);
+  offset = align(offset + quantized.byteLength);
+
+  const positions = new Float32Array(vertexCount * 3);
+  for (let i = 0; i < positions.length; i++) {
+    const axis = i % 3;
+    positions[i] = low[axis] + quantized[i] * step[axis];
+  }
+
+  const IndexArray = flags & PREVIEW_WIDE_INDEX_FLAG ? Uint32Array : Uint16Array;
+  const indices = new IndexArray(buffer, offset, indexCount);
+  offset = align(offset + indices.byteLength);
+
+  const geometry = new BufferGeometry();
+  geometry.setAttribute('position', new BufferAttribute(positions, 3));
+  geometry.setIndex(new BufferAttribute(indices, 1));
+
+  if (flags & PREVIEW_NORMALS_FLAG) {
+    geometry.setAttribute('normal', new BufferAttribute(new Int8Array(buffer, offset, vertexCount * 3), 3, true));
+  }
+
+  return geometry;
+}
+
+const PREVIEW_DELTA_MAGIC = 'GPRD';
+const PREVIEW_DELTA_HEADER_SIZE = 12;
+const PREVIEW_REPLACE_FLAG = 1;
+const PREVIEW_ADDED_RUN = 0xffffffff;
+
+/**
+ * Apply a preview delta returned with `?format=preview&base=<name>` to the geometry of the base
+ *
+ * See preview_delta() in server/mesh.py for the layout. The triangles of the result are in
+ * the same order as the mesh on the server, so it can be the base of the next delta. Only
+ * the vertices the triangles use are kept, so the geometry does not grow with every delta
+ * of a session. Normals are worked out again from the new mesh if the base has them, as
+ * the normals of kept vertices change with the triangles around them.
+ * @param {BufferGeometry} base - Geometry of the mesh named as the base
+ * @param {ArrayBuffer} buffer - Preview delta
+ * @returns {BufferGeometry} - Indexed geometry of the new mesh
+ */
+export function applyPreviewDelta(base, buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== PREVIEW_DELTA_MAGIC || view.getUint8(4) !== PREVIEW_VERSION) {
+    throw new Error('Not a preview delta');
+  }
+
+  const flags = view.getUint8(5);
+  const runCount = view.getUint32(8, true);
+  const runs = new Uint32Array(buffer, PREVIEW_DELTA_HEADER_SIZE, runCount * 2);
+  const added = decodePreviewMesh(buffer.slice(PREVIEW_DELTA_HEADER_SIZE + runs.byteLength));
+
+  if (flags & PREVIEW_REPLACE_FLAG) {
+    return added;
+  }
+
+  const basePositions = base.getAttribute('position').array;
+  const addedPositions = added.getAttribute('position').array;
+  const baseIndices = base.index.array;
+  const addedIndices = added.index.array;
+  const baseVertexCount = basePositions.length / 3;
+
+  let indexCount = 0;
+  for (let run = 0; run < runCount; run++) {
+    indexCount += runs[run * 2 + 1] * 3;
+  }
+
+  // Indices into the base vertices followed by the added ones
+  const joined = new Uint32Array(indexCount);
+  let offset = 0;
+  let addedOffset = 0;
+  for (let run = 0; run < runCount; run++) {
+    const start = runs[run * 2];
+    const count = runs[run * 2 + 1] * 3;
+    if (start === PREVIEW_ADDED_RUN) {
+      for (let i = 0; i < count; i++) {
+        joined[offset + i] = addedIndices[addedOffset + i] + baseVertexCount;
+      }
+      addedOffset += count;
+    } else {
+      joined.set(baseIndices.subarray(start * 3, start * 3 + count), offset);
+    }
+    offset += count;
+  }
+
+  // Number the vertices that are still used in the order they are first used
+  const renumbered = new Int32Array(baseVertexCount + addedPositions.length / 3).fill(-1);
+  let vertexCount = 0;
+  for (let i = 0; i < indexCount; i++) {
+    if (renumbered[joined[i]] < 0) {
+      renumbered[joined[i]] = vertexCount++;
+    }
+  }
+
+  const positions = new Float32Array(vertexCount * 3);
+  const indices = new (vertexCount > 65536 ? Uint32Array : Uint16Array)(indexCount);
+  for (let i = 0; i < indexCount; i++) {
+    const vertex = joined[i];
+    indices[i] = renumbered[vertex];
+    const source = vertex < baseVertexCount ? basePositions : addedPositions;
+    const from = (vertex < baseVertexCount ? vertex : vertex - baseVertexCount) * 3;
+    positions.set(source.subarray(from, from + 3), renumbered[vertex] * 3);
+  }
+
+  const geometry = new BufferGeometry();
+  geometry.setAttribute('position', new BufferAttribute(positions, 3));
+  geometry.setIndex(new BufferAttribute(indices, 1));
+
+  if (base.getAttribute('normal')) {
+    geometry.computeVertexNormals();
+  }
+
+  return geometry;
+}
@@ -0,0 +1,46 @@
+"""
+ZIP bundles of several artifacts
+"""
+
+from collections.abc import Iterable
+import mmap
+from pathlib import Path
+import zipfile
+
+from server import settings
+from server.spool import Spool
+
+
+# Extensions of formats that are compressed already, so deflating them again only costs
+# time
+stored_exts = {"3mf", "zip", "png", "gz", "br", "zst"}
+
+# Size of the pieces entries are compressed and written in
+entry_chunk_bytes = 1024 * 1024
+
+
+def write_zip(entries: Iterable[tuple[str, bytes]]) -> bytes | mmap.mmap:
+    """
+    Write a ZIP file of (name, data) entries
+
+    Each entry is written as soon as the iterable produces it, so a generator can build
+    the next entry after the previous one has been compressed and let go of. Entries in
+    formats compressed already are stored as they are. The file is spooled to disk once
+    it reaches settings.stream_min_bytes.
+    """
+    with Spool(settings.stream_min_bytes) as spool:
+        # The spool cannot seek, so sizes are written after each entry
+        with zipfile.ZipFile(spool, mode="w") as zf:
+            for name, data in entries:
+                # A fixed time so the same entries always give the same file
+                info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+                info.external_attr = 0o644 << 16
+                if Path(name).suffix.lstrip(".") in stored_exts:
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                view = memoryview(data)
+                with zf.open(info, mode="w", force_zip64=len(view) > zipfile.ZIP64_LIMIT) as f:
+                    for offset in range(0, len(view), entry_chunk_bytes):
+                        f.write(view[offset : offset + entry_chunk_bytes])
+        return spool.getvalue()
@@ -0,0 +1,83 @@
+"""
+Cached artifact routes
+"""
+
+import re
+
+from sanic import response
+from sanic.exceptions import NotFound
+from sanic.request import Request
+from sanic_ext import openapi
+
+from server import settings
+from server.api import api_bp
+from server.formats import artifact_response
+from server.openscad import artifact_name_pattern, open_artifact
+
+
+# Media type of each artifact extension in the caches
+artifact_media_types = {
+    "stl": "model/stl",
+    "binstl": "model/stl",
+    "asciistl": "model/stl",
+    "obj": "model/obj",
+    "3mf": "model/3mf",
+    "zip": "application/zip",
+    "png": "image/png",
+    "preview": "application/vnd.goews.preview",
+    "preview-normals": "application/vnd.goews.preview",
+    "preview-delta": "application/vnd.goews.preview-delta",
+}
+
+unsafe_filename_pattern = re.compile(r"[^\w.-]")
+
+
+def cache_control() -> str:
+    """
+    Cache-Control of artifact responses
+
+    Artifact names address the model source, libraries, toolchain, converters and
+    parameters, so a name always refers to the same artifact and clients and proxies may
+    keep it for good. Bad artifacts are retired with a new GOEWS_CACHE_VERSION, which
+    gives them new names.
+    """
+    return f"public, max-age={settings.artifact_max_age}, immutable"
+
+
+def etag_matches(header: str | None, etag: str) -> bool:
+    """Whether an If-None-Match header matches the entity tag."""
+    if header is None:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+@api_bp.route("/artifacts/<name>", methods=["GET", "HEAD"])
+@openapi.summary("Cached artifact")
+@openapi.description(
+    "Download a generated artifact by the name given in the Content-Location of a part "
+    "response. Supports HEAD, conditional requests and single byte ranges so downloads "
+    "can be resumed. Artifacts never change, so responses may be cached for good."
+)
+async def artifact(request: Request, name: str):
+    match = artifact_name_pattern.fullmatch(name)
+    etag = f'"{name}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control()}
+
+    # The entity tag only depends on the name, so this does not need the artifact
+    if match and etag_matches(request.headers.get("if-none-match"), etag):
+        return response.empty(status=304, headers=headers)
+
+    data = await open_artifact(name)
+    if data is None:
+        raise NotFound("Artifact not found. It may have been evicted; request the part again")
+
+    if match["encoding"]:
+        headers["Content-Encoding"] = match["encoding"]
+
+    filename = request.args.get("filename")
+    if filename is not None:
+        filename = unsafe_filename_pattern.sub("_", filename)
+
+    content_type = artifact_media_types.get(match["ext"], "application/octet-stream")
+    return await artifact_response(request, data, content_type, filename, headers)
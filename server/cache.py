@@ -0,0 +1,332 @@
+"""
+Artifact caches for generated models
+"""
+
+import json
+import logging
+import mmap
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from server.locks import FileLock
+
+
+logger = logging.getLogger("cache")
+
+
+class MappedFile(mmap.mmap):
+    """Read-only memory map of a cached artifact that remembers the file it maps."""
+
+    path: Path
+
+
+def map_file(path: Path) -> MappedFile | bytes:
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        mapped = MappedFile(f.fileno(), 0, access=mmap.ACCESS_READ)
+    mapped.path = path
+    return mapped
+
+
+class DiskCache:
+    """
+    Content-addressed artifact store on disk
+
+    Artifacts are stored as `<root>/<key[:2]>/<key>.<ext>` so any process on the host
+    using the same root shares them. Files are written atomically and the modification
+    time is bumped on every hit so the least recently used artifacts are evicted first
+    once the total size goes over `max_bytes`.
+    """
+
+    # Evict down to this fraction of max_bytes so eviction does not run on every put
+    low_watermark = 0.9
+
+    # Temporary files older than this are left over from a crashed worker
+    stale_tmp_age = 3600
+
+    # Other workers write to the same directory without this one seeing it, so the size
+    # is counted again after this fraction of max_bytes has been written here
+    rescan_fraction = 0.05
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = None
+        self.written = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def path(self, key: str, ext: str) -> Path:
+        return self.root / key[:2] / f"{key}.{ext}"
+
+    def get(self, key: str, ext: str) -> bytes | None:
+        if not self.enabled:
+            return None
+
+        path = self.path(key, ext)
+        try:
+            data = self.read(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+
+        self.touch(path)
+        self.hits += 1
+        return data
+
+    def read(self, path: Path) -> bytes:
+        return path.read_bytes()
+
+    def map(self, key: str, ext: str) -> MappedFile | bytes | None:
+        """Map an artifact if it is cached. This is not counted in the statistics."""
+        if not self.enabled:
+            return None
+
+        path = self.path(key, ext)
+        try:
+            data = map_file(path)
+        except FileNotFoundError:
+            return None
+
+        self.touch(path)
+        return data
+
+    def put(self, key: str, ext: str, data: bytes) -> Path | None:
+        if not self.enabled:
+            return None
+
+        path = self.path(key, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file in the same directory and rename it into place so
+        # readers in other workers never see a partial artifact
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        self.written += len(data)
+        if self.size is None or self.written > self.max_bytes * self.rescan_fraction:
+            self.size = self.scan_size()
+            self.written = 0
+        else:
+            self.size += len(data) - replaced
+
+        if self.size > self.max_bytes:
+            self.evict_shared()
+
+        return path
+
+    def touch(self, path: Path):
+        try:
+            os.utime(path)
+        except OSError:
+            # Possibly evicted by another worker in the meantime
+            pass
+
+    def entries(self) -> list[tuple[float, int, Path]]:
+        entries = []
+        now = time.time()
+        for path in self.root.glob("*/*"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.name.startswith("."):
+                if now - stat.st_mtime > self.stale_tmp_age:
+                    path.unlink(missing_ok=True)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def scan_size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict_shared(self):
+        """
+        Evict while holding the eviction lock of the cache directory
+
+        Only one worker evicts at a time, and it counts the size again under the lock so
+        it does not evict what another worker has already made room for.
+        """
+        lock = FileLock(self.root / ".evict.lock", remove=False)
+        if not lock.try_acquire():
+            # Another worker is evicting. Count the size again on the next put
+            self.size = None
+            return
+        try:
+            self.size = self.scan_size()
+            self.written = 0
+            if self.size > self.max_bytes:
+                self.evict()
+        finally:
+            lock.release()
+
+    def evict(self):
+        """Remove least recently used artifacts until under the low watermark."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_watermark
+
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+        logger.info(f"Disk cache evicted down to {total} bytes")
+        self.size = total
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "bytes": self.size if self.size is not None else self.scan_size(),
+            "max_bytes": self.max_bytes,
+        }
+
+
+class SharedCache(DiskCache):
+    """
+    Artifact store in shared memory
+
+    This uses the same layout as DiskCache but is meant to live on a tmpfs such as
+    /dev/shm. Artifacts are returned as read-only memory maps so every worker reading an
+    artifact shares the same pages instead of holding a private copy.
+    """
+
+    def read(self, path: Path) -> MappedFile | bytes:
+        return map_file(path)
+
+    def share(self, key: str, ext: str, data: bytes) -> MappedFile | bytes:
+        """Store an artifact and return the shared copy of it."""
+        path = self.put(key, ext, data)
+        if path is None:
+            return data
+        try:
+            return self.read(path)
+        except FileNotFoundError:
+            # Evicted straight away by another worker
+            return data
+
+
+class FailureCache(DiskCache):
+    """
+    Short lived record of builds that failed
+
+    Failures are kept for `ttl` seconds so repeated requests for parameters that do not
+    build fail straight away instead of running OpenSCAD again. Each failure is a small
+    JSON document stored under the key of the artifact that could not be built.
+    """
+
+    def __init__(self, root: Path, max_bytes: int, ttl: int):
+        super().__init__(root, max_bytes)
+        self.ttl = ttl
+
+    @property
+    def enabled(self) -> bool:
+        return super().enabled and self.ttl > 0
+
+    def remember(self, key: str, failure: dict) -> Path | None:
+        failure = {**failure, "expires": time.time() + self.ttl}
+        return self.put(key, "json", json.dumps(failure).encode())
+
+    def recall(self, key: str) -> dict | None:
+        data = self.get(key, "json")
+        if data is None:
+            return None
+
+        failure = json.loads(data)
+        if failure["expires"] < time.time():
+            self.path(key, "json").unlink(missing_ok=True)
+            self.hits -= 1
+            self.misses += 1
+            return None
+
+        return failure
+
+
+class MemoryCache:
+    """
+    In-process artifact cache bounded by size in bytes
+
+    Eviction uses GreedyDual-Size: each entry has a priority of `clock + cost / size`
+    which is refreshed on every hit, and the entry with the lowest priority is evicted
+    first, advancing the clock to its priority. Small artifacts that were expensive to
+    produce stay longer than large ones that were cheap, and entries that are no longer
+    used age out as the clock moves past them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: dict[str, tuple[float, float, bytes]] = {}
+        self.clock = 0.0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def priority(self, cost: float, size: int) -> float:
+        return self.clock + cost / max(size, 1)
+
+    def get(self, key: str) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        _, cost, data = entry
+        self.entries[key] = (self.priority(cost, len(data)), cost, data)
+        self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes, cost: float = 1.0):
+        """Store an artifact. `cost` is the time in seconds it took to produce."""
+        if len(data) > self.max_bytes:
+            return
+
+        self.remove(key)
+        self.entries[key] = (self.priority(cost, len(data)), cost, data)
+        self.bytes += len(data)
+
+        while self.bytes > self.max_bytes:
+            victim = min(self.entries, key=lambda name: self.entries[name][0])
+            self.clock = self.entries[victim][0]
+            self.remove(victim)
+            self.evictions += 1
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= len(entry[2])
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,74 @@
+"""
+Compressed variants of artifacts
+
+Artifacts are compressed once when they are cached and the best variant the client
+accepts is served. gzip is always available. Brotli and Zstandard are used if the
+`brotli` and `zstandard` packages are installed.
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compression functions by content coding, in order of preference. Variants are only
+# made once, so the levels favour size over speed.
+encoders = {}
+if brotli is not None:
+    encoders["br"] = lambda data: brotli.compress(data, quality=8)
+if zstandard is not None:
+    encoders["zstd"] = lambda data: zstandard.ZstdCompressor(level=12).compress(data)
+encoders["gzip"] = lambda data: gzip.compress(data, compresslevel=6, mtime=0)
+
+# Artifact extensions worth compressing. 3MF, ZIP and PNG are compressed already.
+compressible_exts = {"stl", "binstl", "asciistl", "obj", "preview", "preview-normals", "preview-delta"}
+
+
+def compress(data, encoding: str) -> bytes:
+    return encoders[encoding](bytes(data))
+
+
+def accepted_encodings(header: str) -> dict[str, float]:
+    """Content codings in an Accept-Encoding header with their quality values."""
+    accepted = {}
+    for item in header.split(","):
+        coding, *options = (part.strip() for part in item.split(";"))
+        if not coding:
+            continue
+        quality = 1.0
+        for option in options:
+            name, _, value = option.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding.lower()] = quality
+    return accepted
+
+
+def negotiate_encoding(header: str | None) -> str | None:
+    """
+    Pick the content coding to send for an Accept-Encoding header
+
+    Returns None when the artifact should be sent as is.
+    """
+    if not header:
+        return None
+
+    accepted = accepted_encodings(header)
+    default = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in encoders:
+        quality = accepted.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
@@ -0,0 +1,428 @@
+"""
+Model formats offered by the part endpoints
+"""
+
+import asyncio
+import fcntl
+import functools
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import Awaitable, Callable, TypeVar
+from urllib.parse import urlencode
+import uuid
+
+from sanic import response
+from sanic.exceptions import BadRequest
+from sanic.request import Request
+
+from server import progress, settings
+from server.api import api_bp
+from server.compression import compressible_exts, negotiate_encoding
+from server.openscad import (
+    BuildSuperseded,
+    OpenSCADError,
+    artifact_name,
+    artifact_name_pattern,
+    export,
+    preview_delta,
+    quality_presets,
+)
+
+
+T = TypeVar("T")
+
+# Media type and file extension of each export format
+export_formats = {
+    "binstl": ("model/stl", "stl"),
+    "asciistl": ("model/stl", "stl"),
+    "obj": ("model/obj", "obj"),
+    "3mf": ("model/3mf", "3mf"),
+    "preview": ("application/vnd.goews.preview", "preview"),
+    "preview-normals": ("application/vnd.goews.preview", "preview"),
+}
+
+# Formats that can be sent as changes to a mesh the client has, with `?base=<name>`
+delta_formats = {"preview", "preview-normals"}
+delta_content_type = "application/vnd.goews.preview-delta"
+
+# Seconds between progress events while nothing changes, so the estimate counts down
+progress_interval = 1.0
+
+# Seconds between checks of whether a newer request of a client session came in. See
+# superseding()
+session_poll_interval = 0.1
+
+# Session files stay in place when a request ends, so an older request still sees it was
+# replaced. Files older than this many seconds are removed
+session_max_age = 3600
+next_session_prune = 0.0
+
+# Lock taken by every worker to update session files
+session_lock_name = ".lock"
+
+# Size of the chunks large artifacts are sent in
+stream_chunk_bytes = 256 * 1024
+
+# Names accepted by the `format` query parameter
+query_formats = {
+    "stl": "binstl",
+    "binstl": "binstl",
+    "asciistl": "asciistl",
+    "obj": "obj",
+    "3mf": "3mf",
+    "preview": "preview",
+    "preview-normals": "preview-normals",
+}
+
+# Media types accepted in the Accept header, in order of preference when the client
+# accepts several equally
+accept_formats = {
+    "model/stl": "binstl",
+    "model/x.stl-binary": "binstl",
+    "model/x.stl-ascii": "asciistl",
+    "model/3mf": "3mf",
+    "application/vnd.ms-package.3dmanufacturing-3dmodel+xml": "3mf",
+    "model/obj": "obj",
+}
+
+
+def negotiate_format(request: Request) -> str:
+    """
+    Pick the export format for a request
+
+    The `format` query parameter takes precedence over the Accept header. Binary STL is
+    used when neither asks for anything we have.
+    """
+    name = request.args.get("format")
+    if name is not None:
+        if name not in query_formats:
+            raise BadRequest(f"Unknown format {name}. Use one of {', '.join(query_formats)}")
+        return query_formats[name]
+
+    match = request.accept.match(*accept_formats)
+    return accept_formats[match.mime] if match else "binstl"
+
+
+def negotiate_quality(request: Request, export_format: str) -> str:
+    """
+    Pick the build quality for a request
+
+    The `quality` query parameter picks one of openscad.quality_presets. Preview meshes
+    are built at preview quality and everything else at standard quality otherwise.
+    """
+    name = request.args.get("quality")
+    if name is not None:
+        if name not in quality_presets:
+            raise BadRequest(f"Unknown quality {name}. Use one of {', '.join(quality_presets)}")
+        return name
+    return "preview" if export_format in delta_formats else "standard"
+
+
+async def model_response(request: Request, filename: str, model_file: str, **params):
+    """Build a model in the format the client asked for and return it as a download."""
+    return await exported_response(request, filename, functools.partial(export, model_file, **params))
+
+
+async def exported_response(request: Request, filename: str, exporter: Callable[..., Awaitable[bytes]]):
+    """
+    Return what `exporter` produces for the negotiated format as a download
+
+    `exporter` is given the format, the content coding to compress it with, if any, and
+    the build quality. Preview meshes are sent as changes to the mesh named by the
+    `base` query parameter if it is given. See openscad.preview_delta().
+    """
+    export_format = negotiate_format(request)
+    quality = negotiate_quality(request, export_format)
+    content_type, ext = export_formats[export_format]
+    filename = Path(filename).with_suffix(f".{ext}").name
+
+    encoding = None
+    if ext in compressible_exts:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+
+    base = request.args.get("base")
+    if base is not None:
+        match = artifact_name_pattern.fullmatch(base)
+        if export_format not in delta_formats or not match or match["ext"] != export_format:
+            raise BadRequest("base must be the name of a preview mesh in the requested format")
+        content_type = delta_content_type
+
+    async def produce():
+        if base is None:
+            data = await exporter(export_format, encoding=encoding, quality=quality)
+            mesh_data = data
+        else:
+            # The delta is worked out from the uncompressed mesh
+            mesh_data = await exporter(export_format, quality=quality)
+            data = await preview_delta(base, mesh_data, encoding=encoding)
+
+        # Name of the mesh to give as the base of the next delta
+        name = artifact_name(mesh_data)
+        if export_format in delta_formats and name is not None:
+            headers["X-Preview-Name"] = f"{name[:64]}.{export_format}"
+        return data
+
+    # Only previews are replaced. Downloads of the same session carry on
+    session = request.headers.get("x-preview-session") if export_format in delta_formats else None
+    production = superseding(session, produce())
+    if any(media.mime == "text/event-stream" for media in request.accept):
+        return await progress_response(request, production, filename, headers)
+    return await artifact_response(request, await production, content_type, filename, headers)
+
+
+def session_path(session: str) -> Path:
+    """File holding the token of the latest request of a client session."""
+    return settings.cache_dir / "sessions" / hashlib.sha256(session.encode()).hexdigest()
+
+
+def prune_sessions(directory: Path):
+    now = time.time()
+    for path in directory.iterdir():
+        if path.name == session_lock_name:
+            continue
+        try:
+            if now - path.stat().st_mtime > session_max_age:
+                path.unlink(missing_ok=True)
+        except FileNotFoundError:
+            pass
+
+
+def session_token(arrival_ns: int) -> str:
+    """Token of a request that arrived at `arrival_ns`, which sorts after those of earlier requests."""
+    return f"{arrival_ns:020d}-{uuid.uuid4().hex}"
+
+
+def start_session_request(session: str, token: str) -> os.stat_result | None:
+    """
+    Make the request with `token` the latest of its session
+
+    Requests are ordered by their tokens, so a request that arrived earlier but gets here
+    later does not replace a newer one. Returns the status of the session file as written,
+    or None if a newer request is the latest already.
+    """
+    global next_session_prune
+
+    path = session_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if time.monotonic() >= next_session_prune:
+        next_session_prune = time.monotonic() + session_max_age / 10
+        prune_sessions(path.parent)
+
+    with open(path.parent / session_lock_name, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        latest = latest_session_request(session)
+        if latest is not None and latest > token:
+            return None
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".", suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+        return os.stat(path)
+
+
+def latest_session_request(session: str) -> str | None:
+    try:
+        return session_path(session).read_text()
+    except FileNotFoundError:
+        return None
+
+
+def session_replaced(session: str, token: str, written: os.stat_result) -> bool:
+    """
+    Whether a newer request replaced the one with `token` as the latest of its session
+
+    The file is only read once it is no longer the one written for `token`, so this is
+    cheap enough to check from the event loop.
+    """
+    try:
+        current = os.stat(session_path(session))
+    except FileNotFoundError:
+        return False
+    if (current.st_ino, current.st_mtime_ns) == (written.st_ino, written.st_mtime_ns):
+        return False
+    latest = latest_session_request(session)
+    return latest is not None and latest > token
+
+
+async def superseding(session: str | None, production: Awaitable[T]) -> T:
+    """
+    Await `production` until a newer request of the same client session comes in
+
+    Clients send the session in the X-Preview-Session header so a newer preview replaces
+    one still being built. The latest request of each session is kept in a file under
+    settings.cache_dir so it is seen by every worker on the host, and waiting requests
+    check it every `session_poll_interval` seconds. Requests are ordered by when they
+    arrived. The replaced request fails with BuildSuperseded and stops waiting, which
+    stops its builds unless other requests are waiting for them too.
+    """
+    if session is None:
+        return await production
+
+    token = session_token(time.time_ns())
+    task = asyncio.ensure_future(production)
+    try:
+        written = await asyncio.to_thread(start_session_request, session, token)
+        while written is not None:
+            await asyncio.wait({task}, timeout=session_poll_interval)
+            if task.done():
+                return task.result()
+            if session_replaced(session, token, written):
+                break
+        raise BuildSuperseded("A newer preview was requested")
+    finally:
+        task.cancel()
+
+
+def server_sent_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def progress_response(request: Request, production: Awaitable, filename: str, headers: dict):
+    """
+    Follow the production of an artifact as a stream of server-sent events
+
+    `progress` events have the phase of the build, the position in the queue while it
+    waits and the estimated seconds remaining. They are sent on every change and at
+    least every `progress_interval` seconds. The stream ends with a `done` event with the
+    URL of the artifact, or an `error` event if it could not be produced.
+    """
+    follower = progress.Progress()
+    token = progress.current.set(follower)
+    try:
+        task = asyncio.ensure_future(production)
+    finally:
+        progress.current.reset(token)
+
+    try:
+        stream = await request.respond(content_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+        while not task.done():
+            await stream.send(server_sent_event("progress", follower.snapshot()))
+            changed = asyncio.ensure_future(follower.wait(progress_interval))
+            await asyncio.wait({task, changed}, return_when=asyncio.FIRST_COMPLETED)
+            changed.cancel()
+
+        try:
+            data = task.result()
+        except OpenSCADError as error:
+            await stream.send(server_sent_event("error", {"code": error.code, "message": str(error)}))
+        else:
+            done = {"url": artifact_location(data, filename)}
+            if "X-Preview-Name" in headers:
+                done["preview_name"] = headers["X-Preview-Name"]
+            await stream.send(server_sent_event("done", done))
+        await stream.eof()
+        return stream
+    finally:
+        # The build carries on for any other request waiting for it
+        task.cancel()
+
+
+def byte_range(header: str | None, total: int) -> tuple[int, int] | None:
+    """
+    Start and end, exclusive, of the range asked for in a Range header
+
+    Returns None to send the whole artifact when there is no range or it is not one we
+    support, such as several ranges at once. Ranges starting past the end are returned
+    as they are so the caller can refuse them.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, dash, last = spec.strip().partition("-")
+    if not dash:
+        return None
+    try:
+        if not first:
+            # The last bytes of the artifact. A suffix of 0 cannot be satisfied
+            suffix = int(last)
+            return (max(total - suffix, 0) if suffix else total), total
+        start = int(first)
+        end = int(last) + 1 if last else total
+    except ValueError:
+        return None
+    if last and end <= start:
+        return None
+    return start, min(end, total)
+
+
+def artifact_location(data, filename: str | None = None) -> str | None:
+    """URL an artifact can be fetched from for as long as it stays cached, if it is cached."""
+    name = artifact_name(data)
+    if name is None:
+        return None
+    location = f"{api_bp.url_prefix}/artifacts/{name}"
+    if filename is not None:
+        location += "?" + urlencode({"filename": filename})
+    return location
+
+
+async def artifact_response(
+    request: Request,
+    data,
+    content_type: str,
+    filename: str | None = None,
+    headers: dict | None = None,
+):
+    """
+    Send an artifact
+
+    GET and HEAD requests may ask for a single byte range so interrupted downloads can
+    be resumed. Responses to POST requests point to where the artifact can be fetched
+    that way, if it is cached, and redirect there instead with `?redirect=true`.
+    Artifacts of at least settings.stream_min_bytes are sent in chunks straight from the
+    cached copy rather than copied into a single response body.
+    """
+    headers = dict(headers or {})
+    if filename is not None:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    total = len(data)
+    start, end, status = 0, total, 200
+    if request.method == "POST":
+        location = artifact_location(data, filename)
+        if location is not None:
+            if request.args.get("redirect", "").lower() in ("1", "true"):
+                return response.redirect(location, status=303)
+            headers["Content-Location"] = location
+    else:
+        headers["Accept-Ranges"] = "bytes"
+        # A range of a different artifact than the client has would corrupt its copy
+        if_range = request.headers.get("if-range")
+        requested = None
+        if if_range is None or if_range == headers.get("ETag"):
+            requested = byte_range(request.headers.get("range"), total)
+        if requested is not None:
+            start, end = requested
+            if start >= end:
+                return response.raw(b"", status=416, headers={**headers, "Content-Range": f"bytes */{total}"})
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{total}"
+
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(end - start)
+        return response.raw(b"", status=status, content_type=content_type, headers=headers)
+
+    view = memoryview(data)[start:end]
+    if len(view) < settings.stream_min_bytes:
+        return response.raw(bytes(view), status=status, content_type=content_type, headers=headers)
+
+    stream = await request.respond(
+        status=status,
+        content_type=content_type,
+        headers={**headers, "Content-Length": str(len(view))},
+    )
+    for offset in range(0, len(view), stream_chunk_bytes):
+        await stream.send(view[offset : offset + stream_chunk_bytes])
+    await stream.eof()
+    return stream
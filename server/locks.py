@@ -0,0 +1,279 @@
+"""
+Locks shared by every worker on the host
+"""
+
+import asyncio
+from collections.abc import Callable
+from contextlib import asynccontextmanager
+import fcntl
+import heapq
+import itertools
+import os
+from pathlib import Path
+import time
+import uuid
+
+
+class FileLock:
+    """
+    Exclusive lock on a file
+
+    Waiting polls with a non-blocking flock() so it does not tie up the event loop or a
+    thread. The lock is released by the kernel if the process dies. The lock file is
+    removed on release unless `remove` is false.
+    """
+
+    poll_interval = 0.05
+    max_poll_interval = 0.5
+
+    def __init__(self, path: Path, remove: bool = True):
+        self.path = Path(path)
+        self.remove = remove
+        self.fd = None
+
+    @property
+    def locked(self) -> bool:
+        return self.fd is not None
+
+    def try_acquire(self) -> bool:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+
+        if not self.remove:
+            self.fd = fd
+            return True
+
+        # The previous holder may have removed the file after we opened it, in which
+        # case we hold a lock nobody else can see
+        try:
+            current = os.stat(self.path)
+        except FileNotFoundError:
+            current = None
+        if current is None or current.st_ino != os.fstat(fd).st_ino:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        return True
+
+    async def acquire(self):
+        interval = self.poll_interval
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+    def release(self):
+        if self.fd is None:
+            return
+        if self.remove:
+            self.path.unlink(missing_ok=True)
+        fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+
+class HostSemaphore:
+    """
+    Counting semaphore shared by every process on the host
+
+    Each of the `value` slots is a lock file in `directory`, so processes using the same
+    directory share the budget however many of them there are.
+
+    Local waiters are served lowest priority first, with only the first in line polling
+    for a free slot. Every second spent waiting lowers a waiter's priority by `aging` so
+    waiters with a high priority are not starved.
+    """
+
+    def __init__(self, directory: Path, value: int, aging: float = 1.0):
+        self.directory = Path(directory)
+        self.slots = [FileLock(self.directory / f"slot-{i}.lock", remove=False) for i in range(value)]
+        self.aging = aging
+        # Heap of [priority + aging * enqueue time, sequence, wake event]
+        self.queue = []
+        self.sequence = itertools.count()
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def value(self) -> int:
+        return len(self.slots)
+
+    @property
+    def in_use(self) -> int:
+        """Slots held by this process."""
+        return sum(1 for slot in self.slots if slot.locked)
+
+    @property
+    def waiting(self) -> int:
+        return len(self.queue)
+
+    def others_held(self, index: int) -> bool:
+        """
+        Whether any slot but `index` is held by any process on the host
+
+        Slots are probed with a non-blocking flock() on a separate descriptor, which
+        fails while another descriptor holds the lock, including ones in this process.
+        """
+        for other, slot in enumerate(self.slots):
+            if other == index:
+                continue
+            if slot.locked:
+                return True
+            try:
+                fd = os.open(slot.path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            finally:
+                # Closing the descriptor also releases the probe's lock
+                os.close(fd)
+        return False
+
+    def try_acquire(self) -> int | None:
+        for index, slot in enumerate(self.slots):
+            if not slot.locked and slot.try_acquire():
+                return index
+        return None
+
+    def wake_first(self):
+        if self.queue:
+            self.queue[0][2].set()
+
+    async def acquire(self, priority: float = 0.0, on_position: Callable[[int], None] | None = None) -> int:
+        """
+        Wait for a free slot and return its index
+
+        `on_position` is given the number of local waiters ahead when this one joins the
+        queue and again when it gets to the front.
+        """
+        start = time.monotonic()
+        wake = asyncio.Event()
+        entry = [priority + self.aging * start, next(self.sequence), wake]
+        heapq.heappush(self.queue, entry)
+        if on_position is not None:
+            on_position(sum(1 for other in self.queue if other < entry))
+
+        try:
+            interval = FileLock.poll_interval
+            first = False
+            while True:
+                if self.queue[0] is entry:
+                    if not first and on_position is not None:
+                        on_position(0)
+                    first = True
+                    if (index := self.try_acquire()) is not None:
+                        break
+                    wake.clear()
+                    try:
+                        await asyncio.wait_for(wake.wait(), interval)
+                    except TimeoutError:
+                        interval = min(interval * 2, FileLock.max_poll_interval)
+                else:
+                    # Sleep until this waiter is first in line
+                    wake.clear()
+                    await wake.wait()
+                    interval = FileLock.poll_interval
+        finally:
+            self.queue.remove(entry)
+            heapq.heapify(self.queue)
+            self.wake_first()
+
+        wait = time.monotonic() - start
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        return index
+
+    def release(self, index: int):
+        self.slots[index].release()
+        self.wake_first()
+
+    @asynccontextmanager
+    async def slot(self, priority: float = 0.0, on_position: Callable[[int], None] | None = None):
+        index = await self.acquire(priority, on_position)
+        try:
+            yield index
+        finally:
+            self.release(index)
+
+    def stats(self) -> dict:
+        return {
+            "slots": self.value,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "mean_wait": self.total_wait / self.acquired if self.acquired else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class HostSum:
+    """
+    Sum of a number published by every process on the host
+
+    Each process writes its number to its own file in `directory`, which it keeps locked
+    while it runs. Files that are no longer locked were left by processes that have
+    exited, and are removed by the next process adding up the numbers.
+    """
+
+    width = 24
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.value = 0.0
+        self.lock = None
+
+    def publish(self, value: float):
+        self.value = value
+        if self.lock is None:
+            lock = FileLock(self.directory / f"{os.getpid()}-{uuid.uuid4().hex}.value", remove=False)
+            if not lock.try_acquire():
+                return
+            self.lock = lock
+        # Written in place at a fixed width so readers never see a partly written number
+        os.pwrite(self.lock.fd, f"{value:{self.width}.6f}".encode(), 0)
+
+    def total(self) -> float:
+        total = self.value
+        for path in self.directory.glob("*.value"):
+            if self.lock is not None and path == self.lock.path:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    try:
+                        total += float(os.pread(fd, self.width, 0) or 0)
+                    except ValueError:
+                        pass
+                else:
+                    path.unlink(missing_ok=True)
+            finally:
+                os.close(fd)
+        return total
+
+    def close(self):
+        if self.lock is not None:
+            self.lock.path.unlink(missing_ok=True)
+            self.lock.release()
+            self.lock = None
@@ -0,0 +1,396 @@
+"""
+Triangle mesh formats
+
+OpenSCAD is only asked for binary STL. Every other format is converted from that here so
+all formats of a model come from a single geometry build.
+"""
+
+import io
+import re
+import struct
+from typing import NamedTuple
+import zipfile
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+
+# Layout of a binary STL facet record
+stl_dtype = np.dtype(
+    [
+        ("normal", "<f4", (3,)),
+        ("vertices", "<f4", (3, 3)),
+        ("attributes", "<u2"),
+    ]
+)
+
+stl_header_size = 84
+
+vertex_pattern = re.compile(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)")
+
+# Browser preview mesh layout. See write_preview()
+preview_magic = b"GPRV"
+preview_version = 1
+preview_header = struct.Struct("<4sBBxxII3f3f")
+preview_normals_flag = 1
+preview_wide_index_flag = 2
+preview_scale = 65535
+
+# Changes between two preview meshes. See preview_delta()
+preview_delta_magic = b"GPRD"
+preview_delta_header = struct.Struct("<4sBBxxI")
+preview_replace_flag = 1
+
+
+class MeshPart(NamedTuple):
+    """A separate body in a multi-part file, optionally with a material."""
+
+    name: str
+    triangles: np.ndarray
+    material: str | None = None
+    color: str | None = None
+
+
+def is_binary_stl(data) -> bool:
+    # Binary files may also start with "solid", so check the size matches the count
+    if len(data) < stl_header_size:
+        return False
+    (count,) = struct.unpack_from("<I", data, 80)
+    return len(data) == stl_header_size + count * stl_dtype.itemsize
+
+
+def read_stl(data) -> np.ndarray:
+    """Triangles of an ASCII or binary STL as an (n, 3, 3) float32 array."""
+    if is_binary_stl(data):
+        (count,) = struct.unpack_from("<I", data, 80)
+        records = np.frombuffer(data, dtype=stl_dtype, count=count, offset=stl_header_size)
+        return records["vertices"].copy()
+
+    vertices = np.array(vertex_pattern.findall(bytes(data)), dtype=np.float32)
+    return vertices.reshape(-1, 3, 3)
+
+
+def normals(triangles: np.ndarray) -> np.ndarray:
+    """Unit normals of each triangle. Degenerate triangles get a zero normal."""
+    cross = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    length = np.linalg.norm(cross, axis=1, keepdims=True)
+    return np.divide(cross, length, out=np.zeros_like(cross), where=length > 0)
+
+
+def indexed(triangles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Shared vertices and the (n, 3) vertex indices of each triangle."""
+    vertices, faces = np.unique(triangles.reshape(-1, 3), axis=0, return_inverse=True)
+    return vertices, faces.reshape(-1, 3)
+
+
+def format_rows(template: str, values: np.ndarray) -> str:
+    """Format each row of `values` with `template` and join the results."""
+    if not len(values):
+        return ""
+    values = values.reshape(len(values), -1)
+    return (template * len(values)) % tuple(values.ravel().tolist())
+
+
+def write_binary_stl(triangles: np.ndarray) -> bytes:
+    records = np.zeros(len(triangles), dtype=stl_dtype)
+    records["normal"] = normals(triangles)
+    records["vertices"] = triangles
+    header = b"Binary STL".ljust(80, b" ")
+    return header + struct.pack("<I", len(triangles)) + records.tobytes()
+
+
+def write_ascii_stl(triangles: np.ndarray, name: str = "OpenSCAD_Model") -> bytes:
+    facets = np.concatenate([normals(triangles)[:, None], triangles], axis=1)
+    body = format_rows(
+        "  facet normal %.9g %.9g %.9g\n"
+        "    outer loop\n"
+        "      vertex %.9g %.9g %.9g\n"
+        "      vertex %.9g %.9g %.9g\n"
+        "      vertex %.9g %.9g %.9g\n"
+        "    endloop\n"
+        "  endfacet\n",
+        facets,
+    )
+    return f"solid {name}\n{body}endsolid {name}\n".encode()
+
+
+def write_obj(triangles: np.ndarray) -> bytes:
+    vertices, faces = indexed(triangles)
+    return (
+        format_rows("v %.9g %.9g %.9g\n", vertices) + format_rows("f %d %d %d\n", faces + 1)
+    ).encode()
+
+
+def write_3mf(parts: list[MeshPart]) -> bytes:
+    """3MF package with each part as a separate object, with materials if given."""
+    materials = list(dict.fromkeys(part.material for part in parts if part.material))
+    colors = {part.material: part.color for part in parts if part.material and part.color}
+
+    resources = []
+    if materials:
+        bases = "".join(
+            f"<base name={quoteattr(material)} displaycolor={quoteattr(colors.get(material, '#808080'))}/>"
+            for material in materials
+        )
+        resources.append(f'<basematerials id="1">{bases}</basematerials>')
+
+    items = []
+    for object_id, part in enumerate(parts, start=2):
+        vertices, faces = indexed(part.triangles)
+        material = f' pid="1" pindex="{materials.index(part.material)}"' if part.material else ""
+        resources.append(
+            f'<object id="{object_id}" type="model" name={quoteattr(part.name)}{material}>'
+            "<mesh><vertices>"
+            + format_rows('<vertex x="%.9g" y="%.9g" z="%.9g"/>', vertices)
+            + "</vertices><triangles>"
+            + format_rows('<triangle v1="%d" v2="%d" v3="%d"/>', faces)
+            + "</triangles></mesh></object>"
+        )
+        items.append(f'<item objectid="{object_id}"/>')
+
+    model = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<model unit="millimeter" xml:lang="en-US" '
+        'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+        f"<resources>{''.join(resources)}</resources>"
+        f"<build>{''.join(items)}</build>"
+        "</model>"
+    )
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(
+            "[Content_Types].xml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>'
+            "</Types>",
+        )
+        zf.writestr(
+            "_rels/.rels",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Target="/3D/3dmodel.model" Id="rel0" '
+            'Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>'
+            "</Relationships>",
+        )
+        zf.writestr("3D/3dmodel.model", model)
+    return buf.getvalue()
+
+
+def padded(size: int) -> int:
+    """Size rounded up to a 4 byte boundary."""
+    return size + -size % 4
+
+
+def align(data: bytes) -> bytes:
+    return data.ljust(padded(len(data)), b"\0")
+
+
+def write_preview(triangles: np.ndarray, with_normals: bool = False) -> bytes:
+    """
+    Compact indexed mesh for the browser preview
+
+    Vertices are quantized to 16 bits within the bounding box of the mesh and shared
+    between triangles. The header holds the magic, version, flags, vertex and index
+    counts, and the bounding box minimum and maximum. It is followed by the positions
+    as uint16, the indices as uint16, or uint32 with more than 65536 vertices, and
+    optionally area weighted vertex normals as int8. Each part starts on a 4 byte
+    boundary.
+    """
+    corners = triangles.reshape(-1, 3).astype(np.float64)
+    low = corners.min(axis=0) if len(corners) else np.zeros(3)
+    high = corners.max(axis=0) if len(corners) else np.zeros(3)
+    low, high = low.astype(np.float32), high.astype(np.float32)
+    scale = preview_grid(low, high)
+    quantized = np.rint((corners - low) * scale).astype(np.uint16).reshape(-1, 3, 3)
+
+    vertices, faces = indexed(quantized)
+    # Triangles that collapsed when quantized would not be visible anyway
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+
+    vertex_normals = None
+    if with_normals:
+        positions = low + vertices / np.where(scale > 0, scale, 1)
+        face_normals = np.cross(
+            positions[faces[:, 1]] - positions[faces[:, 0]], positions[faces[:, 2]] - positions[faces[:, 0]]
+        )
+        vertex_normals = np.zeros_like(positions)
+        for corner in range(3):
+            np.add.at(vertex_normals, faces[:, corner], face_normals)
+        length = np.linalg.norm(vertex_normals, axis=1, keepdims=True)
+        vertex_normals = np.divide(vertex_normals, length, out=np.zeros_like(vertex_normals), where=length > 0)
+        vertex_normals = np.rint(vertex_normals * 127).astype(np.int8)
+
+    return pack_preview(low, high, vertices, faces, vertex_normals)
+
+
+def preview_grid(low: np.ndarray, high: np.ndarray) -> np.ndarray:
+    """Quantization steps per unit along each axis of a preview mesh bounding box."""
+    extent = high.astype(np.float64) - low
+    return np.divide(preview_scale, extent, out=np.zeros(3), where=extent > 0)
+
+
+def pack_preview(
+    low: np.ndarray, high: np.ndarray, vertices: np.ndarray, faces: np.ndarray, vertex_normals: np.ndarray | None
+) -> bytes:
+    flags = 0
+    index_type = "<u2"
+    if len(vertices) > 65536:
+        flags |= preview_wide_index_flag
+        index_type = "<u4"
+    parts = [align(vertices.astype("<u2").tobytes()), align(faces.astype(index_type).tobytes())]
+    if vertex_normals is not None:
+        flags |= preview_normals_flag
+        parts.append(align(vertex_normals.astype(np.int8).tobytes()))
+
+    header = preview_header.pack(preview_magic, preview_version, flags, len(vertices), faces.size, *low, *high)
+    return header + b"".join(parts)
+
+
+def unpack_preview(data) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray | None]:
+    """Bounding box, quantized vertices, (n, 3) triangle indices and int8 normals of a preview mesh."""
+    magic, version, flags, vertex_count, index_count, *bounds = preview_header.unpack_from(data)
+    if magic != preview_magic or version != preview_version:
+        raise ValueError("Not a preview mesh")
+    low, high = np.array(bounds[:3], dtype=np.float32), np.array(bounds[3:], dtype=np.float32)
+
+    offset = preview_header.size
+    vertices = np.frombuffer(data, dtype="<u2", count=vertex_count * 3, offset=offset).reshape(-1, 3)
+    offset += padded(vertices.nbytes)
+    index_type = "<u4" if flags & preview_wide_index_flag else "<u2"
+    faces = np.frombuffer(data, dtype=index_type, count=index_count, offset=offset).reshape(-1, 3)
+    offset += padded(faces.nbytes)
+
+    vertex_normals = None
+    if flags & preview_normals_flag:
+        vertex_normals = np.frombuffer(data, dtype=np.int8, count=vertex_count * 3, offset=offset).reshape(-1, 3)
+
+    return low, high, vertices, faces.astype(np.int64), vertex_normals
+
+
+def read_preview(data) -> tuple[np.ndarray, np.ndarray, np.ndarray | None]:
+    """Vertex positions, (n, 3) triangle indices and vertex normals of a preview mesh."""
+    low, high, vertices, faces, vertex_normals = unpack_preview(data)
+    positions = low + vertices * ((high.astype(np.float64) - low) / preview_scale)
+    return positions, faces, None if vertex_normals is None else vertex_normals / 127
+
+
+def triangle_keys(corners: np.ndarray) -> np.ndarray:
+    """
+    (n, 9) integer keys identifying triangles by their quantized corners
+
+    Each triangle starts at its smallest corner so the same triangle gets the same key
+    whichever corner it was written from.
+    """
+    packed = (corners[:, :, 0] << 32) | (corners[:, :, 1] << 16) | corners[:, :, 2]
+    order = (packed.argmin(axis=1)[:, None] + np.arange(3)) % 3
+    return np.take_along_axis(corners, order[:, :, None], axis=1).reshape(-1, 9)
+
+
+def preview_delta(base, data) -> bytes:
+    """
+    Changes from the preview mesh `base` to the preview mesh `data`
+
+    The header holds the magic, version, flags and number of runs. It is followed by
+    the runs as pairs of uint32 and a preview mesh of the triangles that are not in the
+    base. Each run is a start and count of triangles copied from the base, or a count
+    of triangles taken from the added mesh when the start is 0xffffffff. Together the
+    runs give the triangles of `data` in order, so the result can be the base of the
+    next delta. Triangles are matched on the quantization grid of the base.
+
+    The delta holds all of `data` with the replace flag set instead when there is no
+    base, the meshes are of different kinds or the changes are not smaller.
+    """
+    replace = preview_delta_header.pack(preview_delta_magic, preview_version, preview_replace_flag, 0) + bytes(data)
+    if base is None:
+        return replace
+
+    low, high, vertices, faces, vertex_normals = unpack_preview(data)
+    base_low, base_high, base_vertices, base_faces, base_normals = unpack_preview(base)
+    if (vertex_normals is None) != (base_normals is None):
+        return replace
+
+    # Move the new corners onto the grid of the base. Corners outside the base can not
+    # match anything
+    positions = low + vertices * ((high.astype(np.float64) - low) / preview_scale)
+    on_grid = np.rint((positions - base_low) * preview_grid(base_low, base_high)).astype(np.int64)
+    keys = triangle_keys(on_grid[faces])
+    tolerance = np.maximum(high - low, base_high - base_low).astype(np.float64) / preview_scale
+    outside = ((positions < base_low - tolerance) | (positions > base_high + tolerance)).any(axis=1)
+    keys[outside[faces].any(axis=1)] = -1
+    base_keys = triangle_keys(base_vertices.astype(np.int64)[base_faces])
+
+    _, ids = np.unique(np.concatenate([base_keys, keys]), axis=0, return_inverse=True)
+    ids = ids.ravel()
+    base_index = np.full(ids.max(initial=-1) + 1, -1)
+    base_index[ids[: len(base_keys)]] = np.arange(len(base_keys))
+    source = base_index[ids[len(base_keys) :]]
+
+    # A run continues while triangles come from consecutive base triangles or are all added
+    added = source < 0
+    follows = np.zeros(len(source), dtype=bool)
+    follows[1:] = (added[1:] & added[:-1]) | (~added[1:] & (source[1:] == source[:-1] + 1))
+    starts = np.flatnonzero(~follows)
+    counts = np.diff(np.append(starts, len(source)))
+    runs = np.stack([np.where(added[starts], 0xFFFFFFFF, source[starts]), counts], axis=1)
+
+    used, added_faces = np.unique(faces[added], return_inverse=True)
+    added_mesh = pack_preview(
+        low,
+        high,
+        vertices[used],
+        added_faces.reshape(-1, 3),
+        None if vertex_normals is None else vertex_normals[used],
+    )
+    delta = (
+        preview_delta_header.pack(preview_delta_magic, preview_version, 0, len(runs))
+        + runs.astype("<u4").tobytes()
+        + added_mesh
+    )
+    return delta if len(delta) < len(data) else replace
+
+
+def read_preview_delta(data) -> tuple[bool, np.ndarray, bytes]:
+    """Whether a preview delta replaces the base, its (n, 2) runs and the added preview mesh."""
+    magic, version, flags, run_count = preview_delta_header.unpack_from(data)
+    if magic != preview_delta_magic or version != preview_version:
+        raise ValueError("Not a preview delta")
+    offset = preview_delta_header.size
+    runs = np.frombuffer(data, dtype="<u4", count=run_count * 2, offset=offset).reshape(-1, 2)
+    return bool(flags & preview_replace_flag), runs, bytes(data[offset + runs.nbytes :])
+
+
+def split(triangles: np.ndarray, offset: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Separate two bodies exported together with the second moved `offset` along X
+
+    The offset must be at least twice the extent of either body from the origin. The
+    second body is moved back into place.
+    """
+    second = triangles[:, :, 0].min(axis=1) > offset / 2
+    moved = triangles[second].astype(np.float64)
+    moved[:, :, 0] -= offset
+    return triangles[~second], moved.astype(np.float32)
+
+
+def convert(stl, export_format: str, name: str = "OpenSCAD_Model") -> bytes:
+    """Convert a binary or ASCII STL to one of the export formats."""
+    return write(read_stl(stl), export_format, name)
+
+
+def write(triangles: np.ndarray, export_format: str, name: str = "OpenSCAD_Model") -> bytes:
+    if export_format == "binstl":
+        return write_binary_stl(triangles)
+    if export_format == "asciistl":
+        return write_ascii_stl(triangles, name)
+    if export_format == "obj":
+        return write_obj(triangles)
+    if export_format == "3mf":
+        return write_3mf([MeshPart(name, triangles)])
+    if export_format == "preview":
+        return write_preview(triangles)
+    if export_format == "preview-normals":
+        return write_preview(triangles, with_normals=True)
+    raise ValueError(f"Unknown export format {export_format}")
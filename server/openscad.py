@@ -1,7 +1,32 @@
 import asyncio
-from async_lru import alru_cache
+from collections import Counter, defaultdict
+from collections.abc import Awaitable, Callable
+import functools
+import hashlib
+import json
 import logging
+import mmap
+import os
 from pathlib import Path
+import re
+import signal
+import subprocess
+import time
+
+from server import compression, mesh, progress, settings
+from server.cache import DiskCache, FailureCache, MappedFile, MemoryCache, SharedCache
+from server.locks import FileLock, HostSemaphore, HostSum
+from server.scheduler import (
+    AdmissionControl,
+    BuildJob,
+    BuildScheduler,
+    CostModel,
+    available_cpus,
+    available_memory,
+    default_max_builds,
+    oom_kills,
+)
+from server.spool import Spool
 
 
 logger = logging.getLogger("openscad")
@@ -11,17 +36,677 @@ top_dir = (Path(__file__) / "../..").resolve()
 
 
 class OpenSCADError(Exception):
-    pass
+    code = "build_failed"
+
+    # Whether the failure would happen again and may be remembered. See remembered_failures
+    remember = True
+
+    def __init__(self, message: str, stderr: str = ""):
+        super().__init__(message)
+        self.stderr = stderr
+
+
+class ModelError(OpenSCADError):
+    """OpenSCAD could not build the model with the given parameters."""
+
+    code = "model_error"
+
+
+class BuildTimeout(OpenSCADError):
+    """The build ran past its time limit and was killed."""
+
+    code = "build_timeout"
+
+
+class BuildOutOfMemory(OpenSCADError):
+    """The build ran past its memory limit."""
+
+    code = "build_out_of_memory"
+
+
+class BuildKilled(OpenSCADError):
+    """The build was killed by something other than the server, such as an operator."""
+
+    code = "build_killed"
+    remember = False
+
+
+class BuildTooLarge(OpenSCADError):
+    """The build is estimated to take longer than any single build is allowed."""
+
+    code = "build_too_large"
+
+
+class BuildQueueFull(OpenSCADError):
+    """Too much work is already queued. The client should retry after `retry_after` seconds."""
+
+    code = "build_queue_full"
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class BuildSuperseded(OpenSCADError):
+    """A newer request of the same client session replaced this one."""
+
+    code = "build_superseded"
+
+
+# Artifacts survive restarts and are shared by every worker on the host
+disk_cache = DiskCache(settings.cache_dir / "artifacts", settings.cache_max_bytes)
+
+# Hot artifacts are mapped from shared memory so workers do not each hold a copy
+shared_cache = SharedCache(settings.shared_cache_dir, settings.shared_cache_max_bytes)
+
+# Recent build failures, so retrying parameters that do not build fails straight away
+failure_cache = FailureCache(
+    settings.cache_dir / "failures", settings.failure_cache_max_bytes, settings.failure_cache_ttl
+)
+
+# Lock files used so only one worker on the host builds a given artifact at a time
+lock_dir = settings.cache_dir / "locks"
+
+# Limits the number of OpenSCAD processes across every worker on the host
+max_builds = settings.max_builds or default_max_builds(
+    len(available_cpus()), available_memory(), settings.build_memory_bytes
+)
+build_semaphore = HostSemaphore(settings.cache_dir / "slots", max_builds, aging=settings.queue_aging)
+
+# Decides the threads and CPUs each build gets
+scheduler = BuildScheduler(
+    available_cpus(),
+    max_builds,
+    pin=bool(settings.pin_builds),
+    cpu_seconds=settings.build_cpu_seconds,
+    memory_bytes=settings.build_max_memory_bytes,
+)
+
+# Learns build times so queued builds can be started shortest first
+cost_model = CostModel()
+
+# Refuses builds that are too large or would wait too long
+admission = AdmissionControl(
+    max_builds, settings.max_build_seconds, settings.max_queue_seconds, HostSum(settings.cache_dir / "queue")
+)
+
+# Recently used artifacts are also kept in memory, with separate budgets so large models
+# do not push out screenshots
+stl_memory_cache = MemoryCache(settings.memory_cache_stl_bytes)
+png_memory_cache = MemoryCache(settings.memory_cache_png_bytes)
+
+# Artifacts currently being produced, so concurrent requests for the same one share it,
+# the number of requests waiting for each and their progress
+inflight: dict[str, asyncio.Future] = {}
+waiters: Counter[str] = Counter()
+inflight_progress: dict[str, progress.Progress] = {}
+
+# Compressed variants of artifacts being made in the background, by key of the variant
+precompressions: dict[str, asyncio.Task] = {}
+
+# Size of the reads from OpenSCAD's output
+output_chunk_bytes = 256 * 1024
+
+# Amount of OpenSCAD's error output kept with a failure. The end has the actual error
+max_stderr_length = 2000
+
+# Messages printed when OpenSCAD or the C++ runtime fail to allocate memory
+out_of_memory_pattern = re.compile(r"bad_alloc|out of memory|cannot allocate memory", re.IGNORECASE)
+
+# Messages OpenSCAD logs as it starts each phase of a build
+phase_patterns = [
+    (re.compile(rb"(Parsing|Compiling) design"), "evaluating"),
+    (re.compile(rb"Rendering "), "rendering"),
+]
+
+dependency_pattern = re.compile(r"^\s*(?:include|use)\s*<([^>]+)>", re.MULTILINE)
+
+skip_list_pattern = re.compile(r"\[\s*(-?\d+)\s*,\s*(-?\d+)\s*\]")
+
+# Per model rules for parameters that do not affect the geometry. See inactive_parameters()
+inactive_parameter_rules: dict[str, list[tuple[Callable[[dict], bool], tuple[str, ...]]]] = defaultdict(list)
+
+# Per model measures of build size. See build_size()
+build_size_rules: dict[str, Callable[[dict], float]] = {}
+
+
+def inactive_parameters(model_file: str, *names: str, when: Callable[[dict], bool]):
+    """
+    Declare model parameters that have no effect on the geometry when `when` is true
+
+    `when` is given the canonical parameters that would be passed to OpenSCAD. Inactive
+    parameters are left out of both the cache key and the OpenSCAD command so OpenSCAD
+    falls back to the model default, which is equivalent as it is not used.
+    """
+    inactive_parameter_rules[model_file].append((when, names))
+
+
+def elide_inactive_params(model_file: str, params: dict) -> dict:
+    # Evaluate every rule against the full set so rules do not depend on each other
+    inactive = set()
+    for when, names in inactive_parameter_rules.get(model_file, []):
+        try:
+            if when(params):
+                inactive.update(names)
+        except KeyError:
+            # The rule depends on a parameter that was not given
+            pass
+
+    return {name: value for name, value in params.items() if name not in inactive}
+
+
+def build_size(model_file: str, size: Callable[[dict], float]):
+    """
+    Declare how the build time of a model scales with its parameters
+
+    `size` is given the parameters that would be passed to OpenSCAD and should return a
+    number the build time is roughly proportional to, such as the number of tile units.
+    Models without a declared size count as 1.
+    """
+    build_size_rules[model_file] = size
+
+
+def model_size(model_file: str, params: dict) -> float:
+    size = build_size_rules.get(model_file)
+    if size is None:
+        return 1
+    try:
+        return max(size(params), 1)
+    except KeyError:
+        # The measure depends on a parameter that was not given
+        return 1
+
+
+def tile_units(params: dict) -> int:
+    """Number of units in a tile, less those in the skip list."""
+    skipped = len(skip_list_pattern.findall(params.get("skip_list", "")))
+    return params["columns"] * params["rows"] - skipped
+
+
+def library_dirs() -> list[Path]:
+    """Directories OpenSCAD looks for libraries in, in the order it looks."""
+    dirs = [Path(path) for path in os.environ.get("OPENSCADPATH", "").split(os.pathsep) if path]
+    dirs.append(Path.home() / ".local/share/OpenSCAD/libraries")
+    dirs.append(Path("/usr/share/openscad/libraries"))
+    return dirs
+
+
+def resolve_dependency(directory: Path, name: str) -> Path:
+    """File an include or use of `name` in a file in `directory` refers to."""
+    for candidate in [directory / name, *(library / name for library in library_dirs())]:
+        if candidate.is_file():
+            return candidate
+    return directory / name
+
+
+@functools.cache
+def model_digest(model_file: str) -> str:
+    """
+    Hash a model file along with every file it includes or uses
+
+    Dependencies are looked up next to the file using them and then in the library
+    path, the way OpenSCAD finds them, so upgrading a library such as BOSL2 changes the
+    digest too. Dependencies that are not installed are skipped.
+    """
+    digest = hashlib.sha256()
+    pending = [(model_file, top_dir / model_file)]
+    seen = set()
+
+    while pending:
+        name, path = pending.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+
+        if not path.is_file():
+            continue
+
+        content = path.read_bytes()
+        digest.update(name.encode())
+        digest.update(content)
+        for dependency in sorted(dependency_pattern.findall(content.decode(errors="replace"))):
+            pending.append((dependency, resolve_dependency(path.parent, dependency)))
+
+    return digest.hexdigest()
+
+
+@functools.cache
+def openscad_version() -> str:
+    """Version OpenSCAD reports, or "unknown" if it cannot be run."""
+    try:
+        result = subprocess.run(["openscad", "--version"], capture_output=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return "unknown"
+    # OpenSCAD prints its version to stderr
+    return (result.stdout + result.stderr).decode(errors="replace").strip()
+
+
+def canonical_value(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, float):
+        value = round(value, settings.float_precision)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, str):
+        return str(value)
+    return value
+
+
+def canonical_skip_list(skip_list: str, rows: int | None, columns: int | None) -> str:
+    """
+    Sort and de-duplicate a skip list, dropping entries that are outside the tile
+    """
+    entries = set()
+    for match in skip_list_pattern.finditer(skip_list):
+        row, column = int(match[1]), int(match[2])
+        if row < 1 or column < 1:
+            continue
+        if rows is not None and row > rows:
+            continue
+        if columns is not None and column > columns:
+            continue
+        entries.add((row, column))
+    return ",".join(repr([row, column]) for row, column in sorted(entries))
+
+
+def canonicalize_params(params: dict) -> dict:
+    """
+    Normalize build parameters so equivalent requests share cache entries
+
+    Numbers are reduced to their simplest type and rounded to
+    `settings.float_precision`, skip lists are sorted, de-duplicated and clipped to the
+    tile size, and the keys are sorted.
+    """
+    canonical = {name: canonical_value(value) for name, value in params.items()}
+
+    if isinstance(canonical.get("skip_list"), str):
+        canonical["skip_list"] = canonical_skip_list(
+            canonical["skip_list"], canonical.get("rows"), canonical.get("columns")
+        )
+
+    return dict(sorted(canonical.items()))
+
+
+# Overrides of the resolution of each build quality. Standard builds use the resolution
+# set in the models. $plain_threads replaces thread cutters with plain holes in the
+# models that have them, as threads are slow to cut and do not show in a preview
+quality_presets = {
+    "preview": {"$fa": 6, "$fs": 1, "$plain_threads": True},
+    "standard": {},
+    "fine": {"$fa": 0.25, "$fs": 0.25},
+}
+
+
+def quality_params(params: dict, quality: str) -> dict:
+    """
+    Add the overrides of a build quality to the model parameters
+
+    The overrides are passed to OpenSCAD like any other parameter, so each quality is
+    cached separately.
+    """
+    return {**params, **quality_presets[quality]}
+
+
+# Names of cached artifacts, which are also their file names in the caches
+artifact_name_pattern = re.compile(r"[0-9a-f]{64}(?:\.(?P<encoding>gzip|br|zstd))?\.(?P<ext>[0-9a-z-]+)")
+
+
+# Version of the conversions from OpenSCAD's output in mesh and archive. Bump it when
+# they produce different output so converted artifacts that are cached are not used
+converter_version = 1
+
+def artifact_key(model_file: str, kind: str, params: dict, converter: int | None = None) -> str:
+    """
+    Content address for an artifact built from the given model and parameters
+
+    The key also covers the OpenSCAD version, the libraries the model uses and
+    settings.cache_version, so cached artifacts are not used after any of them change.
+    Artifacts converted from a build pass the `converter` version they were made with.
+    """
+    payload = {
+        "model": model_digest(model_file),
+        "openscad": openscad_version(),
+        "cache_version": settings.cache_version,
+        "kind": kind,
+        "params": params,
+    }
+    if converter is not None:
+        payload["converter"] = converter
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def define_args(params: dict) -> list[str]:
+    args = []
+    for name, value in params.items():
+        if value is not None:
+            if isinstance(value, str):
+                args += ["-D", f'{name}="{value}"']
+            elif isinstance(value, bool):
+                args += ["-D", f'{name}={str(value).lower()}']
+            else:
+                args += ["-D", f"{name}={value}"]
+    return args
+
+
+# Failures that would happen again with the same parameters, by code. Refusals based on
+# the load of the server are not remembered
+remembered_failures = {error.code: error for error in (ModelError, BuildTimeout, BuildOutOfMemory)}
+
 
+def build_failure(returncode: int, stderr: str, error_message: str, oom_killed: bool = False) -> OpenSCADError:
+    """
+    Work out why OpenSCAD exited unsuccessfully
 
-# Allow up to 32 processes at once
-process_semaphore = asyncio.Semaphore(32)
+    `oom_killed` is whether the OOM killer killed a process of the server while the
+    build ran. Builds killed on timeout or cancellation do not get here. Failures of
+    builds that were killed are not remembered, as they depend on what else was running.
+    """
+    stderr = stderr[-max_stderr_length:]
+    if returncode == -signal.SIGXCPU:
+        error = BuildTimeout(f"{error_message}: the build took too long", stderr)
+    elif (oom_killed and returncode == -signal.SIGKILL) or out_of_memory_pattern.search(stderr):
+        error = BuildOutOfMemory(f"{error_message}: the build ran out of memory", stderr)
+    elif returncode == -signal.SIGKILL:
+        error = BuildKilled(f"{error_message}: the build was killed", stderr)
+    else:
+        error = ModelError(error_message, stderr)
+    if returncode == -signal.SIGKILL:
+        error.remember = False
+    return error
 
-@alru_cache(maxsize=1024)
-async def build(model_file: str, **params) -> bytes:
+
+async def read_output(stream: asyncio.StreamReader) -> bytes | mmap.mmap:
+    """
+    Read OpenSCAD's output as it is written
+
+    Outputs of at least settings.stream_min_bytes are spooled to a temporary file and
+    returned mapped.
+    """
+    with Spool(settings.stream_min_bytes) as spool:
+        while chunk := await stream.read(output_chunk_bytes):
+            if not spool.size:
+                progress.report(phase="exporting")
+            spool.write(chunk)
+        return spool.getvalue()
+
+
+async def read_errors(stream: asyncio.StreamReader) -> bytes:
+    """Read OpenSCAD's error output, reporting the phases of the build it logs."""
+    output = bytearray()
+    line_start = 0
+    while chunk := await stream.read(output_chunk_bytes):
+        output += chunk
+        line_end = output.rfind(b"\n") + 1
+        for line in output[line_start:line_end].splitlines():
+            for pattern, phase in phase_patterns:
+                if pattern.match(line):
+                    progress.report(phase=phase)
+        line_start = max(line_start, line_end)
+    return bytes(output)
+
+
+def admit(job: BuildJob | None, error_message: str) -> float:
+    """Estimated seconds `job` takes to build, raising if it should not be queued."""
+    estimate = cost_model.estimate(job) if job else 0.0
+    # Estimates from other kinds of build are too rough to refuse a build on
+    if job and cost_model.sampled(job.name) and admission.too_large(estimate):
+        raise BuildTooLarge(f"{error_message}: the model is too large to build")
+    if admission.busy():
+        raise BuildQueueFull(f"{error_message}: the server is busy", admission.expected_wait())
+    return estimate
+
+
+async def run_openscad(cmd: list[str], error_message: str, job: BuildJob | None = None) -> bytes | mmap.mmap:
+    # Builds expected to finish sooner are started first
+    estimate = admit(job, error_message)
+
+    with admission.queued(estimate):
+        progress.report(phase="queued", finish_by=progress.estimate(admission.expected_wait() + estimate))
+        async with build_semaphore.slot(estimate, lambda position: progress.report(position=position)) as slot:
+            progress.report(phase="evaluating", position=0, finish_by=progress.estimate(estimate))
+            # A freed slot is handed out again while higher ones are still running, so
+            # whether the host is idle depends on the other slots
+            busy = build_semaphore.waiting > 0 or build_semaphore.others_held(slot)
+            threads, cpus = scheduler.place(slot, busy=busy)
+            start = time.monotonic()
+            start_oom_kills = oom_kills()
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *scheduler.command(cmd, cpus),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=scheduler.environment(threads),
+                )
+            except Exception:
+                logger.exception("Got exception starting openscad")
+                raise OpenSCADError(error_message)
+            scheduler.apply(proc.pid, cpus)
+
+            try:
+                stdout, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(read_output(proc.stdout), read_errors(proc.stderr), proc.wait()),
+                    settings.build_timeout or None,
+                )
+            except TimeoutError:
+                proc.kill()
+                await proc.wait()
+                logger.error(f"OpenSCAD build timed out after {settings.build_timeout}s: {cmd}")
+                raise BuildTimeout(f"{error_message}: the build took too long")
+            except BaseException:
+                # Also reached when the last request waiting for the build goes away
+                if proc.returncode is None:
+                    proc.kill()
+                raise
+
+    if proc.returncode != 0:
+        stderr = stderr.decode(errors="replace")
+        logger.error(f"OpenSCAD build failed with status {proc.returncode}: {stderr}")
+        oom_killed = start_oom_kills is not None and (oom_kills() or 0) > start_oom_kills
+        raise build_failure(proc.returncode, stderr, error_message, oom_killed)
+
+    if job:
+        cost_model.record(job, time.monotonic() - start)
+
+    return stdout
+
+
+async def recall_failure(key: str):
+    """Raise the error from a recent failed build of the artifact, if there is one."""
+    failure = await asyncio.to_thread(failure_cache.recall, key)
+    if failure is not None:
+        raise remembered_failures[failure["code"]](failure["message"], failure["stderr"])
+
+
+async def run_remembering_failure(key: str, cmd: list[str], error_message: str, job: BuildJob | None) -> bytes:
+    try:
+        return await run_openscad(cmd, error_message, job)
+    except tuple(remembered_failures.values()) as error:
+        if not error.remember:
+            raise
+        try:
+            await asyncio.to_thread(
+                failure_cache.remember, key, {"code": error.code, "message": str(error), "stderr": error.stderr}
+            )
+        except OSError:
+            logger.exception("Unable to store failure in failure cache")
+        raise
+
+
+async def cached_run(key: str, ext: str, run: Callable[[], Awaitable[bytes]]) -> bytes:
+    """Produce an artifact with `run` unless it is already in the shared memory or disk cache."""
+    data = await asyncio.to_thread(shared_cache.get, key, ext)
+    if data is not None:
+        return data
+
+    data = await asyncio.to_thread(disk_cache.get, key, ext)
+    if data is None:
+        await recall_failure(key)
+
+        if not (shared_cache.enabled or disk_cache.enabled):
+            return await run()
+
+        # If another worker is already producing this artifact, wait for it and pick up
+        # its result instead of producing it again
+        async with FileLock(lock_dir / f"{key}.lock"):
+            data = await asyncio.to_thread(shared_cache.get, key, ext)
+            if data is not None:
+                return data
+
+            data = await asyncio.to_thread(disk_cache.get, key, ext)
+            if data is None:
+                # The worker holding the lock before may have failed to build it
+                await recall_failure(key)
+                data = await run()
+
+                try:
+                    await asyncio.to_thread(disk_cache.put, key, ext, data)
+                except OSError:
+                    logger.exception("Unable to store artifact in disk cache")
+
+    # Hand out the shared copy so this worker does not keep a private one
+    try:
+        return await asyncio.to_thread(shared_cache.share, key, ext, data)
+    except OSError:
+        logger.exception("Unable to store artifact in shared cache")
+        return data
+
+
+async def produce(memory_cache: MemoryCache, key: str, ext: str, run: Callable[[], Awaitable[bytes]]) -> bytes:
+    start = time.monotonic()
+    data = await cached_run(key, ext, run)
+    memory_cache.put(key, data, cost=time.monotonic() - start)
+    return data
+
+
+async def store_variant(key: str, ext: str, data, encoding: str) -> bytes:
+    variant = await asyncio.to_thread(compression.compress, data, encoding)
+    try:
+        await asyncio.to_thread(disk_cache.put, key, ext, variant)
+    except OSError:
+        logger.exception("Unable to store compressed artifact in disk cache")
+    return variant
+
+
+def forget_precompression(key: str, task: asyncio.Task):
+    if precompressions.get(key) is task:
+        del precompressions[key]
+
+
+def precompressing(key: str, ext: str, run: Callable[[], Awaitable[bytes]]) -> Callable[[], Awaitable[bytes]]:
+    """
+    Wrap `run` to also store every compressed variant of the artifact it produces
+
+    The variants are made in the background, so the artifact is returned as soon as it
+    has been produced rather than once every encoder has been through it.
+    """
+
+    async def run_and_compress():
+        data = await run()
+        if disk_cache.enabled:
+            for encoding in compression.encoders:
+                variant_key = f"{key}.{encoding}"
+                if variant_key not in precompressions:
+                    task = asyncio.create_task(store_variant(variant_key, ext, data, encoding))
+                    precompressions[variant_key] = task
+                    task.add_done_callback(functools.partial(forget_precompression, variant_key))
+        return data
+
+    return run_and_compress
+
+
+async def encode(memory_cache: MemoryCache, key: str, ext: str, run: Callable[[], Awaitable[bytes]], encoding: str) -> bytes:
+    data = await get_artifact(memory_cache, key, ext, run)
+
+    # Wait for the variant being made in the background rather than making it twice
+    task = precompressions.get(f"{key}.{encoding}")
+    if task is not None:
+        progress.report(phase="compressing")
+        return await asyncio.shield(task)
+
+    # Normally stored when the artifact was produced, unless it has been evicted since
+    variant = await asyncio.to_thread(disk_cache.get, f"{key}.{encoding}", ext)
+    if variant is None:
+        progress.report(phase="compressing")
+        variant = await asyncio.to_thread(compression.compress, data, encoding)
+    return variant
+
+
+def forget_inflight(key: str, future: asyncio.Future):
+    if inflight.get(key) is future:
+        del inflight[key]
+        del inflight_progress[key]
+
+
+async def get_artifact(
+    memory_cache: MemoryCache,
+    key: str,
+    ext: str,
+    run: Callable[[], Awaitable[bytes]],
+    encoding: str | None = None,
+) -> bytes:
+    """
+    Return an artifact from the caches, or produce it with `run`
+
+    Concurrent requests for the same artifact share a single run. If `encoding` is
+    given, the artifact is returned compressed with that content coding. Compressed
+    variants are cached like any other artifact.
+    """
+    if encoding is not None:
+        run = functools.partial(encode, memory_cache, key, ext, run, encoding)
+        return await fetch(memory_cache, f"{key}.{encoding}", ext, run)
+
+    if ext in compression.compressible_exts:
+        run = precompressing(key, ext, run)
+    return await fetch(memory_cache, key, ext, run)
+
+
+async def fetch(memory_cache: MemoryCache, key: str, ext: str, run: Callable[[], Awaitable[bytes]]) -> bytes:
+    # Concurrent requests for the same key share a single run
+    data = memory_cache.get(key)
+    if data is not None:
+        return data
+
+    future = inflight.get(key)
+    if future is None:
+        production = progress.Progress()
+        future = asyncio.ensure_future(progress.tracked(production, produce(memory_cache, key, ext, run)))
+        inflight[key] = future
+        inflight_progress[key] = production
+        future.add_done_callback(lambda _: forget_inflight(key, future))
+
+    # Let whatever follows this request follow the artifact too
+    follower = progress.current.get()
+    if follower is not None and key in inflight_progress:
+        follower.follow(inflight_progress[key])
+
+    # Keep building for the other waiters if this request goes away, but stop the build
+    # once nobody is waiting for it
+    waiters[key] += 1
+    try:
+        return await asyncio.shield(future)
+    finally:
+        waiters[key] -= 1
+        if not waiters[key]:
+            del waiters[key]
+            if not future.done():
+                # New requests start a fresh build rather than joining one being stopped
+                forget_inflight(key, future)
+                future.cancel()
+
+
+async def build(model_file: str, *, encoding: str | None = None, quality: str = "standard", **params) -> bytes:
+    """
+    Build the model with the given parameters as a binary STL, optionally compressed
+
+    `quality` is one of quality_presets.
+    """
     if not params:
         raise OpenSCADError("No parameters given")
 
+    params = elide_inactive_params(model_file, canonicalize_params(quality_params(params, quality)))
+
     cmd = [
         "openscad",
         "--backend",
@@ -30,44 +715,67 @@ async def build(model_file: str, **params) -> bytes:
         "-o",
         "-",
         "--export-format",
-        "stl",
+        "binstl",
     ]
-    for name, value in params.items():
-        if value is not None:
-            if isinstance(value, str):
-                cmd += ["-D", f'{name}="{value}"']
-            elif isinstance(value, bool):
-                cmd += ["-D", f'{name}={str(value).lower()}']
-            else:
-                cmd += ["-D", f"{name}={value}"]
+    cmd += define_args(params)
 
-    async with process_semaphore:
-        try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-        except asyncio.CancelledError:
-            proc.kill()
-            raise
-        except Exception:
-            proc.kill()
-            logger.exception("Got exception running openscad")
-            raise OpenSCADError("Model generation failed")
+    key = artifact_key(model_file, "binstl", params)
+    job = BuildJob(f"{model_file}:stl", model_size(model_file, params))
+    run = functools.partial(run_remembering_failure, key, cmd, "Model generation failed", job)
+    return await get_artifact(stl_memory_cache, key, "stl", run, encoding)
 
-    if proc.returncode != 0:
-        logger.error(f"OpenSCAD build failed: {stderr.decode()}")
-        raise OpenSCADError("Model generation failed")
 
-    return stdout
+async def derive(
+    model_file: str,
+    kind: str,
+    ext: str,
+    convert: Callable[[bytes], bytes],
+    *,
+    encoding: str | None = None,
+    quality: str = "standard",
+    **params,
+) -> bytes:
+    """
+    Build the model and return an artifact converted from the binary STL by `convert`
+
+    `kind` identifies the conversion. The result is cached separately from the build,
+    and the conversion runs in a thread.
+    """
+    canonical = elide_inactive_params(model_file, canonicalize_params(quality_params(params, quality)))
+    key = artifact_key(model_file, kind, canonical, converter=converter_version)
+
+    async def run():
+        stl = await build(model_file, quality=quality, **params)
+        progress.report(phase="exporting")
+        return await asyncio.to_thread(convert, stl)
+
+    return await get_artifact(stl_memory_cache, key, ext, run, encoding)
+
+
+async def export(
+    model_file: str, export_format: str, *, encoding: str | None = None, quality: str = "standard", **params
+) -> bytes:
+    """
+    Build the model with the given parameters in one of the formats in mesh.write()
+
+    Every format is converted from the same binary STL build and cached separately.
+    """
+    if export_format == "binstl":
+        return await build(model_file, encoding=encoding, quality=quality, **params)
+
+    convert = functools.partial(mesh.convert, export_format=export_format, name=Path(model_file).stem)
+    return await derive(
+        model_file, export_format, export_format, convert, encoding=encoding, quality=quality, **params
+    )
 
 
-@alru_cache(maxsize=256)
 async def render_screenshot(model_file: str, width: int = 800, height: int = 600, **params) -> bytes:
     """Render a PNG screenshot of the model with given parameters."""
     if not params:
         raise OpenSCADError("No parameters given")
 
+    params = elide_inactive_params(model_file, canonicalize_params(params))
+
     cmd = [
         "openscad",
         "--backend",
@@ -81,31 +789,73 @@ async def render_screenshot(model_file: str, width: int = 800, height: int = 600
         "-",
         str(top_dir / model_file),
     ]
-    for name, value in params.items():
-        if value is not None:
-            if isinstance(value, str):
-                cmd += ["-D", f'{name}="{value}"']
-            elif isinstance(value, bool):
-                cmd += ["-D", f'{name}={str(value).lower()}']
-            else:
-                cmd += ["-D", f"{name}={value}"]
+    cmd += define_args(params)
 
-    async with process_semaphore:
-        try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await proc.communicate()
-        except asyncio.CancelledError:
-            proc.kill()
-            raise
-        except Exception:
-            proc.kill()
-            logger.exception("Got exception running openscad")
-            raise OpenSCADError("Screenshot generation failed")
+    key = artifact_key(model_file, f"png-{width}x{height}", params)
+    job = BuildJob(f"{model_file}:png", model_size(model_file, params))
+    run = functools.partial(run_remembering_failure, key, cmd, "Screenshot generation failed", job)
+    return await get_artifact(png_memory_cache, key, "png", run)
 
-    if proc.returncode != 0:
-        logger.error(f"OpenSCAD build failed: {stderr.decode()}")
-        raise OpenSCADError("Screenshot generation failed")
 
-    return stdout
+async def preview_delta(base_name: str, data, *, encoding: str | None = None) -> bytes:
+    """
+    Return the changes from the cached preview mesh `base_name` to the preview mesh `data`
+
+    See mesh.preview_delta(). Deltas between cached meshes are cached like any other
+    artifact. If the base is no longer cached the delta replaces it with `data`.
+    """
+    match = artifact_name_pattern.fullmatch(base_name)
+    # The client may name a compressed variant of the mesh it has
+    base = await open_artifact(f"{base_name[:64]}.{match['ext']}") if match else None
+    name = artifact_name(data)
+
+    async def run():
+        return await asyncio.to_thread(mesh.preview_delta, base, data)
+
+    if base is None or name is None:
+        delta = await run()
+        if encoding is not None:
+            delta = await asyncio.to_thread(compression.compress, delta, encoding)
+        return delta
+
+    key = hashlib.sha256(f"{converter_version}:{base_name[:64]}:{name}".encode()).hexdigest()
+    return await get_artifact(stl_memory_cache, key, "preview-delta", run, encoding)
+
+
+def artifact_name(data) -> str | None:
+    """Name of the cached file an artifact is mapped from, if it is."""
+    return data.path.name if isinstance(data, MappedFile) else None
+
+
+async def open_artifact(name: str) -> MappedFile | bytes | None:
+    """Map a cached artifact by name, or return None if it is not cached on this host."""
+    if not artifact_name_pattern.fullmatch(name):
+        return None
+
+    key, ext = name.rsplit(".", 1)
+    for cache in (shared_cache, disk_cache):
+        data = await asyncio.to_thread(cache.map, key, ext)
+        if data is not None:
+            return data
+    return None
+
+
+def cache_stats() -> dict:
+    return {
+        "memory": {
+            "stl": stl_memory_cache.stats(),
+            "png": png_memory_cache.stats(),
+        },
+        "shared": shared_cache.stats(),
+        "disk": disk_cache.stats(),
+        "failures": failure_cache.stats(),
+    }
+
+
+def build_stats() -> dict:
+    return {
+        **build_semaphore.stats(),
+        "scheduler": scheduler.stats(),
+        "seconds_per_unit": cost_model.stats(),
+        "admission": admission.stats(),
+    }
@@ -1,12 +1,12 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -52,20 +52,18 @@ def make_bin_filename(body: BinDefinition) -> str:
 @validate(json=BinDefinition)
 async def bin(request: Request, body: BinDefinition):
     filename = make_bin_filename(body)
-    return response.raw(
-        await build(
-            "bin.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            width=body.width,
-            depth=body.depth,
-            height=body.height,
-            wall_thickness=body.wall_thickness,
-            bottom_thickness=body.bottom_thickness,
-            lip_thickness=body.lip_thickness,
-            inner_rounding=body.inner_rounding,
-            outer_rounding=body.outer_rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "bin.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        width=body.width,
+        depth=body.depth,
+        height=body.height,
+        wall_thickness=body.wall_thickness,
+        bottom_thickness=body.bottom_thickness,
+        lip_thickness=body.lip_thickness,
+        inner_rounding=body.inner_rounding,
+        outer_rounding=body.outer_rounding,
     )
@@ -1,12 +1,13 @@
 from enum import StrEnum
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import inactive_parameters
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -41,6 +42,19 @@ class BoltDefinition(BaseModel):
     slot_recess_length: Annotated[float, Field(gt=0, description="Length of slot recess in mm")] = 10
 
 
+inactive_parameters(
+    "bolt.scad",
+    "hex_socket_width",
+    when=lambda params: params["head_recess_type"] != HeadRecessType.HEX.to_int(),
+)
+inactive_parameters(
+    "bolt.scad",
+    "slot_recess_width",
+    "slot_recess_length",
+    when=lambda params: params["head_recess_type"] != HeadRecessType.SLOT.to_int(),
+)
+
+
 def make_bolt_filename(body: BoltDefinition) -> str:
     parts = ["bolt", str(int(body.length))]
     
@@ -68,17 +82,15 @@ def make_bolt_filename(body: BoltDefinition) -> str:
 @validate(json=BoltDefinition)
 async def bolt(request: Request, body: BoltDefinition):
     filename = make_bolt_filename(body)
-    return response.raw(
-        await build(
-            "bolt.scad",
-            length=body.length,
-            head_type=body.head_type.to_int(),
-            head_recess_type=body.head_recess_type.to_int(),
-            head_recess_depth=body.head_recess_depth,
-            hex_socket_width=body.hex_socket_width,
-            slot_recess_width=body.slot_recess_width,
-            slot_recess_length=body.slot_recess_length,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "bolt.scad",
+        length=body.length,
+        head_type=body.head_type.to_int(),
+        head_recess_type=body.head_recess_type.to_int(),
+        head_recess_depth=body.head_recess_depth,
+        hex_socket_width=body.hex_socket_width,
+        slot_recess_width=body.slot_recess_width,
+        slot_recess_length=body.slot_recess_length,
     )
@@ -1,13 +1,14 @@
 from enum import StrEnum
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -36,6 +37,9 @@ class CableclipDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+build_size("cableclip.scad", lambda params: params["clips"])
+
+
 def make_cableclip_filename(body: CableclipDefinition) -> str:
     parts = ["cableclip", f"{int(body.cable_diameter)}mm"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -64,21 +68,19 @@ def make_cableclip_filename(body: CableclipDefinition) -> str:
 @validate(json=CableclipDefinition)
 async def cableclip(request: Request, body: CableclipDefinition):
     filename = make_cableclip_filename(body)
-    return response.raw(
-        await build(
-            "cableclip.scad",
-            orientation=body.orientation.to_int(),
-            clips=body.clips,
-            cable_diameter=body.cable_diameter,
-            width=body.width,
-            height=body.height,
-            thickness=body.thickness,
-            gap=body.gap,
-            lip_thickness=body.lip_thickness,
-            rounding=body.rounding,
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "cableclip.scad",
+        orientation=body.orientation.to_int(),
+        clips=body.clips,
+        cable_diameter=body.cable_diameter,
+        width=body.width,
+        height=body.height,
+        thickness=body.thickness,
+        gap=body.gap,
+        lip_thickness=body.lip_thickness,
+        rounding=body.rounding,
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
     )
@@ -1,12 +1,12 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -49,18 +49,16 @@ def make_cup_filename(body: CupDefinition) -> str:
 @validate(json=CupDefinition)
 async def cup(request: Request, body: CupDefinition):
     filename = make_cup_filename(body)
-    return response.raw(
-        await build(
-            "cup.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            inner_diameter=body.inner_diameter,
-            height=body.height,
-            wall_thickness=body.wall_thickness,
-            bottom_thickness=body.bottom_thickness,
-            inner_rounding=body.inner_rounding,
-            outer_rounding=body.outer_rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "cup.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        inner_diameter=body.inner_diameter,
+        height=body.height,
+        wall_thickness=body.wall_thickness,
+        bottom_thickness=body.bottom_thickness,
+        inner_rounding=body.inner_rounding,
+        outer_rounding=body.outer_rounding,
     )
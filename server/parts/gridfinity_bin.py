@@ -1,13 +1,14 @@
 from enum import StrEnum
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size, inactive_parameters
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -95,6 +96,40 @@ class GridfinityBinDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+inactive_parameters(
+    "gridfinity_bin.scad",
+    "bin_cd",
+    "bin_c_chamfer",
+    when=lambda params: not params["bin_cut_cylinders"],
+)
+inactive_parameters(
+    "gridfinity_bin.scad",
+    "bin_style_tab",
+    "bin_place_tab",
+    "bin_scoop",
+    when=lambda params: params["bin_cut_cylinders"],
+)
+# Solid bins have no compartments at all
+inactive_parameters(
+    "gridfinity_bin.scad",
+    "bin_cut_cylinders",
+    "bin_cd",
+    "bin_c_chamfer",
+    "bin_style_tab",
+    "bin_place_tab",
+    "bin_scoop",
+    when=lambda params: params["bin_divx"] == 0 or params["bin_divy"] == 0,
+)
+
+build_size(
+    "gridfinity_bin.scad",
+    lambda params: params["bin_gridx"]
+    * params["bin_gridy"]
+    * max(params["bin_divx"], 1)
+    * max(params["bin_divy"], 1),
+)
+
+
 def make_gridfinity_bin_filename(body: GridfinityBinDefinition) -> str:
     parts = ["gridfinity-bin", f"{body.gridx}x{body.gridy}x{body.gridz}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -126,37 +161,35 @@ def make_gridfinity_bin_filename(body: GridfinityBinDefinition) -> str:
 @validate(json=GridfinityBinDefinition)
 async def gridfinity_bin(request: Request, body: GridfinityBinDefinition):
     filename = make_gridfinity_bin_filename(body)
-    return response.raw(
-        await build(
-            "gridfinity_bin.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            bin_gridx=body.gridx,
-            bin_gridy=body.gridy,
-            bin_gridz=body.gridz,
-            bin_gridz_define=body.gridz_define.to_int(),
-            bin_height_internal=body.height_internal,
-            bin_enable_zsnap=body.enable_zsnap,
-            bin_include_lip=body.include_lip,
-            bin_divx=body.divx,
-            bin_divy=body.divy,
-            bin_cut_cylinders=body.cut_cylinders,
-            bin_cd=body.cd,
-            bin_c_chamfer=body.c_chamfer,
-            bin_style_tab=body.style_tab.to_int(),
-            bin_place_tab=body.place_tab.to_int(),
-            bin_scoop=body.scoop,
-            bin_only_corners=body.only_corners,
-            bin_refined_holes=body.refined_holes,
-            bin_magnet_holes=body.magnet_holes,
-            bin_screw_holes=body.screw_holes,
-            bin_crush_ribs=body.crush_ribs,
-            bin_chamfer_holes=body.chamfer_holes,
-            bin_printable_hole_top=body.printable_hole_top,
-            bin_enable_thumbscrew=body.enable_thumbscrew,
-            bin_wall_thickness=body.wall_thickness,
-            bin_bottom_thickness=body.bottom_thickness,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "gridfinity_bin.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        bin_gridx=body.gridx,
+        bin_gridy=body.gridy,
+        bin_gridz=body.gridz,
+        bin_gridz_define=body.gridz_define.to_int(),
+        bin_height_internal=body.height_internal,
+        bin_enable_zsnap=body.enable_zsnap,
+        bin_include_lip=body.include_lip,
+        bin_divx=body.divx,
+        bin_divy=body.divy,
+        bin_cut_cylinders=body.cut_cylinders,
+        bin_cd=body.cd,
+        bin_c_chamfer=body.c_chamfer,
+        bin_style_tab=body.style_tab.to_int(),
+        bin_place_tab=body.place_tab.to_int(),
+        bin_scoop=body.scoop,
+        bin_only_corners=body.only_corners,
+        bin_refined_holes=body.refined_holes,
+        bin_magnet_holes=body.magnet_holes,
+        bin_screw_holes=body.screw_holes,
+        bin_crush_ribs=body.crush_ribs,
+        bin_chamfer_holes=body.chamfer_holes,
+        bin_printable_hole_top=body.printable_hole_top,
+        bin_enable_thumbscrew=body.enable_thumbscrew,
+        bin_wall_thickness=body.wall_thickness,
+        bin_bottom_thickness=body.bottom_thickness,
     )
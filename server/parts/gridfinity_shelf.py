@@ -1,12 +1,13 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated, Literal
 
-from server.openscad import build
+from server.openscad import build_size, inactive_parameters
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -31,6 +32,36 @@ class GridfinityShelfDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+# The model ignores magnet holes when the base is too thin for them
+inactive_parameters(
+    "gridfinity_shelf.scad",
+    "magnet_holes",
+    "magnet_hole_crush_ribs",
+    "magnet_hole_chamfer",
+    when=lambda params: params["base_thickness"] < 4,
+)
+inactive_parameters(
+    "gridfinity_shelf.scad",
+    "magnet_hole_crush_ribs",
+    "magnet_hole_chamfer",
+    when=lambda params: not params["magnet_holes"],
+)
+inactive_parameters(
+    "gridfinity_shelf.scad",
+    "side_thickness",
+    "side_height",
+    when=lambda params: not params["sides"],
+)
+inactive_parameters(
+    "gridfinity_shelf.scad",
+    "front_thickness",
+    "front_height",
+    when=lambda params: not params["front"],
+)
+
+build_size("gridfinity_shelf.scad", lambda params: params["gridx"] * params["gridy"])
+
+
 def make_gridfinity_shelf_filename(body: GridfinityShelfDefinition) -> str:
     parts = ["gridfinity-shelf", f"{body.gridx}x{body.gridy}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -62,28 +93,26 @@ def make_gridfinity_shelf_filename(body: GridfinityShelfDefinition) -> str:
 @validate(json=GridfinityShelfDefinition)
 async def gridfinity_shelf(request: Request, body: GridfinityShelfDefinition):
     filename = make_gridfinity_shelf_filename(body)
-    return response.raw(
-        await build(
-            "gridfinity_shelf.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            gridx=body.gridx,
-            gridy=body.gridy,
-            rear_offset=body.rear_offset,
-            max_rear_offset_fillet=body.max_rear_offset_fillet,
-            plate_thickness=body.plate_thickness,
-            base_thickness=body.base_thickness,
-            skeletonized=body.skeletonized,
-            sides=body.sides,
-            side_thickness=body.side_thickness,
-            side_height=body.side_height,
-            front=body.front,
-            front_thickness=body.front_thickness,
-            front_height=body.front_height,
-            magnet_holes=body.magnet_holes,
-            magnet_hole_crush_ribs=body.magnet_hole_crush_ribs,
-            magnet_hole_chamfer=body.magnet_hole_chamfer,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "gridfinity_shelf.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        gridx=body.gridx,
+        gridy=body.gridy,
+        rear_offset=body.rear_offset,
+        max_rear_offset_fillet=body.max_rear_offset_fillet,
+        plate_thickness=body.plate_thickness,
+        base_thickness=body.base_thickness,
+        skeletonized=body.skeletonized,
+        sides=body.sides,
+        side_thickness=body.side_thickness,
+        side_height=body.side_height,
+        front=body.front,
+        front_thickness=body.front_thickness,
+        front_height=body.front_height,
+        magnet_holes=body.magnet_holes,
+        magnet_hole_crush_ribs=body.magnet_hole_crush_ribs,
+        magnet_hole_chamfer=body.magnet_hole_chamfer,
     )
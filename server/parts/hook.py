@@ -1,12 +1,13 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -24,6 +25,9 @@ class HookDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+build_size("hook.scad", lambda params: params["hooks"])
+
+
 def make_hook_filename(body: HookDefinition) -> str:
     parts = ["hook", f"{int(body.width)}x{int(body.shank_length)}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -52,21 +56,19 @@ def make_hook_filename(body: HookDefinition) -> str:
 @validate(json=HookDefinition)
 async def hook(request: Request, body: HookDefinition):
     filename = make_hook_filename(body)
-    return response.raw(
-        await build(
-            "hook.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            hooks=body.hooks,
-            width=body.width,
-            gap=body.gap,
-            shank_length=body.shank_length,
-            shank_thickness=body.shank_thickness,
-            post_height=body.post_height,
-            post_thickness=body.post_thickness,
-            lip_thickness=body.lip_thickness,
-            rounding=body.rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "hook.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        hooks=body.hooks,
+        width=body.width,
+        gap=body.gap,
+        shank_length=body.shank_length,
+        shank_thickness=body.shank_thickness,
+        post_height=body.post_height,
+        post_thickness=body.post_thickness,
+        lip_thickness=body.lip_thickness,
+        rounding=body.rounding,
     )
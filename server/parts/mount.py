@@ -1,13 +1,13 @@
 from enum import StrEnum
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -91,17 +91,15 @@ def make_mount_filename(body: MountDefinition) -> str:
 @validate(json=MountDefinition)
 async def mount(request: Request, body: MountDefinition):
     filename = make_mount_filename(body)
-    return response.raw(
-        await build(
-            "hanger_mount.scad",
-            hanger_mount_holes=str([hole.as_list() for hole in body.holes]),
-            hanger_mount_plate_thickness=body.plate_thickness,
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            hanger_mount_minimum_width=body.minimum_width,
-            hanger_mount_minimum_height=body.minimum_height,
-            hanger_mount_bolt_notch=body.bolt_notch,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "hanger_mount.scad",
+        hanger_mount_holes=str([hole.as_list() for hole in body.holes]),
+        hanger_mount_plate_thickness=body.plate_thickness,
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        hanger_mount_minimum_width=body.minimum_width,
+        hanger_mount_minimum_height=body.minimum_height,
+        hanger_mount_bolt_notch=body.bolt_notch,
     )
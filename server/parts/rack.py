@@ -1,12 +1,13 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size, inactive_parameters
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -24,6 +25,16 @@ class RackDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+inactive_parameters(
+    "rack.scad",
+    "lip_height",
+    "lip_thickness",
+    when=lambda params: not params["lip"],
+)
+
+build_size("rack.scad", lambda params: params["slots"])
+
+
 def make_rack_filename(body: RackDefinition) -> str:
     parts = ["rack", f"{body.slots}slot"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -52,21 +63,19 @@ def make_rack_filename(body: RackDefinition) -> str:
 @validate(json=RackDefinition)
 async def rack(request: Request, body: RackDefinition):
     filename = make_rack_filename(body)
-    return response.raw(
-        await build(
-            "rack.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            slots=body.slots,
-            slot_width=body.slot_width,
-            divider_width=body.divider_width,
-            divider_length=body.divider_length,
-            divider_thickness=body.divider_thickness,
-            lip=body.lip,
-            lip_height=body.lip_height,
-            lip_thickness=body.lip_thickness,
-            rounding=body.rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "rack.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        slots=body.slots,
+        slot_width=body.slot_width,
+        divider_width=body.divider_width,
+        divider_length=body.divider_length,
+        divider_thickness=body.divider_thickness,
+        lip=body.lip,
+        lip_height=body.lip_height,
+        lip_thickness=body.lip_thickness,
+        rounding=body.rounding,
     )
@@ -1,12 +1,13 @@
 from pydantic import BaseModel, Field
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -48,19 +49,17 @@ def make_shelf_filename(body: ShelfDefinition) -> str:
 @validate(json=ShelfDefinition)
 async def shelf(request: Request, body: ShelfDefinition):
     filename = make_shelf_filename(body)
-    return response.raw(
-        await build(
-            "shelf.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            width=body.width,
-            depth=body.depth,
-            thickness=body.thickness,
-            rear_fillet_radius=body.rear_fillet_radius,
-            rounding=body.rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "shelf.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        width=body.width,
+        depth=body.depth,
+        thickness=body.thickness,
+        rear_fillet_radius=body.rear_fillet_radius,
+        rounding=body.rounding,
     )
 
 
@@ -82,6 +81,9 @@ class HoleShelfDefinition(BaseModel):
     variant: Variant = Variant.ORIGINAL
 
 
+build_size("hole_shelf.scad", lambda params: params["columns"] * params["rows"])
+
+
 def make_hole_shelf_filename(body: HoleShelfDefinition) -> str:
     parts = ["hole-shelf", f"{body.rows}x{body.columns}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -110,26 +112,24 @@ def make_hole_shelf_filename(body: HoleShelfDefinition) -> str:
 @validate(json=HoleShelfDefinition)
 async def hole_shelf(request: Request, body: HoleShelfDefinition):
     filename = make_hole_shelf_filename(body)
-    return response.raw(
-        await build(
-            "hole_shelf.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            columns=body.columns,
-            rows=body.rows,
-            thickness=body.thickness,
-            hole_radius=body.hole_radius,
-            column_gap=body.column_gap,
-            row_gap=body.row_gap,
-            front_gap=body.front_gap,
-            rear_gap=body.rear_gap,
-            side_gap=body.side_gap,
-            stagger=body.stagger,
-            rear_fillet_radius=body.rear_fillet_radius,
-            rounding=body.rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "hole_shelf.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        columns=body.columns,
+        rows=body.rows,
+        thickness=body.thickness,
+        hole_radius=body.hole_radius,
+        column_gap=body.column_gap,
+        row_gap=body.row_gap,
+        front_gap=body.front_gap,
+        rear_gap=body.rear_gap,
+        side_gap=body.side_gap,
+        stagger=body.stagger,
+        rear_fillet_radius=body.rear_fillet_radius,
+        rounding=body.rounding,
     )
 
 
@@ -178,23 +178,21 @@ def make_slot_shelf_filename(body: SlotShelfDefinition) -> str:
 @validate(json=SlotShelfDefinition)
 async def slot_shelf(request: Request, body: SlotShelfDefinition):
     filename = make_slot_shelf_filename(body)
-    return response.raw(
-        await build(
-            "slot_shelf.scad",
-            hanger_tolerance=body.hanger_tolerance,
-            variant=body.variant.to_int(),
-            slots=body.slots,
-            thickness=body.thickness,
-            slot_length=body.slot_length,
-            slot_width=body.slot_width,
-            slot_rounding=body.slot_rounding,
-            gap=body.gap,
-            front_gap=body.front_gap,
-            rear_gap=body.rear_gap,
-            side_gap=body.side_gap,
-            rear_fillet_radius=body.rear_fillet_radius,
-            rounding=body.rounding,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "slot_shelf.scad",
+        hanger_tolerance=body.hanger_tolerance,
+        variant=body.variant.to_int(),
+        slots=body.slots,
+        thickness=body.thickness,
+        slot_length=body.slot_length,
+        slot_width=body.slot_width,
+        slot_rounding=body.slot_rounding,
+        gap=body.gap,
+        front_gap=body.front_gap,
+        rear_gap=body.rear_gap,
+        side_gap=body.side_gap,
+        rear_fillet_radius=body.rear_fillet_radius,
+        rounding=body.rounding,
     )
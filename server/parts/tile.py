@@ -1,12 +1,13 @@
 from pydantic import BaseModel, Field, field_validator
-from sanic import Blueprint, response
+from sanic import Blueprint
 from sanic.request import Request
 from sanic_ext import openapi, validate
 from typing import Annotated
 
-from server.openscad import build
+from server.openscad import build_size, tile_units
 from server.enums import Variant
 from server.api import api_bp
+from server.formats import model_response
 
 
 @openapi.component
@@ -39,6 +40,9 @@ class TileDefinition(BaseModel):
         return value
 
 
+build_size("tile.scad", tile_units)
+
+
 def make_tile_filename(body: TileDefinition) -> str:
     parts = ["tile", f"{body.columns}x{body.rows}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -84,6 +88,9 @@ class GridTileDefinition(BaseModel):
         return value
 
 
+build_size("grid_tile.scad", tile_units)
+
+
 def make_grid_tile_filename(body: GridTileDefinition) -> str:
     parts = ["grid-tile", f"{body.columns}x{body.rows}"]
     parts.append("original" if body.variant.to_int() == 0 else "thicker_cleats")
@@ -113,26 +120,24 @@ def make_grid_tile_filename(body: GridTileDefinition) -> str:
 async def tile(request: Request, body: TileDefinition):
     skip_list = ",".join(repr(entry) for entry in body.skip_list)
     filename = make_tile_filename(body)
-    return response.raw(
-        await build(
-            "tile.scad",
-            variant=body.variant.to_int(),
-            columns=body.columns,
-            rows=body.rows,
-            fill_top=body.fill_top,
-            fill_bottom=body.fill_bottom,
-            fill_left=body.fill_left,
-            fill_right=body.fill_right,
-            reverse_stagger=body.reverse_stagger,
-            exact_width=body.exact_width,
-            mounting_hole_shank_diameter=body.mounting_hole_shank_diameter,
-            mounting_hole_head_diameter=body.mounting_hole_head_diameter,
-            mounting_hole_inset_depth=body.mounting_hole_inset_depth,
-            mounting_hole_countersink_depth=body.mounting_hole_countersink_depth,
-            skip_list=skip_list,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "tile.scad",
+        variant=body.variant.to_int(),
+        columns=body.columns,
+        rows=body.rows,
+        fill_top=body.fill_top,
+        fill_bottom=body.fill_bottom,
+        fill_left=body.fill_left,
+        fill_right=body.fill_right,
+        reverse_stagger=body.reverse_stagger,
+        exact_width=body.exact_width,
+        mounting_hole_shank_diameter=body.mounting_hole_shank_diameter,
+        mounting_hole_head_diameter=body.mounting_hole_head_diameter,
+        mounting_hole_inset_depth=body.mounting_hole_inset_depth,
+        mounting_hole_countersink_depth=body.mounting_hole_countersink_depth,
+        skip_list=skip_list,
     )
 
 
@@ -144,18 +149,16 @@ async def tile(request: Request, body: TileDefinition):
 async def grid_tile(request: Request, body: GridTileDefinition):
     skip_list = ",".join(repr(entry) for entry in body.skip_list)
     filename = make_grid_tile_filename(body)
-    return response.raw(
-        await build(
-            "grid_tile.scad",
-            variant=body.variant.to_int(),
-            columns=body.columns,
-            rows=body.rows,
-            mounting_hole_shank_diameter=body.mounting_hole_shank_diameter,
-            mounting_hole_head_diameter=body.mounting_hole_head_diameter,
-            mounting_hole_inset_depth=body.mounting_hole_inset_depth,
-            mounting_hole_countersink_depth=body.mounting_hole_countersink_depth,
-            skip_list=skip_list,
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await model_response(
+        request,
+        filename,
+        "grid_tile.scad",
+        variant=body.variant.to_int(),
+        columns=body.columns,
+        rows=body.rows,
+        mounting_hole_shank_diameter=body.mounting_hole_shank_diameter,
+        mounting_hole_head_diameter=body.mounting_hole_head_diameter,
+        mounting_hole_inset_depth=body.mounting_hole_inset_depth,
+        mounting_hole_countersink_depth=body.mounting_hole_countersink_depth,
+        skip_list=skip_list,
     )
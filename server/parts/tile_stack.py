@@ -1,16 +1,18 @@
-import asyncio
-import io
-import zipfile
+import functools
+import math
 from enum import StrEnum
 from typing import Annotated
 
+import numpy as np
 from pydantic import BaseModel, Field, field_validator
-from sanic import response
 from sanic.request import Request
 from sanic_ext import openapi, validate
+from server import mesh
 from server.api import api_bp
+from server.archive import write_zip
 from server.enums import Variant
-from server.openscad import build
+from server.formats import artifact_response, exported_response
+from server.openscad import build_size, derive, export, inactive_parameters, tile_units
 
 
 @openapi.component
@@ -26,6 +28,10 @@ class StackPart(StrEnum):
     ALL = "all"
 
 
+# Longest pull tab allowed, so the space the tabs may take is known from the footprint
+max_tab_len = 100
+
+
 @openapi.component
 class TileStackDefinition(BaseModel):
     tile_kind: TileKind = TileKind.HEX
@@ -43,7 +49,7 @@ class TileStackDefinition(BaseModel):
 
     enable_pull_tabs: bool = True
     tab_side: Annotated[str, Field(description="right, left, front, or back")] = "right"
-    tab_len: Annotated[float, Field(gt=0)] = 22
+    tab_len: Annotated[float, Field(gt=0, le=max_tab_len)] = 22
     tab_support_tile_gap: Annotated[float, Field(ge=0)] = 1.5
 
     columns: Annotated[int, Field(gt=0, description="Tile columns in units")] = 4
@@ -78,6 +84,52 @@ class TileStackDefinition(BaseModel):
         return value
 
 
+inactive_parameters(
+    "tile_stack.scad",
+    "tab_side",
+    "tab_len",
+    "tab_support_tile_gap",
+    when=lambda params: not params["enable_pull_tabs"],
+)
+# The PLA part has no separators and the PETG part has no tab supports
+inactive_parameters(
+    "tile_stack.scad",
+    "spacer_xy_delta",
+    when=lambda params: params["part"] == "pla",
+)
+# The PETG separators only follow the cell outlines and the hole reliefs
+inactive_parameters(
+    "tile_stack.scad",
+    "tab_support_tile_gap",
+    "variant",
+    "fill_top",
+    "fill_bottom",
+    "fill_left",
+    "fill_right",
+    "mounting_hole_inset_depth",
+    "mounting_hole_countersink_depth",
+    when=lambda params: params["part"] == "petg",
+)
+inactive_parameters(
+    "tile_stack.scad",
+    "fill_top",
+    "fill_bottom",
+    "fill_left",
+    "fill_right",
+    "reverse_stagger",
+    "exact_width",
+    when=lambda params: params["tile_kind"] == "grid",
+)
+inactive_parameters(
+    "tile_stack.scad",
+    "mounting_hole_shank_diameter",
+    "mounting_hole_head_diameter",
+    when=lambda params: params["tile_kind"] == "grid" and params["part"] == "petg",
+)
+
+build_size("tile_stack.scad", lambda params: params["stack_count"] * tile_units(params))
+
+
 def make_tile_stack_filename(body: TileStackDefinition) -> str:
     variant = "original" if body.variant.to_int() == 0 else "thicker_cleats"
     return (
@@ -117,6 +169,82 @@ def tile_stack_build_params(body: TileStackDefinition, part: StackPart) -> dict:
     }
 
 
+def stack_split_offset(body: TileStackDefinition) -> int:
+    """
+    How far to move the PETG part so it can be split from the PLA part afterwards
+
+    This is at least twice the furthest either part reaches from the origin along X.
+    It only depends on the footprint, taking the longest tab allowed, so parameters that
+    only change the spacers do not move them.
+    """
+    return 2 * math.ceil((body.columns + body.rows + 2) * 42 + max_tab_len + 100)
+
+
+def stack_parts(stl: bytes, offset: int) -> list[mesh.MeshPart]:
+    pla, petg = mesh.split(mesh.read_stl(stl), offset)
+    return [
+        mesh.MeshPart("PLA tiles", pla, "PLA", "#D3D3D3"),
+        mesh.MeshPart("PETG spacers", petg, "PETG", "#FFA500"),
+    ]
+
+
+def convert_stack(stl: bytes, export_format: str, offset: int, name: str) -> bytes:
+    """
+    Convert a build of both parts, putting the PETG part back in place
+
+    Formats other than 3MF have no objects, so both parts are written into the same mesh
+    as separate shells. They are not joined into one solid.
+    """
+    parts = stack_parts(stl, offset)
+    if export_format == "3mf":
+        return mesh.write_3mf(parts)
+    return mesh.write(np.concatenate([part.triangles for part in parts]), export_format, name)
+
+
+def zip_stack(stl: bytes, offset: int, basename: str) -> bytes:
+    pla, petg = stack_parts(stl, offset)
+
+    def entries():
+        yield f"{basename}.stl", mesh.write_binary_stl(pla.triangles)
+        yield f"{basename}-spacers.stl", mesh.write_binary_stl(petg.triangles)
+
+    return write_zip(entries())
+
+
+async def export_tile_stack(
+    body: TileStackDefinition, export_format: str, encoding: str | None = None, quality: str = "standard"
+) -> bytes:
+    """
+    Build a tile stack in the given format
+
+    Both parts are built together, with the PETG part moved out of the way so they can
+    be separated again. 3MF files keep them as separate objects with their materials.
+    """
+    params = tile_stack_build_params(body, body.part)
+    if body.part != StackPart.ALL:
+        return await export(
+            "tile_stack.scad", export_format, encoding=encoding, quality=quality, **params
+        )
+
+    offset = stack_split_offset(body)
+    convert = functools.partial(
+        convert_stack,
+        export_format=export_format,
+        offset=offset,
+        name=make_tile_stack_basename(body),
+    )
+    return await derive(
+        "tile_stack.scad",
+        f"{export_format}-parts",
+        export_format,
+        convert,
+        encoding=encoding,
+        quality=quality,
+        split_offset=offset,
+        **params,
+    )
+
+
 def make_tile_stack_basename(body: TileStackDefinition) -> str:
     variant = "original" if body.variant.to_int() == 0 else "thicker-cleats"
     return (
@@ -135,13 +263,8 @@ def make_tile_stack_basename(body: TileStackDefinition) -> str:
 async def tile_stack(request: Request, body: TileStackDefinition):
     filename = make_tile_stack_filename(body)
 
-    return response.raw(
-        await build(
-            "tile_stack.scad",
-            **tile_stack_build_params(body, body.part),
-        ),
-        content_type="model/stl",
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    return await exported_response(
+        request, filename, functools.partial(export_tile_stack, body)
     )
 
 
@@ -156,26 +279,16 @@ async def tile_stack(request: Request, body: TileStackDefinition):
 async def tile_stack_bundle(request: Request, body: TileStackDefinition):
     basename = make_tile_stack_basename(body)
 
-    pla_task = build(
-        "tile_stack.scad",
-        **tile_stack_build_params(body, StackPart.PLA),
-    )
-    petg_task = build(
+    offset = stack_split_offset(body)
+
+    # Both parts come from one build, split apart and zipped as separate STLs
+    bundle = await derive(
         "tile_stack.scad",
-        **tile_stack_build_params(body, StackPart.PETG),
+        "zip-parts",
+        "zip",
+        functools.partial(zip_stack, offset=offset, basename=basename),
+        split_offset=offset,
+        **tile_stack_build_params(body, StackPart.ALL),
     )
 
-    pla_stl, petg_stl = await asyncio.gather(pla_task, petg_task)
-
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
-        zf.writestr(f"{basename}.stl", pla_stl)
-        zf.writestr(f"{basename}-spacers.stl", petg_stl)
-
-    return response.raw(
-        buf.getvalue(),
-        content_type="application/zip",
-        headers={
-            "Content-Disposition": f'attachment; filename="{basename}.zip"',
-        },
-    )
+    return await artifact_response(request, bundle, "application/zip", f"{basename}.zip")
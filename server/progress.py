@@ -0,0 +1,81 @@
+"""
+Progress of artifacts being produced
+
+Long builds report what they are doing so clients can follow them rather than wait on a
+silent request. Each artifact being produced has a Progress that every request waiting
+for it follows, and an artifact converted from another follows that one in turn.
+"""
+
+import asyncio
+from collections.abc import Awaitable
+import contextvars
+import time
+from typing import TypeVar
+
+
+T = TypeVar("T")
+
+
+class Progress:
+    """
+    Latest state of an artifact being produced
+
+    The state always has a `phase`, one of queued, evaluating, rendering, exporting and
+    compressing. While queued it also has the `position` in line, and `finish_by` is the
+    monotonic time the artifact is estimated to be ready by. Updates are passed on to
+    every follower.
+    """
+
+    def __init__(self):
+        self.state = {"phase": "queued"}
+        self.followers: set[Progress] = set()
+        self.changed = asyncio.Event()
+
+    def update(self, **state):
+        self.state = {**self.state, **state}
+        self.changed.set()
+        for follower in self.followers:
+            follower.update(**state)
+
+    def follow(self, other: "Progress"):
+        """Take on the updates of `other`, starting with its current state."""
+        other.followers.add(self)
+        self.update(**other.state)
+
+    def snapshot(self) -> dict:
+        """The state to send to a client, with the estimate as seconds remaining."""
+        state = dict(self.state)
+        finish_by = state.pop("finish_by", None)
+        if finish_by is not None:
+            state["remaining"] = round(max(finish_by - time.monotonic(), 0.0), 1)
+        return state
+
+    async def wait(self, timeout: float):
+        """Wait until the state changes or `timeout` seconds pass."""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except TimeoutError:
+            pass
+        self.changed.clear()
+
+
+# Progress of the artifact being produced in the current task, if anything follows it
+current: contextvars.ContextVar[Progress | None] = contextvars.ContextVar("progress", default=None)
+
+
+def report(**state):
+    """Update the progress of the artifact being produced in the current task."""
+    progress = current.get()
+    if progress is not None:
+        progress.update(**state)
+
+
+def estimate(seconds: float) -> float:
+    """Monotonic time something `seconds` from now will be done by, for `finish_by`."""
+    return time.monotonic() + seconds
+
+
+async def tracked(progress: Progress, awaitable: Awaitable[T]) -> T:
+    """Await `awaitable`, reporting its progress to `progress`."""
+    current.set(progress)
+    return await awaitable
@@ -0,0 +1,299 @@
+"""
+Placement of OpenSCAD builds on the host CPUs
+"""
+
+from contextlib import contextmanager
+import logging
+import os
+import resource
+import shutil
+from typing import NamedTuple
+
+from server.locks import HostSum
+
+
+logger = logging.getLogger("scheduler")
+
+
+def available_cpus() -> list[int]:
+    """CPUs this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def available_memory() -> int | None:
+    """Memory available for new processes in bytes, if it can be determined."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_AVPHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def oom_kills() -> int | None:
+    """Processes in this process's cgroup killed by the OOM killer, if it can be determined."""
+    try:
+        with open("/proc/self/cgroup") as f:
+            paths = [line[3:].strip() for line in f if line.startswith("0::")]
+        if not paths:
+            return None
+        with open(f"/sys/fs/cgroup{paths[0]}/memory.events") as f:
+            for line in f:
+                if line.startswith("oom_kill "):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def default_max_builds(cpus: int, memory: int | None, build_memory: int) -> int:
+    """One build per CPU, reduced if there is not enough memory for that many."""
+    builds = cpus
+    if memory is not None and build_memory > 0:
+        builds = min(builds, memory // build_memory)
+    return max(1, builds)
+
+
+class BuildScheduler:
+    """
+    Decides how many threads a build may use and which CPUs it runs on
+
+    Each build slot owns an equal share of the CPUs. When the host is busy each build is
+    pinned to its slot's share so concurrent builds do not fight over cores ("many
+    small jobs"). When a build starts on an otherwise idle host it gets every CPU so a
+    single large model can use the multi-threaded backend fully ("few huge jobs").
+
+    The manifold backend uses TBB, which sizes its thread pool from the CPU affinity of
+    the process, so pinning is what actually enforces the budget. OMP_NUM_THREADS is
+    also set for builds linked against OpenMP.
+
+    Builds are also limited to `cpu_seconds` of CPU time and `memory_bytes` of address
+    space. Either limit is disabled by 0. The CPU set and limits are applied by starting
+    the build through taskset and prlimit from util-linux, which set them on themselves
+    and exec the build, so they hold before it starts without running code in the forked
+    child.
+    """
+
+    def __init__(
+        self,
+        cpus: list[int],
+        max_builds: int,
+        pin: bool = True,
+        cpu_seconds: int = 0,
+        memory_bytes: int = 0,
+    ):
+        self.cpus = cpus
+        self.max_builds = max_builds
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.taskset = shutil.which("taskset")
+        self.prlimit = shutil.which("prlimit")
+        if (self.pin and not self.taskset) or ((cpu_seconds or memory_bytes) and not self.prlimit):
+            logger.warning("taskset or prlimit not found, build limits are applied once builds have started")
+        self.small = 0
+        self.large = 0
+
+    def slot_cpus(self, slot: int) -> list[int]:
+        count = len(self.cpus)
+        start = slot * count // self.max_builds
+        end = (slot + 1) * count // self.max_builds
+        # With more slots than CPUs some slots share a CPU
+        return self.cpus[start:end] or [self.cpus[slot % count]]
+
+    def place(self, slot: int, busy: bool) -> tuple[int, list[int] | None]:
+        """
+        Return the thread budget and CPU set for a build in `slot`
+
+        `busy` is whether other builds are running or waiting. The CPU set is None when
+        the build should not be pinned.
+        """
+        if busy:
+            self.small += 1
+            cpus = self.slot_cpus(slot)
+        else:
+            self.large += 1
+            cpus = self.cpus
+
+        return len(cpus), cpus if self.pin else None
+
+    def environment(self, threads: int) -> dict[str, str]:
+        env = dict(os.environ)
+        env["OMP_NUM_THREADS"] = str(threads)
+        return env
+
+    def command(self, cmd: list[str], cpus: list[int] | None) -> list[str]:
+        """Wrap `cmd` so it starts with the CPU set and resource limits already applied."""
+        if cpus is not None and self.taskset:
+            cmd = [self.taskset, "--cpu-list", ",".join(map(str, cpus)), *cmd]
+        limits = []
+        if self.cpu_seconds:
+            limits.append(f"--cpu={self.cpu_seconds}")
+        if self.memory_bytes:
+            limits.append(f"--as={self.memory_bytes}")
+        if limits and self.prlimit:
+            cmd = [self.prlimit, *limits, *cmd]
+        return cmd
+
+    def apply(self, pid: int, cpus: list[int] | None):
+        """
+        Apply what command() could not to a build process that has started
+
+        This is only needed without taskset or prlimit, and leaves the build unlimited
+        until it is done. It is done from the parent rather than in a preexec_fn, which is
+        not safe in a process running threads. The process may already have exited.
+        """
+        try:
+            if cpus is not None and not self.taskset:
+                os.sched_setaffinity(pid, cpus)
+            if self.prlimit:
+                return
+            if self.cpu_seconds:
+                resource.prlimit(pid, resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds))
+            if self.memory_bytes:
+                resource.prlimit(pid, resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes))
+        except ProcessLookupError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "cpus": len(self.cpus),
+            "max_builds": self.max_builds,
+            "pinned": self.pin,
+            "small_builds": self.small,
+            "large_builds": self.large,
+        }
+
+
+class BuildJob(NamedTuple):
+    """A kind of build, such as STLs of one model, and the size of one instance."""
+
+    name: str
+    size: float
+
+
+class CostModel:
+    """
+    Estimates how long builds will take
+
+    Each kind of build keeps an exponentially weighted average of the seconds taken per
+    unit of size, learned from completed builds. Kinds that have not been built yet use
+    the average rate of those that have.
+    """
+
+    def __init__(self, alpha: float = 0.2, default_rate: float = 1.0):
+        self.alpha = alpha
+        self.default_rate = default_rate
+        self.rates: dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        if name in self.rates:
+            return self.rates[name]
+        if self.rates:
+            return sum(self.rates.values()) / len(self.rates)
+        return self.default_rate
+
+    def sampled(self, name: str) -> bool:
+        """Whether builds of this kind have been timed, rather than estimated from others."""
+        return name in self.rates
+
+    def estimate(self, job: BuildJob) -> float:
+        """Estimated build time in seconds."""
+        return self.rate(job.name) * job.size
+
+    def record(self, job: BuildJob, duration: float):
+        rate = duration / max(job.size, 1)
+        previous = self.rates.get(job.name)
+        self.rates[job.name] = rate if previous is None else previous + self.alpha * (rate - previous)
+
+    def stats(self) -> dict:
+        return dict(sorted(self.rates.items()))
+
+
+class AdmissionControl:
+    """
+    Decides whether a build should be queued at all
+
+    Builds estimated to take longer than `max_build_seconds` are refused outright. Other
+    builds are refused while the estimated time to work through the builds already
+    queued exceeds `max_queue_seconds`, so clients back off instead of waiting on a queue
+    that would time them out. Either limit is disabled by 0.
+
+    The queue is counted across every worker on the host with `shared`, since they share
+    the `capacity` build slots. Without it only this worker's queue is counted.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        max_build_seconds: float,
+        max_queue_seconds: float,
+        shared: HostSum | None = None,
+    ):
+        self.capacity = capacity
+        self.max_build_seconds = max_build_seconds
+        self.max_queue_seconds = max_queue_seconds
+        self.shared = shared
+        self.queued_seconds = 0.0
+        self.too_large_count = 0
+        self.busy_count = 0
+
+    def host_queued_seconds(self) -> float:
+        if self.shared is None:
+            return self.queued_seconds
+        try:
+            return self.shared.total()
+        except OSError:
+            logger.exception("Unable to read the queues of other workers")
+            return self.queued_seconds
+
+    def publish(self):
+        if self.shared is None:
+            return
+        try:
+            self.shared.publish(self.queued_seconds)
+        except OSError:
+            logger.exception("Unable to share the queue with other workers")
+
+    def expected_wait(self) -> float:
+        """Estimated seconds until the builds queued on the host have finished."""
+        return self.host_queued_seconds() / self.capacity
+
+    def too_large(self, estimate: float) -> bool:
+        if self.max_build_seconds and estimate > self.max_build_seconds:
+            self.too_large_count += 1
+            return True
+        return False
+
+    def busy(self) -> bool:
+        if self.max_queue_seconds and self.expected_wait() > self.max_queue_seconds:
+            self.busy_count += 1
+            return True
+        return False
+
+    @contextmanager
+    def queued(self, estimate: float):
+        """Count a build towards the queue while it is waiting or running."""
+        self.queued_seconds += estimate
+        self.publish()
+        try:
+            yield
+        finally:
+            self.queued_seconds -= estimate
+            self.publish()
+
+    def stats(self) -> dict:
+        return {
+            "queued_seconds": self.queued_seconds,
+            "expected_wait": self.expected_wait(),
+            "too_large": self.too_large_count,
+            "busy": self.busy_count,
+        }
@@ -2,12 +2,14 @@
 Web-based GOEWS model generator
 """
 
+import math
 from pathlib import Path
 
 from sanic import Sanic, response
 from sanic_ext import Extend, openapi
 
 from server.api import api_bp
+from server.openscad import BuildQueueFull, BuildSuperseded, BuildTimeout, BuildTooLarge, ModelError, OpenSCADError
 
 top_dir = (Path(__file__) / "../..").resolve()
 frontend_dir = top_dir / "frontend/dist"
@@ -34,7 +36,34 @@ async def main(request):
     return await response.file(frontend_dir / "index.html")
 
 
+# HTTP status for each kind of build failure. Anything else is a server error
+build_error_status = {
+    ModelError: 422,
+    BuildTooLarge: 422,
+    BuildTimeout: 504,
+    BuildQueueFull: 503,
+    BuildSuperseded: 409,
+}
+
+
+@app.exception(OpenSCADError)
+async def build_error(request, exception: OpenSCADError):
+    status = next(
+        (status for error, status in build_error_status.items() if isinstance(exception, error)),
+        500,
+    )
+    headers = {}
+    if isinstance(exception, BuildQueueFull):
+        headers["Retry-After"] = str(max(1, math.ceil(exception.retry_after)))
+    return response.json(
+        {"description": "Build failed", "status": status, "message": str(exception), "code": exception.code},
+        status=status,
+        headers=headers,
+    )
+
+
 # Get the API calls loaded
+import server.artifacts
 import server.parts.bin
 import server.parts.bolt
 import server.parts.cableclip
@@ -47,6 +76,7 @@ import server.parts.rack
 import server.parts.shelf
 import server.parts.tile
 import server.parts.tile_stack
+import server.status
 
 # Register the blueprint after routes are added
 app.blueprint(api_bp)
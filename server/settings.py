@@ -0,0 +1,100 @@
+"""
+Server settings
+
+Settings are read from the environment so they can be adjusted per host, for example
+with `Environment=` lines in the Systemd unit.
+"""
+
+import os
+from pathlib import Path
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+def env_path(name: str, default: Path) -> Path:
+    value = os.environ.get(name)
+    return Path(value) if value else default
+
+
+# Where generated artifacts are kept between restarts. Systemd sets CACHE_DIRECTORY
+# when the unit uses CacheDirectory=
+cache_dir = env_path(
+    "GOEWS_CACHE_DIR",
+    env_path("CACHE_DIRECTORY", Path.home() / ".cache" / "goews"),
+)
+
+# Part of every artifact key. Change it to stop using every cached artifact, for
+# example after changing something the keys do not cover
+cache_version = os.environ.get("GOEWS_CACHE_VERSION", "")
+
+# Seconds clients and proxies may keep an artifact. Artifacts never change under their
+# name, so this is a year by default
+artifact_max_age = env_int("GOEWS_ARTIFACT_MAX_AGE", 365 * 24 * 60 * 60)
+
+# Maximum size of the on-disk artifact cache. Set to 0 to disable it
+cache_max_bytes = env_int("GOEWS_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+
+# Shared memory artifact cache used by all workers on the host. This should be on a
+# tmpfs. Set the size to 0 to disable it
+shared_cache_dir = env_path("GOEWS_SHARED_CACHE_DIR", Path("/dev/shm") / f"goews-{os.getuid()}")
+shared_cache_max_bytes = env_int(
+    "GOEWS_SHARED_CACHE_MAX_BYTES",
+    512 * 1024 * 1024 if shared_cache_dir.parent.is_dir() else 0,
+)
+
+# Number of decimal places floating point parameters are rounded to. Differences below
+# this are not meaningful for a printed part and would only split the caches
+float_precision = env_int("GOEWS_FLOAT_PRECISION", 3)
+
+# Per worker in-memory cache budgets in bytes for models and screenshots
+memory_cache_stl_bytes = env_int("GOEWS_MEMORY_CACHE_STL_BYTES", 256 * 1024 * 1024)
+memory_cache_png_bytes = env_int("GOEWS_MEMORY_CACHE_PNG_BYTES", 32 * 1024 * 1024)
+
+# Artifacts at least this many bytes are spooled to a temporary file while OpenSCAD
+# writes them rather than collected in memory, and are sent to clients in chunks
+stream_min_bytes = env_int("GOEWS_STREAM_MIN_BYTES", 4 * 1024 * 1024)
+
+# Maximum number of OpenSCAD processes running at once across all workers on the host.
+# When 0 this is sized from the available CPUs and memory
+max_builds = env_int("GOEWS_MAX_BUILDS", 0)
+
+# Memory to allow for each OpenSCAD process when sizing max_builds
+build_memory_bytes = env_int("GOEWS_BUILD_MEMORY_BYTES", 1024 * 1024 * 1024)
+
+# Pin builds to their share of the CPUs while other builds are running. Set to 0 to
+# leave placement to the kernel
+pin_builds = env_int("GOEWS_PIN_BUILDS", 1)
+
+# Queued builds are started shortest estimated build time first. Each second a build
+# waits counts against this many seconds of its estimate so large builds still get
+# their turn
+queue_aging = env_float("GOEWS_QUEUE_AGING", 1.0)
+
+# Builds estimated to take longer than this many seconds are refused. Set to 0 to allow
+# any size
+max_build_seconds = env_int("GOEWS_MAX_BUILD_SECONDS", 600)
+
+# New builds are refused with a 503 while the builds already queued in a worker are
+# estimated to take longer than this many seconds. Set to 0 to never refuse
+max_queue_seconds = env_int("GOEWS_MAX_QUEUE_SECONDS", 300)
+
+# Limits for each OpenSCAD process. Builds running longer than the timeout in seconds
+# are killed. The CPU time limit counts every thread, so it should allow for builds
+# using several CPUs. The memory limit is on address space, which is larger than the
+# memory actually used. Set any of them to 0 to disable it
+build_timeout = env_int("GOEWS_BUILD_TIMEOUT", 600)
+build_cpu_seconds = env_int("GOEWS_BUILD_CPU_SECONDS", 0)
+build_max_memory_bytes = env_int("GOEWS_BUILD_MAX_MEMORY_BYTES", 8 * 1024 * 1024 * 1024)
+
+# Builds that fail are remembered for this many seconds so retries fail straight away.
+# Set to 0 to always retry
+failure_cache_ttl = env_int("GOEWS_FAILURE_CACHE_TTL", 300)
+failure_cache_max_bytes = env_int("GOEWS_FAILURE_CACHE_MAX_BYTES", 16 * 1024 * 1024)
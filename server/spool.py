@@ -0,0 +1,55 @@
+"""
+Output buffers that move to disk when they get large
+"""
+
+import mmap
+import tempfile
+
+
+class Spool:
+    """
+    Write-only buffer kept in memory until it reaches `max_bytes`
+
+    Past that it is written to a temporary file instead and its value is returned
+    mapped, so large artifacts are never held in memory as a whole.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.chunks = []
+        self.size = 0
+        self.file = None
+
+    def write(self, data) -> int:
+        if self.file is not None:
+            return self.file.write(data)
+
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        if self.size >= self.max_bytes:
+            self.file = tempfile.TemporaryFile()
+            self.file.writelines(self.chunks)
+            self.chunks = []
+        return len(data)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def getvalue(self) -> bytes | mmap.mmap:
+        """Everything written so far. The spool must not be written to after this."""
+        if self.file is None:
+            return b"".join(self.chunks)
+        self.file.flush()
+        return mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        # Mappings returned by getvalue() stay valid after the file is closed
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
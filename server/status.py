@@ -0,0 +1,17 @@
+"""
+Server status routes
+"""
+
+from sanic import response
+from sanic.request import Request
+from sanic_ext import openapi
+
+from server.api import api_bp
+from server.openscad import build_stats, cache_stats
+
+
+@api_bp.get("/status")
+@openapi.summary("Server status")
+@openapi.description("Cache and build queue statistics for this worker")
+async def status(request: Request):
+    return response.json({"cache": cache_stats(), "builds": build_stats()})
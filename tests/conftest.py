@@ -0,0 +1,45 @@
+"""Shared test setup."""
+
+import pytest
+import server.openscad
+import server.settings
+from server.cache import DiskCache, FailureCache, SharedCache
+from server.locks import HostSemaphore, HostSum
+from server.scheduler import AdmissionControl
+
+
+@pytest.fixture(autouse=True, scope="session")
+def cache_dirs(tmp_path_factory):
+    """Keep the caches, locks, build slots and queue of every test out of the real cache directories."""
+    cache_dir = tmp_path_factory.mktemp("cache")
+    shared_cache_dir = tmp_path_factory.mktemp("shared")
+    settings = server.settings
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(settings, "cache_dir", cache_dir)
+    patch.setattr(settings, "shared_cache_dir", shared_cache_dir)
+    patch.setattr(server.openscad, "disk_cache", DiskCache(cache_dir / "artifacts", settings.cache_max_bytes))
+    patch.setattr(server.openscad, "shared_cache", SharedCache(shared_cache_dir, settings.shared_cache_max_bytes))
+    patch.setattr(
+        server.openscad,
+        "failure_cache",
+        FailureCache(cache_dir / "failures", settings.failure_cache_max_bytes, settings.failure_cache_ttl),
+    )
+    patch.setattr(server.openscad, "lock_dir", cache_dir / "locks")
+    patch.setattr(
+        server.openscad,
+        "build_semaphore",
+        HostSemaphore(cache_dir / "slots", server.openscad.max_builds, aging=settings.queue_aging),
+    )
+    patch.setattr(
+        server.openscad,
+        "admission",
+        AdmissionControl(
+            server.openscad.max_builds,
+            settings.max_build_seconds,
+            settings.max_queue_seconds,
+            HostSum(cache_dir / "queue"),
+        ),
+    )
+    yield cache_dir
+    patch.undo()
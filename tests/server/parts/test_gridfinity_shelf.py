@@ -2,6 +2,7 @@
 
 import pytest
 from pydantic import ValidationError
+from server.openscad import elide_inactive_params
 from server.parts.gridfinity_shelf import (
     GridfinityShelfDefinition, make_gridfinity_shelf_filename,
 )
@@ -231,3 +232,62 @@ class TestMakeGridfinityShelfFilename:
         assert "no_skeletonized" in filename
         assert "sides" in filename
         assert "magnet_holes" in filename
+
+
+class TestInactiveParameters:
+    """Tests for the gridfinity shelf inactive parameter rules."""
+
+    def test_magnets_dropped_on_thin_base(self):
+        """Test that magnet options are not part of the build when the base is too thin."""
+        params = elide_inactive_params(
+            "gridfinity_shelf.scad",
+            {
+                "base_thickness": 2,
+                "magnet_holes": True,
+                "magnet_hole_crush_ribs": True,
+                "magnet_hole_chamfer": False,
+                "sides": True,
+                "side_thickness": 2,
+                "side_height": 20,
+                "front": True,
+                "front_thickness": 2,
+                "front_height": 20,
+            },
+        )
+        assert "magnet_holes" not in params
+        assert "magnet_hole_crush_ribs" not in params
+        assert "magnet_hole_chamfer" not in params
+        assert params["base_thickness"] == 2
+
+    def test_magnets_kept_on_thick_base(self):
+        """Test that magnet options are kept when the base is thick enough."""
+        params = elide_inactive_params(
+            "gridfinity_shelf.scad",
+            {
+                "base_thickness": 5,
+                "magnet_holes": True,
+                "magnet_hole_crush_ribs": True,
+                "magnet_hole_chamfer": False,
+                "sides": True,
+                "front": True,
+            },
+        )
+        assert params["magnet_holes"] is True
+        assert params["magnet_hole_crush_ribs"] is True
+
+    def test_sides_and_front_dropped_when_disabled(self):
+        """Test that side and front dimensions are not part of the build when disabled."""
+        params = elide_inactive_params(
+            "gridfinity_shelf.scad",
+            {
+                "base_thickness": 0,
+                "magnet_holes": False,
+                "sides": False,
+                "side_thickness": 3,
+                "side_height": 30,
+                "front": False,
+                "front_thickness": 3,
+                "front_height": 30,
+            },
+        )
+        assert params == {"base_thickness": 0, "sides": False, "front": False}
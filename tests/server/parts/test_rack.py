@@ -2,6 +2,7 @@
 
 import pytest
 from pydantic import ValidationError
+from server.openscad import elide_inactive_params
 from server.parts.rack import RackDefinition, make_rack_filename
 from server.enums import Variant
 
@@ -117,3 +118,17 @@ class TestMakeRackFilename:
         """Test filename with custom hanger tolerance."""
         body = RackDefinition(hanger_tolerance=0.2)
         assert make_rack_filename(body) == "rack-7slot-original-hanger_tolerance_0.2.stl"
+
+
+class TestInactiveParameters:
+    """Tests for the rack inactive parameter rules."""
+
+    def test_lip_parameters_dropped_without_lip(self):
+        """Test that lip dimensions are not part of the build without a lip."""
+        params = elide_inactive_params("rack.scad", {"lip": False, "lip_height": 10, "lip_thickness": 5, "slots": 7})
+        assert params == {"lip": False, "slots": 7}
+
+    def test_lip_parameters_kept_with_lip(self):
+        """Test that lip dimensions are kept when there is a lip."""
+        params = elide_inactive_params("rack.scad", {"lip": True, "lip_height": 10, "lip_thickness": 5})
+        assert params == {"lip": True, "lip_height": 10, "lip_thickness": 5}
@@ -0,0 +1,105 @@
+"""Tests for server.parts.tile_stack module."""
+
+import io
+import zipfile
+
+import numpy as np
+import pytest
+
+import server.parts.tile_stack
+import server.server
+from server import mesh
+from server.parts.tile_stack import (
+    StackPart,
+    TileStackDefinition,
+    convert_stack,
+    max_tab_len,
+    stack_split_offset,
+    zip_stack,
+)
+
+app = server.server.app
+
+
+@pytest.fixture
+def body():
+    return TileStackDefinition(part=StackPart.ALL, columns=2, rows=2)
+
+
+@pytest.fixture
+def stl(body):
+    """A build of both parts with one PLA and two PETG triangles."""
+    offset = stack_split_offset(body)
+    triangle = [[0, 0, 0], [1, 0, 0], [1, 1, 0]]
+    moved = [[x + offset, y, z] for x, y, z in triangle]
+    return mesh.write_binary_stl(np.array([triangle, moved, moved], dtype=np.float32))
+
+
+class TestStackSplitOffset:
+    """Tests for stack_split_offset function."""
+
+    def test_clears_stack(self, body):
+        """Test that the offset is more than twice the width of the stack and its tabs."""
+        assert stack_split_offset(body) / 2 > (body.columns + 1) * 42 + max_tab_len
+
+    def test_spacers_only(self, body):
+        """Test that parameters that only change the spacers do not move them."""
+        assert stack_split_offset(body) == stack_split_offset(body.model_copy(update={"tab_len": max_tab_len}))
+
+
+class TestConvertStack:
+    """Tests for convert_stack function."""
+
+    def test_3mf_parts(self, body, stl):
+        """Test that 3MF files carry both parts as separate objects with materials."""
+        data = convert_stack(stl, "3mf", stack_split_offset(body), "stack")
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            model = zf.read("3D/3dmodel.model").decode()
+        assert model.count("<object ") == 2
+        assert '<base name="PLA"' in model
+        assert '<base name="PETG"' in model
+
+    def test_reassembled(self, body, stl):
+        """Test that other formats get both parts back in place."""
+        triangles = mesh.read_stl(convert_stack(stl, "binstl", stack_split_offset(body), "stack"))
+        assert len(triangles) == 3
+        assert triangles[:, :, 0].max() == 1
+
+    def test_zip(self, body, stl):
+        """Test that the bundle has a separate STL for each part."""
+        data = zip_stack(stl, stack_split_offset(body), "stack")
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert len(mesh.read_stl(zf.read("stack.stl"))) == 1
+            assert len(mesh.read_stl(zf.read("stack-spacers.stl"))) == 2
+
+
+class TestEndpoints:
+    """Tests for the tile stack endpoints."""
+
+    @pytest.fixture
+    def derived(self, monkeypatch, stl):
+        """Replace deriving artifacts with a recorder converting a fixed build."""
+        calls = []
+
+        async def derive(model_file, kind, ext, convert, **params):
+            calls.append((kind, params))
+            return convert(stl)
+
+        monkeypatch.setattr(server.parts.tile_stack, "derive", derive)
+        return calls
+
+    def test_3mf(self, derived):
+        """Test that a 3MF of the whole stack comes from one build of both parts."""
+        _, response = app.test_client.post("/api/tile-stack?format=3mf", json={"part": "all", "columns": 2, "rows": 2})
+        assert response.status == 200
+        assert response.headers["Content-Type"] == "model/3mf"
+        assert len(derived) == 1
+        assert derived[0][1]["part"] == "all"
+        assert derived[0][1]["split_offset"] > 0
+
+    def test_bundle(self, derived):
+        """Test that the bundle comes from one build of both parts."""
+        _, response = app.test_client.post("/api/tile-stack-bundle", json={"columns": 2, "rows": 2})
+        assert response.status == 200
+        assert response.headers["Content-Type"] == "application/zip"
+        assert [kind for kind, _ in derived] == ["zip-parts"]
@@ -0,0 +1,51 @@
+"""Tests for server.archive module."""
+
+import io
+import mmap
+import random
+import zipfile
+
+import server.settings
+from server.archive import write_zip
+
+
+class TestWriteZip:
+    """Tests for write_zip function."""
+
+    def test_entries(self):
+        """Test that every entry is written in order."""
+        data = write_zip([("a.stl", b"solid a"), ("b.stl", b"solid b")])
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.namelist() == ["a.stl", "b.stl"]
+            assert zf.read("b.stl") == b"solid b"
+            assert zf.testzip() is None
+
+    def test_compression(self):
+        """Test that entries compressed already are stored and others deflated."""
+        data = write_zip([("model.stl", b"solid" * 100), ("model.3mf", b"PK" * 100)])
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.getinfo("model.stl").compress_type == zipfile.ZIP_DEFLATED
+            assert zf.getinfo("model.3mf").compress_type == zipfile.ZIP_STORED
+
+    def test_generator(self):
+        """Test that entries can be produced one at a time."""
+
+        def entries():
+            for index in range(3):
+                yield f"{index}.stl", bytes(index)
+
+        with zipfile.ZipFile(io.BytesIO(write_zip(entries()))) as zf:
+            assert len(zf.namelist()) == 3
+
+    def test_reproducible(self):
+        """Test that the same entries always give the same file."""
+        assert write_zip([("a.stl", b"solid")]) == write_zip([("a.stl", b"solid")])
+
+    def test_spooled(self, monkeypatch):
+        """Test that large bundles are spooled to disk and returned mapped."""
+        monkeypatch.setattr(server.settings, "stream_min_bytes", 1024)
+        entry = random.Random(0).randbytes(4096)
+        data = write_zip([("a.stl", entry)])
+        assert isinstance(data, mmap.mmap)
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.read("a.stl") == entry
@@ -0,0 +1,130 @@
+"""Tests for server.artifacts module."""
+
+import pytest
+
+import server.openscad
+import server.server
+import server.settings
+from server.cache import DiskCache, SharedCache
+
+app = server.server.app
+
+key = "ab" * 32
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch, tmp_path):
+    """Give each test empty caches with one artifact on disk."""
+    disk_cache = DiskCache(tmp_path / "disk", max_bytes=1024 * 1024)
+    disk_cache.put(key, "stl", b"0123456789")
+    disk_cache.put(f"{key}.gzip", "stl", b"compressed")
+    monkeypatch.setattr(server.openscad, "disk_cache", disk_cache)
+    monkeypatch.setattr(server.openscad, "shared_cache", SharedCache(tmp_path / "shared", max_bytes=1024 * 1024))
+
+
+class TestArtifact:
+    """Tests for the cached artifact route."""
+
+    def test_get(self):
+        """Test that a cached artifact is returned whole."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl")
+        assert response.status == 200
+        assert response.body == b"0123456789"
+        assert response.headers["Content-Type"] == "model/stl"
+        assert response.headers["Accept-Ranges"] == "bytes"
+
+    def test_range(self):
+        """Test that a byte range is returned with its position."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"Range": "bytes=2-4"})
+        assert response.status == 206
+        assert response.body == b"234"
+        assert response.headers["Content-Range"] == "bytes 2-4/10"
+
+    def test_open_range(self):
+        """Test that a range may run to the end of the artifact."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"Range": "bytes=7-"})
+        assert response.body == b"789"
+
+    def test_suffix_range(self):
+        """Test that the last bytes of the artifact can be asked for."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"Range": "bytes=-4"})
+        assert response.body == b"6789"
+        assert response.headers["Content-Range"] == "bytes 6-9/10"
+
+    def test_range_past_end(self):
+        """Test that ranges starting past the end are refused."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"Range": "bytes=10-"})
+        assert response.status == 416
+        assert response.headers["Content-Range"] == "bytes */10"
+
+    def test_several_ranges(self):
+        """Test that several ranges at once get the whole artifact."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"Range": "bytes=0-1,4-5"})
+        assert response.status == 200
+        assert response.body == b"0123456789"
+
+    def test_head(self):
+        """Test that HEAD gives the size without the body."""
+        _, response = app.test_client.head(f"/api/artifacts/{key}.stl")
+        assert response.status == 200
+        assert response.headers["Content-Length"] == "10"
+        assert response.body == b""
+
+    def test_encoded(self):
+        """Test that compressed variants are sent with their content coding."""
+        _, response = app.test_client.head(f"/api/artifacts/{key}.gzip.stl")
+        assert response.headers["Content-Encoding"] == "gzip"
+
+    def test_filename(self):
+        """Test that the download file name is taken from the query without unsafe characters."""
+        _, response = app.test_client.get(f'/api/artifacts/{key}.stl?filename=../a"b.stl')
+        assert response.headers["Content-Disposition"] == 'attachment; filename=".._a_b.stl"'
+
+    @pytest.mark.parametrize("name", [f"{'cd' * 32}.stl", "..%2Fsecret.stl", f"{key}.gzip"])
+    def test_not_found(self, name):
+        """Test that artifacts that are not cached or invalid names are not found."""
+        _, response = app.test_client.get(f"/api/artifacts/{name}")
+        assert response.status == 404
+
+    def test_cacheable(self):
+        """Test that artifacts have a strong entity tag and may be cached for good."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl")
+        assert response.headers["ETag"] == f'"{key}.stl"'
+        assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+    def test_max_age(self, monkeypatch):
+        """Test that how long artifacts may be cached can be changed."""
+        monkeypatch.setattr(server.settings, "artifact_max_age", 3600)
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl")
+        assert response.headers["Cache-Control"] == "public, max-age=3600, immutable"
+
+    @pytest.mark.parametrize("header", [f'"{key}.stl"', f'"other", W/"{key}.stl"', "*"])
+    def test_not_modified(self, header):
+        """Test that conditional requests for the same artifact are not sent it again."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"If-None-Match": header})
+        assert response.status == 304
+        assert response.body == b""
+        assert response.headers["ETag"] == f'"{key}.stl"'
+
+    def test_not_modified_after_eviction(self):
+        """Test that clients keep their copy after the artifact has been evicted."""
+        name = f"{'cd' * 32}.stl"
+        _, response = app.test_client.get(f"/api/artifacts/{name}", headers={"If-None-Match": f'"{name}"'})
+        assert response.status == 304
+
+    def test_modified(self):
+        """Test that other entity tags get the artifact."""
+        _, response = app.test_client.get(f"/api/artifacts/{key}.stl", headers={"If-None-Match": '"other"'})
+        assert response.status == 200
+
+    def test_if_range(self):
+        """Test that ranges are only sent if the client has the same artifact."""
+        _, response = app.test_client.get(
+            f"/api/artifacts/{key}.stl", headers={"Range": "bytes=2-4", "If-Range": f'"{key}.stl"'}
+        )
+        assert response.status == 206
+        _, response = app.test_client.get(
+            f"/api/artifacts/{key}.stl", headers={"Range": "bytes=2-4", "If-Range": '"other"'}
+        )
+        assert response.status == 200
+        assert response.body == b"0123456789"
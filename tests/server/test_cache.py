@@ -0,0 +1,207 @@
+"""Tests for server.cache module."""
+
+import mmap
+import os
+import time
+
+import pytest
+from server.cache import DiskCache, FailureCache, MemoryCache, SharedCache
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    return DiskCache(tmp_path, max_bytes=1000)
+
+
+class TestDiskCache:
+    """Tests for DiskCache."""
+
+    def test_miss(self, disk_cache):
+        """Test that a missing artifact counts as a miss."""
+        assert disk_cache.get("abcdef", "stl") is None
+        assert disk_cache.misses == 1
+        assert disk_cache.hits == 0
+
+    def test_put_get(self, disk_cache):
+        """Test that stored artifacts are returned and counted as hits."""
+        disk_cache.put("abcdef", "stl", b"solid")
+        assert disk_cache.get("abcdef", "stl") == b"solid"
+        assert disk_cache.hits == 1
+
+    def test_extensions_are_separate(self, disk_cache):
+        """Test that the same key with different extensions are separate artifacts."""
+        disk_cache.put("abcdef", "stl", b"solid")
+        assert disk_cache.get("abcdef", "png") is None
+
+    def test_shared_between_instances(self, tmp_path):
+        """Test that artifacts are visible to other instances using the same root."""
+        DiskCache(tmp_path, max_bytes=1000).put("abcdef", "stl", b"solid")
+        assert DiskCache(tmp_path, max_bytes=1000).get("abcdef", "stl") == b"solid"
+
+    def test_no_temporary_files_left(self, disk_cache, tmp_path):
+        """Test that atomic writes do not leave temporary files behind."""
+        disk_cache.put("abcdef", "stl", b"solid")
+        assert [path.name for path in tmp_path.glob("*/*")] == ["abcdef.stl"]
+
+    def test_eviction_removes_least_recently_used(self, disk_cache):
+        """Test that the least recently used artifacts are evicted first."""
+        disk_cache.put("aa0001", "stl", b"x" * 400)
+        disk_cache.put("aa0002", "stl", b"x" * 400)
+        os.utime(disk_cache.path("aa0001", "stl"), (1, 1))
+        os.utime(disk_cache.path("aa0002", "stl"), (2, 2))
+
+        disk_cache.put("aa0003", "stl", b"x" * 400)
+
+        assert disk_cache.get("aa0001", "stl") is None
+        assert disk_cache.get("aa0002", "stl") is not None
+        assert disk_cache.get("aa0003", "stl") is not None
+        assert disk_cache.evictions == 1
+        assert disk_cache.stats()["bytes"] == 800
+
+    def test_overwrite_counted_once(self, disk_cache):
+        """Test that replacing an artifact does not count its size twice."""
+        disk_cache.put("abcdef", "stl", b"x" * 400)
+        disk_cache.put("abcdef", "stl", b"x" * 300)
+        assert disk_cache.size == 300
+
+    def test_other_workers_counted(self, tmp_path):
+        """Test that artifacts written by other workers are found before evicting."""
+        ours = DiskCache(tmp_path, max_bytes=1000)
+        ours.put("aa0001", "stl", b"x" * 10)
+        DiskCache(tmp_path, max_bytes=1000).put("bb0001", "stl", b"x" * 900)
+
+        ours.put("aa0002", "stl", b"x" * 100)
+        assert ours.evictions > 0
+        assert ours.size <= 900
+
+    def test_disabled(self, tmp_path):
+        """Test that a zero size disables the cache."""
+        disk_cache = DiskCache(tmp_path, max_bytes=0)
+        assert disk_cache.put("abcdef", "stl", b"solid") is None
+        assert disk_cache.get("abcdef", "stl") is None
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestSharedCache:
+    """Tests for SharedCache."""
+
+    def test_get_returns_memory_map(self, tmp_path):
+        """Test that artifacts are returned as memory maps of the shared file."""
+        shared_cache = SharedCache(tmp_path, max_bytes=1000)
+        shared_cache.put("abcdef", "stl", b"solid")
+        data = shared_cache.get("abcdef", "stl")
+        assert isinstance(data, mmap.mmap)
+        assert bytes(data) == b"solid"
+
+    def test_share(self, tmp_path):
+        """Test that sharing an artifact stores it and returns the shared copy."""
+        shared_cache = SharedCache(tmp_path, max_bytes=1000)
+        data = shared_cache.share("abcdef", "stl", b"solid")
+        assert isinstance(data, mmap.mmap)
+        assert bytes(shared_cache.get("abcdef", "stl")) == b"solid"
+
+    def test_share_disabled(self, tmp_path):
+        """Test that sharing with the cache disabled returns the original data."""
+        shared_cache = SharedCache(tmp_path, max_bytes=0)
+        assert shared_cache.share("abcdef", "stl", b"solid") == b"solid"
+
+    def test_empty_artifact(self, tmp_path):
+        """Test that empty artifacts can be shared."""
+        shared_cache = SharedCache(tmp_path, max_bytes=1000)
+        shared_cache.put("abcdef", "stl", b"")
+        assert shared_cache.get("abcdef", "stl") == b""
+
+
+class TestFailureCache:
+    """Tests for FailureCache."""
+
+    def test_remember_recall(self, tmp_path):
+        """Test that remembered failures are returned."""
+        failure_cache = FailureCache(tmp_path, max_bytes=1000, ttl=60)
+        failure_cache.remember("abcdef", {"code": "model_error", "message": "Failed"})
+        failure = failure_cache.recall("abcdef")
+        assert failure["code"] == "model_error"
+        assert failure["message"] == "Failed"
+
+    def test_expired(self, tmp_path, monkeypatch):
+        """Test that failures are forgotten after the TTL."""
+        failure_cache = FailureCache(tmp_path, max_bytes=1000, ttl=60)
+        failure_cache.remember("abcdef", {"code": "model_error"})
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 61)
+        assert failure_cache.recall("abcdef") is None
+        assert failure_cache.hits == 0
+        assert failure_cache.misses == 1
+        assert not failure_cache.path("abcdef", "json").exists()
+
+    def test_disabled(self, tmp_path):
+        """Test that a TTL of 0 disables the cache."""
+        failure_cache = FailureCache(tmp_path, max_bytes=1000, ttl=0)
+        failure_cache.remember("abcdef", {"code": "model_error"})
+        assert failure_cache.recall("abcdef") is None
+
+
+class TestMemoryCache:
+    """Tests for MemoryCache."""
+
+    def test_miss(self):
+        """Test that a missing artifact counts as a miss."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        assert memory_cache.get("abcdef") is None
+        assert memory_cache.misses == 1
+
+    def test_put_get(self):
+        """Test that stored artifacts are returned and counted."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        memory_cache.put("abcdef", b"solid")
+        assert memory_cache.get("abcdef") == b"solid"
+        assert memory_cache.stats()["entries"] == 1
+        assert memory_cache.stats()["bytes"] == 5
+
+    def test_replace(self):
+        """Test that storing an existing key replaces it without leaking bytes."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        memory_cache.put("abcdef", b"x" * 10)
+        memory_cache.put("abcdef", b"x" * 20)
+        assert memory_cache.bytes == 20
+
+    def test_too_large(self):
+        """Test that artifacts larger than the budget are not stored."""
+        memory_cache = MemoryCache(max_bytes=10)
+        memory_cache.put("abcdef", b"x" * 11)
+        assert memory_cache.get("abcdef") is None
+        assert memory_cache.bytes == 0
+
+    def test_byte_budget(self):
+        """Test that the total size stays within the budget."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        for i in range(10):
+            memory_cache.put(f"key{i}", b"x" * 300)
+        assert memory_cache.bytes <= 1000
+        assert memory_cache.evictions == 7
+
+    def test_expensive_artifacts_kept(self):
+        """Test that cheap artifacts are evicted before expensive ones of the same size."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        memory_cache.put("expensive", b"x" * 400, cost=60)
+        memory_cache.put("cheap", b"x" * 400, cost=0.01)
+        memory_cache.put("new", b"x" * 400, cost=1)
+        assert memory_cache.get("expensive") is not None
+        assert memory_cache.get("cheap") is None
+
+    def test_small_artifacts_kept(self):
+        """Test that large artifacts are evicted before small ones of the same cost."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        memory_cache.put("small", b"x" * 100)
+        memory_cache.put("large", b"x" * 800)
+        memory_cache.put("new", b"x" * 200)
+        assert memory_cache.get("small") is not None
+        assert memory_cache.get("large") is None
+
+    def test_unused_entries_age_out(self):
+        """Test that an expensive entry that is never used is eventually evicted."""
+        memory_cache = MemoryCache(max_bytes=1000)
+        memory_cache.put("expensive", b"x" * 100, cost=10)
+        for i in range(1000):
+            memory_cache.put(f"key{i}", b"x" * 450, cost=5)
+        assert memory_cache.get("expensive") is None
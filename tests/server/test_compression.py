@@ -0,0 +1,64 @@
+"""Tests for server.compression module."""
+
+import gzip
+
+import pytest
+
+import server.compression
+from server.compression import accepted_encodings, compress, negotiate_encoding
+
+
+class TestAcceptedEncodings:
+    """Tests for accepted_encodings function."""
+
+    def test_quality(self):
+        """Test that quality values are parsed and default to 1."""
+        assert accepted_encodings("gzip, br;q=0.5, zstd;q=0") == {"gzip": 1.0, "br": 0.5, "zstd": 0.0}
+
+    def test_invalid_quality(self):
+        """Test that invalid quality values do not accept the coding."""
+        assert accepted_encodings("gzip;q=high") == {"gzip": 0.0}
+
+
+class TestNegotiateEncoding:
+    """Tests for negotiate_encoding function."""
+
+    @pytest.fixture(autouse=True)
+    def encoders(self, monkeypatch):
+        monkeypatch.setattr(server.compression, "encoders", {"br": None, "zstd": None, "gzip": None})
+
+    def test_none(self):
+        """Test that nothing is compressed without an Accept-Encoding header."""
+        assert negotiate_encoding(None) is None
+        assert negotiate_encoding("identity") is None
+
+    def test_preference(self):
+        """Test that our preferred coding is used when several are accepted equally."""
+        assert negotiate_encoding("gzip, deflate, br, zstd") == "br"
+
+    def test_quality(self):
+        """Test that the client's quality values take precedence."""
+        assert negotiate_encoding("br;q=0.5, gzip") == "gzip"
+
+    def test_refused(self):
+        """Test that codings with a quality of 0 are not used."""
+        assert negotiate_encoding("*, br;q=0, zstd;q=0") == "gzip"
+
+    def test_unavailable(self, monkeypatch):
+        """Test that codings without an installed compressor are not used."""
+        monkeypatch.setattr(server.compression, "encoders", {"gzip": None})
+        assert negotiate_encoding("br") is None
+
+
+class TestCompress:
+    """Tests for compress function."""
+
+    def test_gzip(self):
+        """Test that gzip output is reproducible and decompresses to the input."""
+        data = b"solid model\n" * 100
+        assert gzip.decompress(compress(data, "gzip")) == data
+        assert compress(data, "gzip") == compress(data, "gzip")
+
+    def test_memoryview(self):
+        """Test that artifacts mapped from the shared cache can be compressed."""
+        assert gzip.decompress(compress(memoryview(b"solid"), "gzip")) == b"solid"
@@ -0,0 +1,318 @@
+"""Tests for server.formats module."""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+import server.formats
+import server.progress
+import server.server
+import server.settings
+from server.cache import map_file
+from server.compression import compress
+from server.formats import session_path, session_token, start_session_request, superseding
+from server.openscad import BuildSuperseded, ModelError
+
+app = server.server.app
+
+
+@pytest.fixture
+def exports(monkeypatch):
+    """Replace exporting with a recorder that returns the requested format."""
+    calls = []
+
+    async def export(model_file, export_format, encoding=None, **params):
+        calls.append((model_file, export_format, encoding))
+        if encoding is not None:
+            return compress(export_format.encode(), encoding)
+        return export_format.encode()
+
+    monkeypatch.setattr(server.formats, "export", export)
+    return calls
+
+
+class TestModelResponse:
+    """Tests for format negotiation on the part endpoints."""
+
+    def test_default_binary_stl(self, exports):
+        """Test that binary STL is returned when nothing else is asked for."""
+        _, response = app.test_client.post("/api/hook", json={}, headers={"Accept-Encoding": "identity"})
+        assert response.status == 200
+        assert response.body == b"binstl"
+        assert response.headers["Content-Type"] == "model/stl"
+        assert response.headers["Vary"] == "Accept, Accept-Encoding"
+        assert "Content-Encoding" not in response.headers
+        assert response.headers["Content-Disposition"].endswith('.stl"')
+
+    def test_query(self, exports):
+        """Test that the format query parameter selects the format."""
+        _, response = app.test_client.post("/api/hook?format=obj", json={}, headers={"Accept-Encoding": "identity"})
+        assert response.body == b"obj"
+        assert response.headers["Content-Type"] == "model/obj"
+        assert response.headers["Content-Disposition"].endswith('.obj"')
+
+    def test_ascii_query(self, exports):
+        """Test that ASCII STL can be requested."""
+        _, response = app.test_client.post("/api/hook?format=asciistl", json={}, headers={"Accept-Encoding": "identity"})
+        assert response.body == b"asciistl"
+        assert response.headers["Content-Type"] == "model/stl"
+
+    def test_accept(self, exports):
+        """Test that the Accept header selects the format."""
+        _, response = app.test_client.post(
+            "/api/tile", json={}, headers={"Accept": "model/3mf, model/stl;q=0.5"}
+        )
+        assert response.body == b"3mf"
+        assert response.headers["Content-Type"] == "model/3mf"
+
+    def test_query_overrides_accept(self, exports):
+        """Test that the query parameter takes precedence over the Accept header."""
+        _, response = app.test_client.post(
+            "/api/tile?format=stl", json={}, headers={"Accept": "model/3mf", "Accept-Encoding": "identity"}
+        )
+        assert response.body == b"binstl"
+
+    def test_preview_query(self, exports):
+        """Test that the preview mesh can be requested."""
+        _, response = app.test_client.post(
+            "/api/hook?format=preview", json={}, headers={"Accept-Encoding": "identity"}
+        )
+        assert response.body == b"preview"
+        assert response.headers["Content-Type"] == "application/vnd.goews.preview"
+        assert response.headers["Content-Disposition"].endswith('.preview"')
+
+    def test_preview_delta(self, exports, monkeypatch):
+        """Test that a preview mesh is sent as changes to the base the client has."""
+        bases = []
+
+        async def preview_delta(base, data, encoding=None):
+            bases.append((base, data, encoding))
+            return b"delta"
+
+        monkeypatch.setattr(server.formats, "preview_delta", preview_delta)
+        base = "0" * 64 + ".preview"
+        _, response = app.test_client.post(
+            f"/api/hook?format=preview&base={base}", json={}, headers={"Accept-Encoding": "identity"}
+        )
+        assert response.body == b"delta"
+        assert response.headers["Content-Type"] == "application/vnd.goews.preview-delta"
+        assert bases == [(base, b"preview", None)]
+
+    @pytest.mark.parametrize("query", ["format=stl&base=" + "0" * 64 + ".stl", "format=preview&base=mesh.preview"])
+    def test_invalid_base(self, exports, query):
+        """Test that deltas are only sent for preview meshes named by their artifact."""
+        _, response = app.test_client.post(f"/api/hook?{query}", json={})
+        assert response.status == 400
+
+    @pytest.mark.parametrize(
+        "query, quality",
+        [("format=preview", "preview"), ("format=stl", "standard"), ("format=preview&quality=fine", "fine")],
+    )
+    def test_quality(self, monkeypatch, query, quality):
+        """Test that previews are built at preview quality unless asked otherwise."""
+        qualities = []
+
+        async def export(model_file, export_format, encoding=None, quality="standard", **params):
+            qualities.append(quality)
+            return export_format.encode()
+
+        monkeypatch.setattr(server.formats, "export", export)
+        app.test_client.post(f"/api/hook?{query}", json={}, headers={"Accept-Encoding": "identity"})
+        assert qualities == [quality]
+
+    def test_unknown_quality(self, exports):
+        """Test that unknown qualities are rejected."""
+        _, response = app.test_client.post("/api/hook?quality=draft", json={})
+        assert response.status == 400
+        assert exports == []
+
+    def test_progress_events(self, monkeypatch):
+        """Test that clients accepting event streams can follow the build."""
+        async def export(model_file, export_format, encoding=None, quality="standard", **params):
+            server.progress.report(phase="rendering")
+            await asyncio.sleep(0.05)
+            return export_format.encode()
+
+        monkeypatch.setattr(server.formats, "export", export)
+        _, response = app.test_client.post("/api/hook", json={}, headers={"Accept": "text/event-stream"})
+        assert response.headers["Content-Type"] == "text/event-stream"
+        events = [event.split("\n") for event in response.text.strip().split("\n\n")]
+        assert events[0] == ["event: progress", 'data: {"phase": "queued"}']
+        assert ["event: progress", 'data: {"phase": "rendering"}'] in events
+        assert events[-1] == ["event: done", 'data: {"url": null}']
+
+    def test_progress_error(self, monkeypatch):
+        """Test that build failures end the event stream with an error."""
+        async def export(model_file, export_format, encoding=None, quality="standard", **params):
+            raise ModelError("Model generation failed")
+
+        monkeypatch.setattr(server.formats, "export", export)
+        _, response = app.test_client.post("/api/hook", json={}, headers={"Accept": "text/event-stream"})
+        assert response.text.strip().endswith(
+            'event: error\ndata: {"code": "model_error", "message": "Model generation failed"}'
+        )
+
+    def test_unknown_query(self, exports):
+        """Test that unknown formats are rejected."""
+        _, response = app.test_client.post("/api/hook?format=step", json={})
+        assert response.status == 400
+        assert exports == []
+
+    def test_compressed(self, exports):
+        """Test that the artifact is compressed with an encoding the client accepts."""
+        _, response = app.test_client.post("/api/hook", json={}, headers={"Accept-Encoding": "gzip"})
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.body == b"binstl"
+        assert exports == [("hook.scad", "binstl", "gzip")]
+
+    def test_3mf_not_compressed(self, exports):
+        """Test that formats that are compressed already are sent as is."""
+        _, response = app.test_client.post("/api/hook?format=3mf", json={}, headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+        assert exports == [("hook.scad", "3mf", None)]
+
+    def test_streamed(self, exports, monkeypatch):
+        """Test that large artifacts are streamed with their length."""
+        monkeypatch.setattr(server.settings, "stream_min_bytes", 2)
+        monkeypatch.setattr(server.formats, "stream_chunk_bytes", 2)
+        _, response = app.test_client.post("/api/hook", json={}, headers={"Accept-Encoding": "identity"})
+        assert response.status == 200
+        assert response.body == b"binstl"
+        assert response.headers["Content-Length"] == "6"
+        assert response.headers["Content-Type"] == "model/stl"
+
+    def test_content_location(self, monkeypatch, tmp_path):
+        """Test that cached artifacts point to where they can be fetched with ranges."""
+        path = tmp_path / f"{'ab' * 32}.stl"
+        path.write_bytes(b"solid")
+
+        async def export(model_file, export_format, encoding=None, **params):
+            return map_file(path)
+
+        monkeypatch.setattr(server.formats, "export", export)
+        _, response = app.test_client.post(
+            "/api/hook", json={}, headers={"Accept-Encoding": "identity", "Range": "bytes=0-1"}
+        )
+        assert response.status == 200
+        assert response.body == b"solid"
+        assert response.headers["Content-Location"].startswith(f"/api/artifacts/{'ab' * 32}.stl?filename=hook")
+
+    def test_redirect(self, monkeypatch, tmp_path):
+        """Test that clients can ask to be redirected to the cached artifact."""
+        path = tmp_path / f"{'ab' * 32}.stl"
+        path.write_bytes(b"solid")
+
+        async def export(model_file, export_format, encoding=None, **params):
+            return map_file(path)
+
+        monkeypatch.setattr(server.formats, "export", export)
+        _, response = app.test_client.post(
+            "/api/hook?redirect=true", json={}, headers={"Accept-Encoding": "identity"}, allow_redirects=False
+        )
+        assert response.status == 303
+        assert response.headers["Location"].startswith(f"/api/artifacts/{'ab' * 32}.stl")
+
+
+class TestSuperseding:
+    """Tests for replacing requests of a client session."""
+
+    @pytest.fixture(autouse=True)
+    def fast_polling(self, monkeypatch):
+        monkeypatch.setattr(server.formats, "session_poll_interval", 0.01)
+
+    def test_superseded(self):
+        """Test that a newer request of the session stops the older one waiting."""
+        cancelled = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def fast():
+            return b"model"
+
+        async def main():
+            first = asyncio.ensure_future(superseding("session", slow()))
+            await asyncio.sleep(0.01)
+            assert await superseding("session", fast()) == b"model"
+            with pytest.raises(BuildSuperseded):
+                await first
+
+        asyncio.run(main())
+        assert cancelled == [True]
+
+    def test_old_sessions_pruned(self, monkeypatch):
+        """Test that session files left by requests long finished are removed."""
+        start_session_request("old", session_token(time.time_ns()))
+        os.utime(session_path("old"), (1, 1))
+        monkeypatch.setattr(server.formats, "next_session_prune", 0.0)
+        start_session_request("new", session_token(time.time_ns()))
+        assert not session_path("old").exists()
+        assert session_path("new").exists()
+
+    def test_superseded_by_other_worker(self):
+        """Test that a newer request of the session in another worker is seen too."""
+        async def main():
+            first = asyncio.ensure_future(superseding("shared", asyncio.sleep(10)))
+            await asyncio.sleep(0.02)
+            # What another worker does when the newer request reaches it
+            await asyncio.to_thread(start_session_request, "shared", session_token(time.time_ns()))
+            with pytest.raises(BuildSuperseded):
+                await asyncio.wait_for(first, 1)
+
+        asyncio.run(main())
+
+    def test_arrival_order(self):
+        """Test that a request that arrived first but got to the session file last does not replace the newer one."""
+        newer = session_token(2)
+        assert start_session_request("ordered", newer) is not None
+        assert start_session_request("ordered", session_token(1)) is None
+        assert session_path("ordered").read_text() == newer
+
+    def test_superseded_on_arrival(self):
+        """Test that a request already replaced when it gets to the session file stops waiting straight away."""
+        start_session_request("late", session_token(time.time_ns() + 10**12))
+
+        async def main():
+            with pytest.raises(BuildSuperseded):
+                await asyncio.wait_for(superseding("late", asyncio.sleep(10)), 1)
+
+        asyncio.run(main())
+
+    def test_only_previews(self, monkeypatch):
+        """Test that only preview requests take part in the session."""
+        sessions = []
+
+        async def superseding(session, production):
+            sessions.append(session)
+            return await production
+
+        async def export(model_file, export_format, encoding=None, **params):
+            return export_format.encode()
+
+        monkeypatch.setattr(server.formats, "superseding", superseding)
+        monkeypatch.setattr(server.formats, "export", export)
+        headers = {"X-Preview-Session": "abc", "Accept-Encoding": "identity"}
+        for query in ("format=preview", "format=stl"):
+            app.test_client.post(f"/api/hook?{query}", json={}, headers=headers)
+        assert sessions == ["abc", None]
+
+    def test_other_sessions(self):
+        """Test that requests of other sessions or without one are not replaced."""
+        async def model(delay):
+            await asyncio.sleep(delay)
+            return b"model"
+
+        async def main():
+            return await asyncio.gather(
+                superseding("first", model(0.02)),
+                superseding("second", model(0.01)),
+                superseding(None, model(0.01)),
+            )
+
+        assert asyncio.run(main()) == [b"model"] * 3
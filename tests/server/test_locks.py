@@ -0,0 +1,211 @@
+"""Tests for server.locks module."""
+
+import asyncio
+
+from server.locks import FileLock, HostSemaphore, HostSum
+
+
+class TestFileLock:
+    """Tests for FileLock."""
+
+    def test_exclusive(self, tmp_path):
+        """Test that a held lock cannot be acquired again."""
+        first = FileLock(tmp_path / "key.lock")
+        second = FileLock(tmp_path / "key.lock")
+        assert first.try_acquire()
+        assert not second.try_acquire()
+        first.release()
+        assert second.try_acquire()
+        second.release()
+
+    def test_different_keys(self, tmp_path):
+        """Test that locks on different files are independent."""
+        first = FileLock(tmp_path / "a.lock")
+        second = FileLock(tmp_path / "b.lock")
+        assert first.try_acquire()
+        assert second.try_acquire()
+        first.release()
+        second.release()
+
+    def test_lock_file_removed(self, tmp_path):
+        """Test that the lock file is removed on release."""
+        lock = FileLock(tmp_path / "key.lock")
+        assert lock.try_acquire()
+        lock.release()
+        assert not (tmp_path / "key.lock").exists()
+
+    def test_waits_for_release(self, tmp_path):
+        """Test that acquiring waits until the holder releases the lock."""
+        events = []
+
+        async def holder():
+            async with FileLock(tmp_path / "key.lock"):
+                events.append("holder acquired")
+                await asyncio.sleep(0.1)
+                events.append("holder released")
+
+        async def waiter():
+            await asyncio.sleep(0.01)
+            async with FileLock(tmp_path / "key.lock"):
+                events.append("waiter acquired")
+
+        async def main():
+            await asyncio.gather(holder(), waiter())
+
+        asyncio.run(main())
+        assert events == ["holder acquired", "holder released", "waiter acquired"]
+
+
+class TestHostSemaphore:
+    """Tests for HostSemaphore."""
+
+    def test_slots_shared_between_instances(self, tmp_path):
+        """Test that instances using the same directory share the slots."""
+        first = HostSemaphore(tmp_path, 2)
+        second = HostSemaphore(tmp_path, 2)
+        assert first.try_acquire() == 0
+        assert second.try_acquire() == 1
+        assert first.try_acquire() is None
+        assert second.try_acquire() is None
+        first.release(0)
+        assert second.try_acquire() == 0
+
+    def test_others_held(self, tmp_path):
+        """Test that slots held by other instances count even when slot 0 is free again."""
+        first = HostSemaphore(tmp_path, 3)
+        other = HostSemaphore(tmp_path, 3)
+        assert first.try_acquire() == 0
+        assert other.try_acquire() == 1
+        assert first.others_held(0)
+        first.release(0)
+        assert first.try_acquire() == 0
+        assert first.others_held(0)
+        other.release(1)
+        assert not first.others_held(0)
+        assert other.try_acquire() == 1
+
+    def test_concurrency_bounded(self, tmp_path):
+        """Test that no more than the budget hold a slot at once."""
+        semaphores = [HostSemaphore(tmp_path, 2) for _ in range(3)]
+        running = 0
+        peak = 0
+
+        async def job(semaphore):
+            nonlocal running, peak
+            async with semaphore.slot():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.05)
+                running -= 1
+
+        async def main():
+            await asyncio.gather(*(job(semaphore) for semaphore in semaphores for _ in range(2)))
+
+        asyncio.run(main())
+        assert peak == 2
+
+    def test_wait_instrumentation(self, tmp_path):
+        """Test that queue waits are recorded."""
+        semaphore = HostSemaphore(tmp_path, 1)
+
+        async def job():
+            async with semaphore.slot():
+                await asyncio.sleep(0.05)
+
+        async def main():
+            await asyncio.gather(job(), job())
+
+        asyncio.run(main())
+        stats = semaphore.stats()
+        assert stats["acquired"] == 2
+        assert stats["in_use"] == 0
+        assert stats["waiting"] == 0
+        assert stats["max_wait"] >= 0.04
+
+    def test_lowest_priority_first(self, tmp_path):
+        """Test that waiters are served lowest priority first."""
+        semaphore = HostSemaphore(tmp_path, 1, aging=0)
+        order = []
+
+        async def job(name, priority):
+            async with semaphore.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.02)
+
+        async def main():
+            index = await semaphore.acquire()
+            waiters = asyncio.gather(job("large", 60), job("medium", 10), job("small", 1))
+            await asyncio.sleep(0.01)
+            semaphore.release(index)
+            await waiters
+
+        asyncio.run(main())
+        assert order == ["small", "medium", "large"]
+
+    def test_aging(self, tmp_path):
+        """Test that a waiter that has waited long enough is served before a newer one."""
+        semaphore = HostSemaphore(tmp_path, 1, aging=1000)
+        order = []
+
+        async def job(name, priority, delay=0):
+            await asyncio.sleep(delay)
+            async with semaphore.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.05)
+
+        async def main():
+            await asyncio.gather(job("first", 0), job("large", 20, 0.01), job("small", 1, 0.04))
+
+        asyncio.run(main())
+        assert order == ["first", "large", "small"]
+
+    def test_cancelled_waiter(self, tmp_path):
+        """Test that a cancelled waiter does not block those behind it."""
+        semaphore = HostSemaphore(tmp_path, 1)
+
+        async def main():
+            index = await semaphore.acquire()
+            cancelled = asyncio.create_task(semaphore.acquire(0))
+            waiter = asyncio.create_task(semaphore.acquire(1))
+            await asyncio.sleep(0.01)
+            cancelled.cancel()
+            semaphore.release(index)
+            return await asyncio.wait_for(waiter, 1)
+
+        assert asyncio.run(main()) == 0
+        assert semaphore.waiting == 0
+
+
+class TestHostSum:
+    """Tests for HostSum."""
+
+    def test_sum(self, tmp_path):
+        """Test that the numbers published by every instance are added up."""
+        first = HostSum(tmp_path)
+        second = HostSum(tmp_path)
+        assert first.total() == 0
+        first.publish(1.5)
+        second.publish(2)
+        assert first.total() == second.total() == 3.5
+        second.publish(0.25)
+        assert first.total() == 1.75
+
+    def test_exited(self, tmp_path):
+        """Test that numbers left by processes that have exited are removed."""
+        first = HostSum(tmp_path)
+        second = HostSum(tmp_path)
+        second.publish(2)
+        path = second.lock.path
+        # What the kernel does when the process exits
+        second.lock.release()
+        assert first.total() == 0
+        assert not path.exists()
+
+    def test_close(self, tmp_path):
+        """Test that closing removes the instance's number."""
+        first = HostSum(tmp_path)
+        second = HostSum(tmp_path)
+        second.publish(2)
+        second.close()
+        assert first.total() == 0
+        assert not list(tmp_path.iterdir())
@@ -0,0 +1,266 @@
+"""Tests for server.mesh module."""
+
+import io
+import zipfile
+
+import numpy as np
+import pytest
+from server.mesh import (
+    MeshPart,
+    convert,
+    indexed,
+    normals,
+    preview_delta,
+    read_preview,
+    read_preview_delta,
+    read_stl,
+    split,
+    write_3mf,
+    write_ascii_stl,
+    write_binary_stl,
+    write_obj,
+    write_preview,
+)
+
+
+@pytest.fixture
+def triangles():
+    """Two triangles of a unit square sharing an edge."""
+    return np.array(
+        [
+            [[0, 0, 0], [1, 0, 0], [1, 1, 0]],
+            [[0, 0, 0], [1, 1, 0], [0, 1, 0]],
+        ],
+        dtype=np.float32,
+    )
+
+
+class TestStl:
+    """Tests for reading and writing STL."""
+
+    def test_binary_round_trip(self, triangles):
+        """Test that binary STL is read back unchanged."""
+        data = write_binary_stl(triangles)
+        assert len(data) == 84 + 50 * 2
+        assert np.array_equal(read_stl(data), triangles)
+
+    def test_ascii_round_trip(self, triangles):
+        """Test that ASCII STL is read back unchanged."""
+        data = write_ascii_stl(triangles, "square")
+        assert data.startswith(b"solid square\n")
+        assert data.endswith(b"endsolid square\n")
+        assert np.array_equal(read_stl(data), triangles)
+
+    def test_binary_header_starting_with_solid(self, triangles):
+        """Test that binary STLs with a header starting with solid are not read as ASCII."""
+        data = b"solid".ljust(80, b" ") + write_binary_stl(triangles)[80:]
+        assert np.array_equal(read_stl(data), triangles)
+
+    def test_empty(self):
+        """Test that an empty mesh can be written and read."""
+        empty = np.zeros((0, 3, 3), dtype=np.float32)
+        assert read_stl(write_binary_stl(empty)).shape == (0, 3, 3)
+        assert read_stl(write_ascii_stl(empty)).shape == (0, 3, 3)
+
+    def test_normals(self, triangles):
+        """Test that normals follow the winding order."""
+        assert np.array_equal(normals(triangles), [[0, 0, 1], [0, 0, 1]])
+
+    def test_degenerate_normal(self):
+        """Test that degenerate triangles get a zero normal."""
+        assert np.array_equal(normals(np.zeros((1, 3, 3), dtype=np.float32)), [[0, 0, 0]])
+
+
+class TestIndexed:
+    """Tests for indexed function."""
+
+    def test_shared_vertices(self, triangles):
+        """Test that shared vertices are only stored once."""
+        vertices, faces = indexed(triangles)
+        assert len(vertices) == 4
+        assert np.array_equal(vertices[faces], triangles)
+
+
+class TestObj:
+    """Tests for write_obj function."""
+
+    def test_write(self, triangles):
+        """Test that OBJ output has one vertex per shared vertex and one based faces."""
+        lines = write_obj(triangles).decode().splitlines()
+        assert sum(line.startswith("v ") for line in lines) == 4
+        faces = [line for line in lines if line.startswith("f ")]
+        assert len(faces) == 2
+        assert min(int(index) for face in faces for index in face.split()[1:]) == 1
+
+
+class Test3mf:
+    """Tests for write_3mf function."""
+
+    def test_package(self, triangles):
+        """Test that the package has the parts required by the 3MF core specification."""
+        with zipfile.ZipFile(io.BytesIO(write_3mf([MeshPart("square", triangles)]))) as zf:
+            assert set(zf.namelist()) == {"[Content_Types].xml", "_rels/.rels", "3D/3dmodel.model"}
+            model = zf.read("3D/3dmodel.model").decode()
+        assert model.count("<vertex ") == 4
+        assert model.count("<triangle ") == 2
+        assert "basematerials" not in model
+
+    def test_materials(self, triangles):
+        """Test that parts are separate objects with their materials."""
+        data = write_3mf(
+            [
+                MeshPart("tile", triangles, "PLA", "#FFFFFF"),
+                MeshPart("spacer", triangles, "PETG", "#FF8000"),
+            ]
+        )
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            model = zf.read("3D/3dmodel.model").decode()
+        assert '<base name="PLA" displaycolor="#FFFFFF"/>' in model
+        assert '<object id="3" type="model" name="spacer" pid="1" pindex="1">' in model
+        assert model.count("<item ") == 2
+
+
+class TestPreview:
+    """Tests for the browser preview mesh."""
+
+    def test_round_trip(self, triangles):
+        """Test that vertices are shared and positions are kept within a quantization step."""
+        scaled = triangles * 37.5 + 4
+        positions, faces, vertex_normals = read_preview(write_preview(scaled))
+        assert len(positions) == 4
+        assert faces.shape == (2, 3)
+        assert vertex_normals is None
+        assert np.allclose(positions[faces], scaled, atol=37.5 / 65535)
+
+    def test_normals(self, triangles):
+        """Test that vertex normals of a flat mesh point along its face normal."""
+        _, _, vertex_normals = read_preview(write_preview(triangles, with_normals=True))
+        assert np.allclose(vertex_normals, [0, 0, 1])
+
+    def test_collapsed_triangles_dropped(self, triangles):
+        """Test that triangles smaller than a quantization step are left out."""
+        tiny = triangles * 1e-9 + 0.5
+        _, faces, _ = read_preview(write_preview(np.concatenate([triangles, tiny])))
+        assert len(faces) == 2
+
+    def test_wide_indices(self):
+        """Test that 32 bit indices are used when 16 bits cannot address every vertex."""
+        rng = np.random.default_rng(0)
+        many = rng.random((30000, 3, 3), dtype=np.float32)
+        data = write_preview(many)
+        positions, faces, _ = read_preview(data)
+        assert data[5] == 2
+        assert len(positions) > 65536
+        assert np.allclose(positions[faces], many, atol=1 / 65535)
+
+    def test_not_preview(self, triangles):
+        """Test that other data is rejected."""
+        with pytest.raises(ValueError):
+            read_preview(write_binary_stl(triangles))
+
+
+def apply_delta(base, delta):
+    """Triangles of the mesh a delta turns `base` into, the way the viewer applies it."""
+    replace, runs, added = read_preview_delta(delta)
+    positions, faces, _ = read_preview(added)
+    if replace:
+        return positions[faces]
+    base_positions, base_faces, _ = read_preview(base)
+    added_triangles = iter(positions[faces])
+    triangles = []
+    for start, count in runs:
+        if start == 0xFFFFFFFF:
+            triangles.extend(next(added_triangles) for _ in range(count))
+        else:
+            triangles.extend(base_positions[base_faces[start : start + count]])
+    return np.array(triangles)
+
+
+@pytest.fixture
+def grid():
+    """A flat grid of 40 by 40 unit squares."""
+    x, y = np.meshgrid(np.arange(40, dtype=np.float32), np.arange(40, dtype=np.float32))
+    corners = np.stack([x.ravel(), y.ravel(), np.zeros(x.size, dtype=np.float32)], axis=1)
+    right, up = np.array([1, 0, 0], dtype=np.float32), np.array([0, 1, 0], dtype=np.float32)
+    first = np.stack([corners, corners + right, corners + right + up], axis=1)
+    second = np.stack([corners, corners + right + up, corners + up], axis=1)
+    return np.stack([first, second], axis=1).reshape(-1, 3, 3)
+
+
+class TestPreviewDelta:
+    """Tests for changes between preview meshes."""
+
+    def test_unchanged(self, grid):
+        """Test that an unchanged mesh is a single run copied from the base."""
+        base = write_preview(grid)
+        replace, runs, _ = read_preview_delta(preview_delta(base, base))
+        assert not replace
+        assert runs.tolist() == [[0, len(grid)]]
+
+    def test_removed_and_added(self, grid):
+        """Test that only changed triangles are sent and the result matches the new mesh."""
+        base = write_preview(grid)
+        changed = grid.copy()
+        changed[1000:1010, :, 2] = 0.5
+        data = write_preview(changed)
+        delta = preview_delta(base, data)
+        replace, runs, added = read_preview_delta(delta)
+        assert not replace
+        assert len(delta) < len(data) / 4
+        assert read_preview(added)[1].shape == (10, 3)
+        positions, faces, _ = read_preview(data)
+        assert np.allclose(apply_delta(base, delta), positions[faces], atol=40 / 65535)
+
+    def test_rotated_triangles(self, grid):
+        """Test that triangles written from a different corner still match."""
+        base = write_preview(grid)
+        _, runs, _ = read_preview_delta(preview_delta(base, write_preview(np.roll(grid, 1, axis=1))))
+        assert runs.tolist() == [[0, len(grid)]]
+
+    def test_grown(self, grid):
+        """Test that triangles are matched when the bounding box changes."""
+        base = write_preview(grid)
+        extra = grid[:80] + np.array([0, 0, 5], dtype=np.float32)
+        data = write_preview(np.concatenate([grid, extra]))
+        delta = preview_delta(base, data)
+        replace, runs, _ = read_preview_delta(delta)
+        assert not replace
+        assert runs[0].tolist() == [0, len(grid)]
+        positions, faces, _ = read_preview(data)
+        assert np.allclose(apply_delta(base, delta), positions[faces], atol=40 / 65535)
+
+    def test_replace(self, grid, triangles):
+        """Test that the whole mesh is sent when there is no base or it is not smaller."""
+        data = write_preview(grid)
+        for base in (None, write_preview(triangles), write_preview(grid, with_normals=True)):
+            replace, runs, added = read_preview_delta(preview_delta(base, data))
+            assert replace
+            assert len(runs) == 0
+            assert added == data
+
+
+class TestConvert:
+    """Tests for convert function."""
+
+    @pytest.mark.parametrize("export_format", ["binstl", "asciistl", "obj", "3mf", "preview", "preview-normals"])
+    def test_formats(self, triangles, export_format):
+        """Test that every export format can be produced from a binary STL."""
+        assert convert(write_binary_stl(triangles), export_format)
+
+    def test_unknown(self, triangles):
+        """Test that unknown formats are rejected."""
+        with pytest.raises(ValueError):
+            convert(write_binary_stl(triangles), "step")
+
+
+class TestSplit:
+    """Tests for split function."""
+
+    def test_split(self, triangles):
+        """Test that the moved body is separated and moved back into place."""
+        moved = triangles.copy()
+        moved[:, :, 0] += 100
+        first, second = split(np.concatenate([triangles, moved]), 100)
+        assert np.array_equal(first, triangles)
+        assert np.array_equal(second, triangles)
+
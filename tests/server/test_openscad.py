@@ -0,0 +1,623 @@
+"""Tests for server.openscad module."""
+
+import asyncio
+from collections.abc import Awaitable
+import gzip
+import mmap
+import signal
+import threading
+
+import numpy as np
+import pytest
+import server.openscad
+import server.settings
+from server import compression, mesh, progress
+from server.cache import DiskCache, FailureCache, MemoryCache, SharedCache
+from server.locks import HostSemaphore
+from server.openscad import (
+    BuildKilled,
+    BuildOutOfMemory,
+    BuildQueueFull,
+    BuildTimeout,
+    BuildTooLarge,
+    ModelError,
+    artifact_key,
+    build,
+    build_failure,
+    build_size,
+    build_size_rules,
+    cached_run,
+    canonicalize_params,
+    define_args,
+    elide_inactive_params,
+    export,
+    inactive_parameter_rules,
+    inactive_parameters,
+    model_digest,
+    model_size,
+    preview_delta,
+    run_openscad,
+    tile_units,
+)
+from server.scheduler import AdmissionControl, BuildJob, CostModel
+
+
+class TestModelDigest:
+    """Tests for model_digest function."""
+
+    def test_stable(self):
+        """Test that the digest is stable for the same model."""
+        assert model_digest("tile.scad") == model_digest("tile.scad")
+
+    def test_differs_between_models(self):
+        """Test that different models have different digests."""
+        assert model_digest("tile.scad") != model_digest("grid_tile.scad")
+
+
+    def test_follows_libraries(self, tmp_path, monkeypatch):
+        """Test that library files found in the library path are part of the digest."""
+        library = tmp_path / "libraries"
+        (library / "lib").mkdir(parents=True)
+        (library / "lib/std.scad").write_text("include <shapes.scad>\n")
+        (library / "lib/shapes.scad").write_text("module a() {}\n")
+        (tmp_path / "model.scad").write_text("include <lib/std.scad>\n")
+        monkeypatch.setattr(server.openscad, "top_dir", tmp_path)
+        monkeypatch.setenv("OPENSCADPATH", str(library))
+
+        before = model_digest.__wrapped__("model.scad")
+        (library / "lib/shapes.scad").write_text("module b() {}\n")
+        assert model_digest.__wrapped__("model.scad") != before
+
+
+class TestArtifactKey:
+    """Tests for artifact_key function."""
+
+    def test_parameter_order_does_not_matter(self):
+        """Test that keyword order does not change the key."""
+        assert artifact_key("tile.scad", "stl", {"rows": 2, "columns": 3}) == artifact_key(
+            "tile.scad", "stl", {"columns": 3, "rows": 2}
+        )
+
+    def test_parameters_change_key(self):
+        """Test that different parameters give different keys."""
+        assert artifact_key("tile.scad", "stl", {"rows": 2}) != artifact_key("tile.scad", "stl", {"rows": 3})
+
+    def test_toolchain_changes_key(self, monkeypatch):
+        """Test that a different OpenSCAD version or cache version gives a different key."""
+        key = artifact_key("tile.scad", "stl", {"rows": 2})
+        monkeypatch.setattr(server.openscad, "openscad_version", lambda: "OpenSCAD version 2099.01")
+        upgraded = artifact_key("tile.scad", "stl", {"rows": 2})
+        monkeypatch.setattr(server.settings, "cache_version", "2")
+        assert len({key, upgraded, artifact_key("tile.scad", "stl", {"rows": 2})}) == 3
+
+    def test_converter_changes_key(self):
+        """Test that converted artifacts are keyed by the converter version."""
+        assert artifact_key("tile.scad", "obj", {"rows": 2}, converter=1) != artifact_key(
+            "tile.scad", "obj", {"rows": 2}, converter=2
+        )
+
+    def test_kind_changes_key(self):
+        """Test that different artifact kinds give different keys."""
+        assert artifact_key("tile.scad", "stl", {"rows": 2}) != artifact_key("tile.scad", "png", {"rows": 2})
+
+
+class TestDefineArgs:
+    """Tests for define_args function."""
+
+    def test_types(self):
+        """Test that values are formatted for OpenSCAD."""
+        assert define_args({"a": "hex", "b": True, "c": 4, "d": None}) == [
+            "-D",
+            'a="hex"',
+            "-D",
+            "b=true",
+            "-D",
+            "c=4",
+        ]
+
+
+class TestCanonicalizeParams:
+    """Tests for canonicalize_params function."""
+
+    def test_integral_floats_become_ints(self):
+        """Test that integral floats and ints are treated the same."""
+        assert canonicalize_params({"columns": 4.0}) == canonicalize_params({"columns": 4})
+        assert canonicalize_params({"columns": 4.0})["columns"] == 4
+
+    def test_floats_are_rounded(self):
+        """Test that insignificant float differences are removed."""
+        assert canonicalize_params({"diameter": 4.000001}) == {"diameter": 4}
+        assert canonicalize_params({"diameter": 4.12345}) == {"diameter": 4.123}
+
+    def test_bools_are_kept(self):
+        """Test that booleans are not converted to numbers."""
+        assert canonicalize_params({"fill_top": True})["fill_top"] is True
+
+    def test_keys_are_sorted(self):
+        """Test that keys are ordered."""
+        assert list(canonicalize_params({"rows": 2, "columns": 3})) == ["columns", "rows"]
+
+    def test_skip_list_sorted_and_deduplicated(self):
+        """Test that skip list entries are sorted and duplicates removed."""
+        params = canonicalize_params({"rows": 4, "columns": 4, "skip_list": "[3, 1],[1, 2],[3, 1]"})
+        assert params["skip_list"] == "[1, 2],[3, 1]"
+
+    def test_skip_list_clipped_to_tile(self):
+        """Test that skip list entries outside the tile are dropped."""
+        params = canonicalize_params({"rows": 2, "columns": 3, "skip_list": "[1, 4],[3, 1],[2, 3]"})
+        assert params["skip_list"] == "[2, 3]"
+
+    def test_skip_list_without_dimensions(self):
+        """Test that skip lists are still normalized without rows and columns."""
+        assert canonicalize_params({"skip_list": "[2,2], [1,1]"})["skip_list"] == "[1, 1],[2, 2]"
+
+
+class TestElideInactiveParams:
+    """Tests for elide_inactive_params function."""
+
+    @pytest.fixture(autouse=True)
+    def rules(self):
+        inactive_parameters("test.scad", "b", when=lambda params: not params["a"])
+        inactive_parameters("test.scad", "a", when=lambda params: params["c"] == 0)
+        yield
+        inactive_parameter_rules.pop("test.scad")
+
+    def test_inactive_dropped(self):
+        """Test that parameters are dropped when their rule applies."""
+        assert elide_inactive_params("test.scad", {"a": False, "b": 1, "c": 1}) == {"a": False, "c": 1}
+
+    def test_active_kept(self):
+        """Test that parameters are kept when their rule does not apply."""
+        assert elide_inactive_params("test.scad", {"a": True, "b": 1, "c": 1}) == {"a": True, "b": 1, "c": 1}
+
+    def test_rules_use_all_parameters(self):
+        """Test that rules see parameters dropped by other rules."""
+        assert elide_inactive_params("test.scad", {"a": False, "b": 1, "c": 0}) == {"c": 0}
+
+    def test_missing_parameter(self):
+        """Test that a rule depending on a missing parameter does not apply."""
+        assert elide_inactive_params("test.scad", {"a": True, "b": 1}) == {"a": True, "b": 1}
+
+    def test_other_models_unaffected(self):
+        """Test that rules only apply to their own model."""
+        assert elide_inactive_params("other.scad", {"a": False, "b": 1}) == {"a": False, "b": 1}
+
+
+class TestModelSize:
+    """Tests for model_size function."""
+
+    @pytest.fixture(autouse=True)
+    def rules(self):
+        build_size("test.scad", lambda params: params["a"] * params["b"])
+        yield
+        build_size_rules.pop("test.scad")
+
+    def test_declared(self):
+        """Test that the declared size is used."""
+        assert model_size("test.scad", {"a": 4, "b": 3}) == 12
+
+    def test_at_least_one(self):
+        """Test that sizes below 1 count as 1."""
+        assert model_size("test.scad", {"a": 0, "b": 3}) == 1
+
+    def test_undeclared(self):
+        """Test that models without a declared size count as 1."""
+        assert model_size("other.scad", {"a": 4, "b": 3}) == 1
+
+    def test_missing_parameter(self):
+        """Test that a size depending on a missing parameter counts as 1."""
+        assert model_size("test.scad", {"a": 4}) == 1
+
+
+class TestTileUnits:
+    """Tests for tile_units function."""
+
+    def test_skip_list(self):
+        """Test that skipped units are not counted."""
+        assert tile_units({"columns": 4, "rows": 4, "skip_list": "[1, 1],[2, 3]"}) == 14
+
+
+@pytest.fixture
+def openscad_runs(monkeypatch, tmp_path):
+    """Replace the OpenSCAD process with a recorder and give each test empty caches."""
+    runs = []
+
+    async def run_openscad(cmd, error_message, job=None):
+        runs.append(cmd)
+        await asyncio.sleep(0.01)
+        return b"solid " + " ".join(cmd).encode()
+
+    monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+    monkeypatch.setattr(server.openscad, "disk_cache", DiskCache(tmp_path / "disk", max_bytes=1024 * 1024))
+    monkeypatch.setattr(server.openscad, "shared_cache", SharedCache(tmp_path / "shared", max_bytes=0))
+    monkeypatch.setattr(server.openscad, "stl_memory_cache", MemoryCache(max_bytes=1024 * 1024))
+    monkeypatch.setattr(server.openscad, "failure_cache", FailureCache(tmp_path / "failures", 1024 * 1024, 60))
+    monkeypatch.setattr(server.openscad, "lock_dir", tmp_path / "locks")
+    monkeypatch.setattr(server.openscad, "build_semaphore", HostSemaphore(tmp_path / "slots", 4))
+    return runs
+
+
+class PhaseRecorder(progress.Progress):
+    """Progress that keeps every phase it was given."""
+
+    def __init__(self):
+        super().__init__()
+        self.phases = []
+
+    def update(self, **state):
+        super().update(**state)
+        if "phase" in state:
+            self.phases.append(state["phase"])
+
+
+class TestRunOpenSCAD:
+    """Tests for run_openscad function."""
+
+    def test_too_large(self, monkeypatch):
+        """Test that builds estimated to be too long are refused without running."""
+        cost_model = CostModel()
+        cost_model.record(BuildJob("tile.scad:stl", 1), 1)
+        monkeypatch.setattr(server.openscad, "admission", AdmissionControl(1, 10, 0))
+        monkeypatch.setattr(server.openscad, "cost_model", cost_model)
+        with pytest.raises(BuildTooLarge):
+            asyncio.run(run_openscad(["false"], "Model generation failed", BuildJob("tile.scad:stl", 11)))
+
+    def test_not_sampled(self, monkeypatch):
+        """Test that builds are not refused as too large on estimates from other models."""
+        cost_model = CostModel()
+        cost_model.record(BuildJob("hook.scad:stl", 1), 1)
+        monkeypatch.setattr(server.openscad, "admission", AdmissionControl(1, 10, 0))
+        monkeypatch.setattr(server.openscad, "cost_model", cost_model)
+        with pytest.raises(ModelError):
+            asyncio.run(run_openscad(["false"], "Model generation failed", BuildJob("tile.scad:stl", 11)))
+
+    def test_queue_full(self, monkeypatch):
+        """Test that builds are refused with a retry time while the queue is full."""
+        admission = AdmissionControl(1, 0, 10)
+        admission.queued_seconds = 30
+        monkeypatch.setattr(server.openscad, "admission", admission)
+        with pytest.raises(BuildQueueFull) as excinfo:
+            asyncio.run(run_openscad(["false"], "Model generation failed", BuildJob("tile.scad:stl", 1)))
+        assert excinfo.value.retry_after == 30
+
+
+class TestRunOpenSCADProcess:
+    """Tests for run_openscad function running real processes."""
+
+    @pytest.fixture(autouse=True)
+    def semaphore(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(server.openscad, "build_semaphore", HostSemaphore(tmp_path / "slots", 1))
+
+    def test_output(self):
+        """Test that the output of the process is returned."""
+        assert asyncio.run(run_openscad(["sh", "-c", "echo solid"], "Model generation failed")) == b"solid\n"
+
+    def test_large_output_spooled(self, monkeypatch):
+        """Test that output past the streaming threshold is spooled and returned mapped."""
+        monkeypatch.setattr(server.settings, "stream_min_bytes", 1024)
+        output = asyncio.run(run_openscad(["head", "-c", "1000000", "/dev/zero"], "Model generation failed"))
+        assert isinstance(output, mmap.mmap)
+        assert output[:] == bytes(1000000)
+
+    def test_phases(self):
+        """Test that the phases OpenSCAD logs are reported."""
+        recorder = PhaseRecorder()
+        script = "echo 'Parsing design (AST generation)...' >&2; echo 'Rendering Polygon Mesh' >&2; sleep 0.1; echo solid"
+        asyncio.run(progress.tracked(recorder, run_openscad(["sh", "-c", script], "Model generation failed")))
+        assert recorder.phases == ["queued", "evaluating", "evaluating", "rendering", "exporting"]
+        assert recorder.state["position"] == 0
+
+    def test_model_error(self):
+        """Test that a failing model raises ModelError."""
+        with pytest.raises(ModelError):
+            asyncio.run(run_openscad(["sh", "-c", "echo ERROR >&2; exit 1"], "Model generation failed"))
+
+    def test_timeout(self, monkeypatch):
+        """Test that a build running past the timeout is killed."""
+        monkeypatch.setattr(server.settings, "build_timeout", 0.1)
+        with pytest.raises(BuildTimeout):
+            asyncio.run(run_openscad(["sleep", "10"], "Model generation failed"))
+
+    def test_out_of_memory(self):
+        """Test that allocation failures raise BuildOutOfMemory."""
+        with pytest.raises(BuildOutOfMemory):
+            asyncio.run(
+                run_openscad(["sh", "-c", "echo std::bad_alloc >&2; exit 134"], "Model generation failed")
+            )
+
+
+class TestBuildFailure:
+    """Tests for build_failure function."""
+
+    def test_cpu_limit(self):
+        """Test that hitting the CPU time limit counts as a timeout."""
+        assert isinstance(build_failure(-signal.SIGXCPU, "", "Failed"), BuildTimeout)
+
+    def test_killed(self):
+        """Test that a build killed by something else is not taken for running out of memory or remembered."""
+        error = build_failure(-signal.SIGKILL, "", "Failed")
+        assert isinstance(error, BuildKilled)
+        assert not error.remember
+
+    def test_oom_killed(self):
+        """Test that a build killed while the OOM killer ran counts as out of memory but is not remembered."""
+        error = build_failure(-signal.SIGKILL, "", "Failed", oom_killed=True)
+        assert isinstance(error, BuildOutOfMemory)
+        assert not error.remember
+
+    def test_out_of_memory(self):
+        """Test that a build that fails to allocate memory counts as out of memory."""
+        error = build_failure(1, "terminate called after throwing an instance of 'std::bad_alloc'", "Failed")
+        assert isinstance(error, BuildOutOfMemory)
+        assert error.remember
+
+    def test_model_error(self):
+        """Test that other failures are model errors."""
+        error = build_failure(1, "ERROR: Assertion failed", "Failed")
+        assert isinstance(error, ModelError)
+        assert str(error) == "Failed"
+
+
+class TestBuild:
+    """Tests for build function."""
+
+    def test_concurrent_builds_coalesced(self, openscad_runs):
+        """Test that concurrent identical builds only run OpenSCAD once."""
+        async def main():
+            return await asyncio.gather(
+                build("tile.scad", columns=4, rows=4),
+                build("tile.scad", columns=4.0, rows=4),
+            )
+
+        first, second = asyncio.run(main())
+        assert first == second
+        assert len(openscad_runs) == 1
+
+    def test_quality(self, openscad_runs):
+        """Test that preview builds lower the resolution and are cached separately."""
+        asyncio.run(build("tile.scad", columns=4, rows=4))
+        asyncio.run(build("tile.scad", quality="preview", columns=4, rows=4))
+        assert len(openscad_runs) == 2
+        assert "$fa=6" in openscad_runs[1]
+        assert "$plain_threads=true" in openscad_runs[1]
+        assert not any(arg.startswith("$") for arg in openscad_runs[0])
+
+    def test_progress_followed(self, openscad_runs):
+        """Test that a request follows the progress of the artifacts it waits for."""
+        recorder = PhaseRecorder()
+
+        async def main():
+            progress.current.set(recorder)
+            await export("tile.scad", "obj", columns=4, rows=4)
+
+        asyncio.run(main())
+        # Converting the build. Compressed variants are made in the background
+        assert recorder.phases[-1] == "exporting"
+        assert "compressing" not in recorder.phases
+
+    def test_memory_cache_hit(self, openscad_runs):
+        """Test that a repeated build is served from memory."""
+        asyncio.run(build("tile.scad", columns=4, rows=4))
+        asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert len(openscad_runs) == 1
+        assert server.openscad.stl_memory_cache.hits == 1
+
+    def test_disk_cache_hit(self, openscad_runs, monkeypatch):
+        """Test that a build is served from disk after the memory cache is lost."""
+        asyncio.run(build("tile.scad", columns=4, rows=4))
+        monkeypatch.setattr(server.openscad, "stl_memory_cache", MemoryCache(max_bytes=1024 * 1024))
+        asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert len(openscad_runs) == 1
+        assert server.openscad.disk_cache.hits == 1
+
+    def test_shared_cache_hit(self, openscad_runs, monkeypatch, tmp_path):
+        """Test that a build by another worker is served from shared memory."""
+        monkeypatch.setattr(server.openscad, "shared_cache", SharedCache(tmp_path / "shared", max_bytes=1024 * 1024))
+        first = asyncio.run(build("tile.scad", columns=4, rows=4))
+        monkeypatch.setattr(server.openscad, "stl_memory_cache", MemoryCache(max_bytes=1024 * 1024))
+        monkeypatch.setattr(server.openscad, "disk_cache", DiskCache(tmp_path / "other", max_bytes=0))
+        second = asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert bytes(first) == bytes(second)
+        assert len(openscad_runs) == 1
+        assert server.openscad.shared_cache.hits == 1
+
+    def test_single_flight_between_workers(self, openscad_runs):
+        """Test that a worker waits for another worker building the same artifact."""
+        async def main():
+            # Bypass the in-process coalescing as if the calls came from two workers
+            def run():
+                return server.openscad.run_openscad(["openscad"], "Model generation failed")
+
+            return await asyncio.gather(cached_run("abcdef", "stl", run), cached_run("abcdef", "stl", run))
+
+        first, second = asyncio.run(main())
+        assert bytes(first) == bytes(second)
+        assert len(openscad_runs) == 1
+
+    def test_cancelled_when_nobody_waits(self, monkeypatch, openscad_runs):
+        """Test that the build is stopped when the last waiting request goes away."""
+        cancelled = []
+
+        async def run_openscad(cmd, error_message, job=None):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(cmd)
+                raise
+
+        monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+
+        async def main():
+            task = asyncio.create_task(build("tile.scad", columns=4, rows=4))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.sleep(0.05)
+
+        asyncio.run(main())
+        assert len(cancelled) == 1
+        assert server.openscad.inflight == {}
+
+    def test_kept_while_others_wait(self, openscad_runs):
+        """Test that the build continues when one of several waiting requests goes away."""
+        async def main():
+            first = asyncio.create_task(build("tile.scad", columns=4, rows=4))
+            second = asyncio.create_task(build("tile.scad", columns=4, rows=4))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second
+
+        assert asyncio.run(main()).startswith(b"solid")
+        assert len(openscad_runs) == 1
+
+    def test_failure_remembered(self, monkeypatch, openscad_runs):
+        """Test that a failed build is not run again while the failure is remembered."""
+        async def run_openscad(cmd, error_message, job=None):
+            openscad_runs.append(cmd)
+            raise ModelError(error_message, "ERROR: Assertion failed")
+
+        monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+
+        for _ in range(2):
+            with pytest.raises(ModelError) as excinfo:
+                asyncio.run(build("tile.scad", columns=4, rows=4))
+            assert str(excinfo.value) == "Model generation failed"
+            assert excinfo.value.stderr == "ERROR: Assertion failed"
+        assert len(openscad_runs) == 1
+
+    def test_killed_not_remembered(self, monkeypatch, openscad_runs):
+        """Test that builds that were killed are retried."""
+        async def run_openscad(cmd, error_message, job=None):
+            openscad_runs.append(cmd)
+            raise build_failure(-signal.SIGKILL, "", error_message, oom_killed=True)
+
+        monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+
+        for _ in range(2):
+            with pytest.raises(BuildOutOfMemory):
+                asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert len(openscad_runs) == 2
+
+    def test_load_failures_not_remembered(self, monkeypatch, openscad_runs):
+        """Test that builds refused because of load are retried."""
+        async def run_openscad(cmd, error_message, job=None):
+            openscad_runs.append(cmd)
+            raise BuildQueueFull(error_message, 10)
+
+        monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+
+        for _ in range(2):
+            with pytest.raises(BuildQueueFull):
+                asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert len(openscad_runs) == 2
+
+
+async def precompressed(artifact: Awaitable[bytes]) -> bytes:
+    """Wait for an artifact and the compressed variants made of it in the background."""
+    data = await artifact
+    await asyncio.gather(*server.openscad.precompressions.values())
+    return data
+
+
+class TestCompressedArtifacts:
+    """Tests for compressed variants of artifacts."""
+
+    def test_compressed_build(self, openscad_runs):
+        """Test that a compressed build decompresses to the plain build."""
+        compressed = asyncio.run(build("tile.scad", encoding="gzip", columns=4, rows=4))
+        plain = asyncio.run(build("tile.scad", columns=4, rows=4))
+        assert gzip.decompress(compressed) == plain
+        assert len(openscad_runs) == 1
+
+    def test_compressed_when_cached(self, openscad_runs):
+        """Test that every variant is stored when the artifact is first cached."""
+        asyncio.run(precompressed(build("tile.scad", columns=4, rows=4)))
+        key = artifact_key("tile.scad", "binstl", canonicalize_params({"columns": 4, "rows": 4}))
+        for encoding in compression.encoders:
+            assert server.openscad.disk_cache.get(f"{key}.{encoding}", "stl") is not None
+
+    def test_not_compressed_again(self, openscad_runs, monkeypatch):
+        """Test that requesting a variant uses the one stored when the artifact was cached."""
+        asyncio.run(precompressed(build("tile.scad", columns=4, rows=4)))
+        monkeypatch.setattr(compression, "encoders", {})
+        assert asyncio.run(build("tile.scad", encoding="gzip", columns=4, rows=4))
+
+    def test_not_waiting_for_variants(self, openscad_runs, monkeypatch):
+        """Test that the artifact is returned before the variants are made and each is only made once."""
+        release = threading.Event()
+        compressed = []
+
+        def slow(data):
+            release.wait(5)
+            compressed.append(data)
+            return gzip.compress(data)
+
+        monkeypatch.setattr(compression, "encoders", {"gzip": slow, "slow": slow})
+
+        async def main():
+            plain = await build("tile.scad", columns=4, rows=4)
+            assert not compressed
+            release.set()
+            variant = await build("tile.scad", encoding="gzip", columns=4, rows=4)
+            assert gzip.decompress(variant) == plain
+            await asyncio.gather(*server.openscad.precompressions.values())
+
+        asyncio.run(main())
+        assert len(compressed) == 2
+
+    def test_screenshots_not_compressed(self, openscad_runs):
+        """Test that formats compressed already are not compressed again."""
+        asyncio.run(server.openscad.render_screenshot("tile.scad", columns=4, rows=4))
+        assert len(server.openscad.disk_cache.entries()) == 1
+
+
+class TestExport:
+    """Tests for export function."""
+
+    @pytest.fixture(autouse=True)
+    def stl(self, monkeypatch, openscad_runs):
+        triangles = np.array([[[0, 0, 0], [1, 0, 0], [1, 1, 0]]], dtype=np.float32)
+
+        async def run_openscad(cmd, error_message, job=None):
+            openscad_runs.append(cmd)
+            return mesh.write_binary_stl(triangles)
+
+        monkeypatch.setattr(server.openscad, "run_openscad", run_openscad)
+
+    def test_binary_stl_requested(self, openscad_runs):
+        """Test that OpenSCAD is asked for binary STL."""
+        asyncio.run(export("tile.scad", "binstl", columns=4, rows=4))
+        assert openscad_runs[0][openscad_runs[0].index("--export-format") + 1] == "binstl"
+
+    def test_formats_share_build(self, openscad_runs):
+        """Test that every format is converted from a single OpenSCAD build."""
+        async def main():
+            return await asyncio.gather(
+                *(export("tile.scad", export_format, columns=4, rows=4) for export_format in ("binstl", "obj", "3mf"))
+            )
+
+        binstl, obj, threemf = asyncio.run(main())
+        assert len(openscad_runs) == 1
+        assert obj.startswith(b"v ")
+        assert threemf.startswith(b"PK")
+
+    def test_preview_delta(self, openscad_runs):
+        """Test that a delta is worked out against a cached base mesh."""
+        data = asyncio.run(export("tile.scad", "preview", columns=4, rows=4))
+        server.openscad.disk_cache.put("0" * 64, "preview", data)
+        replace, runs, _ = mesh.read_preview_delta(asyncio.run(preview_delta(f"{'0' * 64}.gzip.preview", data)))
+        assert not replace
+        assert runs.tolist() == [[0, 1]]
+
+    def test_preview_delta_base_evicted(self, openscad_runs):
+        """Test that the delta replaces the base when it is no longer cached."""
+        data = asyncio.run(export("tile.scad", "preview", columns=4, rows=4))
+        replace, _, added = mesh.read_preview_delta(asyncio.run(preview_delta(f"{'0' * 64}.preview", data)))
+        assert replace
+        assert added == data
+
+    def test_formats_cached_separately(self, openscad_runs):
+        """Test that converted formats are cached and not converted again."""
+        first = asyncio.run(export("tile.scad", "asciistl", columns=4, rows=4))
+        second = asyncio.run(export("tile.scad", "asciistl", columns=4, rows=4))
+        assert first == second
+        assert server.openscad.stl_memory_cache.hits == 1
@@ -0,0 +1,56 @@
+"""Tests for server.progress module."""
+
+import asyncio
+
+from server import progress
+from server.progress import Progress
+
+
+class TestProgress:
+    """Tests for Progress."""
+
+    def test_followers_updated(self):
+        """Test that updates are passed on to followers and their followers."""
+        async def main():
+            build, export, request = Progress(), Progress(), Progress()
+            export.follow(build)
+            request.follow(export)
+            build.update(phase="rendering")
+            return request.state
+
+        assert asyncio.run(main()) == {"phase": "rendering"}
+
+    def test_follow_takes_current_state(self):
+        """Test that a new follower starts from the current state."""
+        async def main():
+            build, request = Progress(), Progress()
+            build.update(phase="evaluating", position=0)
+            request.follow(build)
+            return request.state
+
+        assert asyncio.run(main()) == {"phase": "evaluating", "position": 0}
+
+    def test_snapshot_remaining(self):
+        """Test that the estimate is sent as seconds remaining."""
+        async def main():
+            state = Progress()
+            state.update(finish_by=progress.estimate(30))
+            return state.snapshot()
+
+        snapshot = asyncio.run(main())
+        assert "finish_by" not in snapshot
+        assert 29 <= snapshot["remaining"] <= 30
+
+    def test_report(self):
+        """Test that reports go to the progress of the task producing the artifact."""
+        async def produce():
+            progress.report(phase="compressing")
+
+        async def main():
+            state = Progress()
+            await asyncio.ensure_future(progress.tracked(state, produce()))
+            # Outside the task nothing is followed
+            progress.report(phase="exporting")
+            return state.state
+
+        assert asyncio.run(main()) == {"phase": "compressing"}
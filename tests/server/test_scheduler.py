@@ -0,0 +1,184 @@
+"""Tests for server.scheduler module."""
+
+import os
+import resource
+import shutil
+import subprocess
+
+import pytest
+from server.locks import HostSum
+from server.scheduler import (
+    AdmissionControl,
+    BuildJob,
+    BuildScheduler,
+    CostModel,
+    available_cpus,
+    default_max_builds,
+)
+
+
+class TestDefaultMaxBuilds:
+    """Tests for default_max_builds function."""
+
+    def test_one_per_cpu(self):
+        """Test that there is one build per CPU when memory allows."""
+        assert default_max_builds(8, 64 * 1024, 1024) == 8
+
+    def test_limited_by_memory(self):
+        """Test that builds are limited by the available memory."""
+        assert default_max_builds(8, 3 * 1024, 1024) == 3
+
+    def test_unknown_memory(self):
+        """Test that unknown memory does not limit builds."""
+        assert default_max_builds(8, None, 1024) == 8
+
+    def test_at_least_one(self):
+        """Test that at least one build is always allowed."""
+        assert default_max_builds(8, 100, 1024) == 1
+
+
+class TestBuildScheduler:
+    """Tests for BuildScheduler."""
+
+    def test_idle_build_gets_every_cpu(self):
+        """Test that a build on an idle host may use every CPU."""
+        scheduler = BuildScheduler(list(range(8)), 4)
+        assert scheduler.place(0, busy=False) == (8, list(range(8)))
+        assert scheduler.large == 1
+
+    def test_busy_builds_get_their_share(self):
+        """Test that builds on a busy host are given separate CPUs."""
+        scheduler = BuildScheduler(list(range(8)), 4)
+        assert scheduler.place(0, busy=True) == (2, [0, 1])
+        assert scheduler.place(3, busy=True) == (2, [6, 7])
+        assert scheduler.small == 2
+
+    def test_uneven_share(self):
+        """Test that every CPU is used when they do not divide evenly between slots."""
+        scheduler = BuildScheduler(list(range(5)), 2)
+        assert scheduler.slot_cpus(0) + scheduler.slot_cpus(1) == list(range(5))
+
+    def test_more_slots_than_cpus(self):
+        """Test that slots share CPUs when there are more slots than CPUs."""
+        scheduler = BuildScheduler([0, 1], 4)
+        assert all(len(scheduler.slot_cpus(slot)) == 1 for slot in range(4))
+        assert {cpu for slot in range(4) for cpu in scheduler.slot_cpus(slot)} == {0, 1}
+
+    def test_pinning_disabled(self):
+        """Test that no CPU set is given when pinning is disabled."""
+        scheduler = BuildScheduler(list(range(8)), 4, pin=False)
+        assert scheduler.place(1, busy=True) == (2, None)
+
+    @pytest.mark.skipif(shutil.which("prlimit") is None or shutil.which("taskset") is None, reason="No util-linux")
+    def test_limits_applied_before_start(self):
+        """Test that the wrapped command starts with the CPU set and limits applied."""
+        scheduler = BuildScheduler(available_cpus(), 4, cpu_seconds=60, memory_bytes=8 * 1024 * 1024 * 1024)
+        script = "ulimit -t; ulimit -v; grep Cpus_allowed_list /proc/self/status"
+        output = subprocess.run(
+            scheduler.command(["sh", "-c", script], available_cpus()[:1]), capture_output=True, text=True, check=True
+        ).stdout.split()
+        assert output[:2] == ["60", str(8 * 1024 * 1024)]
+        assert output[-1] == str(available_cpus()[0])
+
+    def test_command_without_tools(self):
+        """Test that the command is left alone without taskset and prlimit."""
+        scheduler = BuildScheduler(available_cpus(), 4, cpu_seconds=60, memory_bytes=8 * 1024 * 1024 * 1024)
+        scheduler.taskset = scheduler.prlimit = None
+        assert scheduler.command(["openscad"], available_cpus()[:1]) == ["openscad"]
+
+    def test_limits_applied_to_running_process(self):
+        """Test that the CPU set and limits are applied to a process after it has started without the tools."""
+        scheduler = BuildScheduler(available_cpus(), 4, cpu_seconds=60, memory_bytes=8 * 1024 * 1024 * 1024)
+        scheduler.taskset = scheduler.prlimit = None
+        proc = subprocess.Popen(["sleep", "5"])
+        try:
+            scheduler.apply(proc.pid, available_cpus()[:1])
+            assert os.sched_getaffinity(proc.pid) == set(available_cpus()[:1])
+            assert resource.prlimit(proc.pid, resource.RLIMIT_CPU) == (60, 60)
+            assert resource.prlimit(proc.pid, resource.RLIMIT_AS)[0] == 8 * 1024 * 1024 * 1024
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_limits_on_exited_process(self):
+        """Test that a build process that has already exited is left alone."""
+        proc = subprocess.Popen(["true"])
+        proc.wait()
+        BuildScheduler(available_cpus(), 4, memory_bytes=1024 * 1024 * 1024).apply(proc.pid, None)
+
+    def test_environment(self):
+        """Test that the thread budget is passed in the environment."""
+        scheduler = BuildScheduler(list(range(8)), 4)
+        assert scheduler.environment(2)["OMP_NUM_THREADS"] == "2"
+
+
+class TestCostModel:
+    """Tests for CostModel."""
+
+    def test_default_rate(self):
+        """Test that estimates use the default rate before anything is recorded."""
+        cost_model = CostModel(default_rate=2.0)
+        assert cost_model.estimate(BuildJob("tile.scad:stl", 16)) == 32
+
+    def test_learns_rate(self):
+        """Test that estimates follow recorded durations."""
+        cost_model = CostModel(alpha=0.5)
+        cost_model.record(BuildJob("tile.scad:stl", 4), 8)
+        assert cost_model.estimate(BuildJob("tile.scad:stl", 16)) == 32
+        cost_model.record(BuildJob("tile.scad:stl", 4), 4)
+        assert cost_model.estimate(BuildJob("tile.scad:stl", 1)) == 1.5
+
+    def test_sampled(self):
+        """Test that only kinds that have been built are sampled."""
+        cost_model = CostModel()
+        cost_model.record(BuildJob("tile.scad:stl", 1), 1)
+        assert cost_model.sampled("tile.scad:stl")
+        assert not cost_model.sampled("hook.scad:stl")
+
+    def test_unknown_job_uses_average(self):
+        """Test that kinds not built yet use the average rate of the others."""
+        cost_model = CostModel()
+        cost_model.record(BuildJob("tile.scad:stl", 1), 1)
+        cost_model.record(BuildJob("hook.scad:stl", 1), 3)
+        assert cost_model.estimate(BuildJob("rack.scad:stl", 1)) == 2
+
+
+class TestAdmissionControl:
+    """Tests for AdmissionControl."""
+
+    def test_too_large(self):
+        """Test that builds over the size limit are refused."""
+        admission = AdmissionControl(4, max_build_seconds=60, max_queue_seconds=60)
+        assert not admission.too_large(60)
+        assert admission.too_large(61)
+        assert admission.too_large_count == 1
+
+    def test_busy(self):
+        """Test that builds are refused while the queue would take too long."""
+        admission = AdmissionControl(2, max_build_seconds=0, max_queue_seconds=60)
+        with admission.queued(100):
+            assert not admission.busy()
+            with admission.queued(30):
+                assert admission.expected_wait() == 65
+                assert admission.busy()
+        assert admission.queued_seconds == 0
+        assert not admission.busy()
+
+    def test_disabled(self):
+        """Test that limits of 0 never refuse builds."""
+        admission = AdmissionControl(1, max_build_seconds=0, max_queue_seconds=0)
+        with admission.queued(10000):
+            assert not admission.too_large(10000)
+            assert not admission.busy()
+
+    def test_shared_between_workers(self, tmp_path):
+        """Test that the queues of every worker sharing the slots are counted."""
+        first = AdmissionControl(2, max_build_seconds=0, max_queue_seconds=60, shared=HostSum(tmp_path))
+        second = AdmissionControl(2, max_build_seconds=0, max_queue_seconds=60, shared=HostSum(tmp_path))
+        with first.queued(100):
+            assert second.expected_wait() == 50
+            with second.queued(30):
+                assert first.expected_wait() == 65
+                assert first.busy()
+            assert first.expected_wait() == 50
+        assert second.expected_wait() == 0
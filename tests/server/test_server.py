@@ -4,7 +4,9 @@ import json
 import pytest
 from sanic import Sanic
 
+import server.formats
 import server.server
+from server.openscad import BuildQueueFull, BuildSuperseded, BuildTooLarge
 
 app = server.server.app
 
@@ -35,3 +37,40 @@ def test_openapi_schema(sanic_app):
     # Check if BoltDefinition schema exists
     schemas = data.get("components", {}).get("schemas", {})
     assert "BoltDefinition" in schemas, "BoltDefinition schema should exist"
+
+
+def test_build_queue_full(sanic_app, monkeypatch):
+    """Test that a full build queue returns 503 with Retry-After."""
+    async def export(model_file, export_format, **params):
+        raise BuildQueueFull("Model generation failed: the server is busy", 12.3)
+
+    monkeypatch.setattr(server.formats, "export", export)
+    _, response = sanic_app.test_client.post("/api/hook", json={})
+
+    assert response.status == 503
+    assert response.headers["Retry-After"] == "13"
+    assert response.json["message"] == "Model generation failed: the server is busy"
+
+
+def test_build_too_large(sanic_app, monkeypatch):
+    """Test that builds over the size limit return 422."""
+    async def export(model_file, export_format, **params):
+        raise BuildTooLarge("Model generation failed: the model is too large to build")
+
+    monkeypatch.setattr(server.formats, "export", export)
+    _, response = sanic_app.test_client.post("/api/hook", json={})
+
+    assert response.status == 422
+    assert "Retry-After" not in response.headers
+
+
+def test_build_superseded(sanic_app, monkeypatch):
+    """Test that previews replaced by a newer one return 409."""
+    async def export(model_file, export_format, **params):
+        raise BuildSuperseded("A newer preview was requested")
+
+    monkeypatch.setattr(server.formats, "export", export)
+    _, response = sanic_app.test_client.post("/api/hook", json={})
+
+    assert response.status == 409
+    assert response.json["code"] == "build_superseded"
@@ -0,0 +1,27 @@
+"""Tests for server.spool module."""
+
+import mmap
+
+from server.spool import Spool
+
+
+class TestSpool:
+    """Tests for Spool."""
+
+    def test_small(self):
+        """Test that small values stay in memory."""
+        with Spool(1024) as spool:
+            spool.write(b"solid ")
+            spool.write(memoryview(b"model"))
+            assert spool.file is None
+            assert spool.getvalue() == b"solid model"
+
+    def test_large(self):
+        """Test that values past the limit are moved to a file and returned mapped."""
+        with Spool(4) as spool:
+            spool.write(b"sol")
+            spool.write(b"id ")
+            spool.write(b"model")
+            value = spool.getvalue()
+        assert isinstance(value, mmap.mmap)
+        assert value[:] == b"solid model"